@@ -0,0 +1,180 @@
+"""
+Filename: bench.py
+
+Author: mg4news
+
+Date: 2025-09-20
+
+License: Unlicense
+
+Description:
+    Benchmarks every pipeline stage on synthetic vaults, and compares the results with a stored
+    baseline. Runs offline on a plain machine; the PDF stage only runs if pandoc is installed and
+    --pdf is given.
+
+    python benchmarks/bench.py --sizes 20 200 --save-baseline benchmarks/baseline.json
+    python benchmarks/bench.py --sizes 20 200 --baseline benchmarks/baseline.json --threshold 0.25
+"""
+
+import argparse
+import json
+import logging
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from synthvault import default_spec, generate_vault  # noqa: E402
+from textwrench.pathmgr import PathMgr  # noqa: E402
+from textwrench.contentcache import shared_cache  # noqa: E402
+from textwrench.mdbuilder import assemble  # noqa: E402
+from textwrench.document import Document  # noqa: E402
+from textwrench.tocbuilder import build_toc  # noqa: E402
+from textwrench.imgfix import resolve_image_links  # noqa: E402
+from textwrench.pdfbuilder import PdfBuilder  # noqa: E402
+
+_TEMPLATES = Path(__file__).resolve().parent.parent / "templates"
+
+
+def _time(func: Callable, repeat: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return {"min": min(samples), "median": statistics.median(samples)}
+
+
+def bench_vault(root: Path, spec: dict, repeat: int, pdf: bool) -> Dict[str, Dict[str, float]]:
+    """
+    Generates a vault and times each stage on it.
+
+    Returns:
+        stage name -> {"min": seconds, "median": seconds}
+    """
+    main = generate_vault(root, spec)
+    fmgr = PathMgr(main.parent)
+    results: Dict[str, Dict[str, float]] = {}
+
+    results["vault_index"] = _time(lambda: fmgr.index_vault(), repeat)
+    lines = fmgr.read_lines(main.name)
+    results["assemble"] = _time(lambda: assemble(lines, fmgr), repeat)
+    assembled = assemble(lines, fmgr)
+    results["classify"] = _time(lambda: Document(assembled), repeat)
+    results["build_toc"] = _time(lambda: build_toc(assembled), repeat)
+    md_dir = str(fmgr.get_resolved_path())
+    results["resolve_image_links"] = _time(lambda: resolve_image_links(assembled, md_dir), repeat)
+    final = resolve_image_links(build_toc(assembled), md_dir)
+
+    chapters = sorted(p for p in root.rglob("*.md"))
+
+    def read_uncached():
+        # The file I/O itself, not hits in the content cache that assemble just filled
+        shared_cache().clear()
+        return [fmgr.read_lines(str(p)) for p in chapters]
+
+    results["pathmgr_read"] = _time(read_uncached, repeat)
+    results["pathmgr_read_cached"] = _time(
+        lambda: [fmgr.read_lines(str(p)) for p in chapters], repeat
+    )
+    results["pathmgr_write"] = _time(lambda: fmgr.write_lines("main_work.md", final), repeat)
+
+    if pdf:
+        builder = PdfBuilder(fmgr)
+        results["pdf"] = _time(
+            lambda: builder.convert_lines_to_pdf(
+                final,
+                "main.pdf",
+                str(_TEMPLATES / "standard.css"),
+                str(_TEMPLATES / "default.html5"),
+            ),
+            1,
+        )
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """
+    Compares results with a baseline.
+
+    Returns:
+        a list of regression descriptions, empty if there are none
+    """
+    regressions = []
+    for size, stages in results["runs"].items():
+        for stage, timing in stages.items():
+            base = baseline.get("runs", {}).get(size, {}).get(stage)
+            if not base or base["min"] <= 0:
+                continue
+            change = timing["min"] / base["min"] - 1
+            if change > threshold:
+                regressions.append(
+                    f"{size}/{stage}: {base['min'] * 1000:.2f} ms -> "
+                    f"{timing['min'] * 1000:.2f} ms (+{change:.0%})"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the textwrench pipeline stages")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 200], help="chapter counts")
+    parser.add_argument("--depth", type=int, default=2, help="chapter nesting depth")
+    parser.add_argument("--headings", type=int, default=6, help="headings per chapter")
+    parser.add_argument("--images", type=int, default=1, help="image links per chapter")
+    parser.add_argument("--comments", type=int, default=1, help="comment blocks per chapter")
+    parser.add_argument("--fences", type=int, default=1, help="code fences per chapter")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per stage")
+    parser.add_argument("--pdf", action="store_true", help="also time PdfBuilder (needs pandoc)")
+    parser.add_argument("--output", type=str, help="write the results to this JSON file")
+    parser.add_argument("--save-baseline", type=str, help="store the results as the baseline")
+    parser.add_argument("--baseline", type=str, help="compare with this baseline")
+    parser.add_argument(
+        "--threshold", type=float, default=0.25, help="flag slowdowns above this ratio"
+    )
+    args = parser.parse_args()
+
+    logging.getLogger("textwrench").setLevel(logging.WARNING)
+    pdf = args.pdf and shutil.which("pandoc") is not None
+    if args.pdf and not pdf:
+        print("pandoc not found, skipping the PDF stage")
+
+    results = {"python": platform.python_version(), "machine": platform.machine(), "runs": {}}
+    for size in args.sizes:
+        spec = default_spec(
+            chapters=size,
+            depth=args.depth,
+            headings=args.headings,
+            images=args.images,
+            comments=args.comments,
+            fences=args.fences,
+        )
+        with tempfile.TemporaryDirectory(prefix="textwrench-bench-") as tmp:
+            stages = bench_vault(Path(tmp), spec, args.repeat, pdf)
+        results["runs"][str(size)] = stages
+        for stage, timing in stages.items():
+            print(f"{size:>6} chapters  {stage:<22} {timing['min'] * 1000:10.2f} ms")
+
+    for filename in filter(None, (args.output, args.save_baseline)):
+        with open(filename, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {filename}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
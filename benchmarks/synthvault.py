@@ -0,0 +1,154 @@
+"""
+Filename: synthvault.py
+
+Author: mg4news
+
+Date: 2025-09-20
+
+License: Unlicense
+
+Description:
+    Generates synthetic Obsidian vaults for benchmarking, modelled on the data/document-*.md
+    templates: a main document with a comment header, a TOC marker and page breaks, linking chapter
+    documents that can link sub-chapters in turn. Chapters contain headings, paragraphs, image links,
+    comment blocks and code fences. Output is deterministic for a given set of parameters.
+"""
+
+import random
+import struct
+import zlib
+from pathlib import Path
+from typing import List, TypedDict
+
+_LOREM = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt "
+    "ut labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco "
+    "laboris nisi ut aliquip ex ea commodo consequat.\n"
+)
+_PAGE_BREAK = [
+    "<!---------------------------------------------------------------------------------------\n",
+    "Generate a page break in PDF output\n",
+    "---------------------------------------------------------------------------------------->\n",
+    '<div style="page-break-after: always;"></div>\n',
+    "\n",
+    "---\n",
+]
+
+
+class VaultSpec(TypedDict):
+    chapters: int
+    depth: int
+    headings: int
+    paragraphs: int
+    images: int
+    comments: int
+    fences: int
+    seed: int
+
+
+def default_spec(**overrides) -> VaultSpec:
+    """
+    Returns a vault specification with defaults, updated with any overrides.
+    """
+    spec = VaultSpec(
+        chapters=20, depth=2, headings=6, paragraphs=2, images=1, comments=1, fences=1, seed=0
+    )
+    spec.update(overrides)
+    return spec
+
+
+def _png(width: int, height: int, seed: int) -> bytes:
+    """A small, valid, solid colour RGB PNG."""
+
+    def chunk(tag: bytes, data: bytes) -> bytes:
+        body = tag + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body))
+
+    pixel = bytes(((seed * 37) % 256, (seed * 91) % 256, (seed * 53) % 256))
+    raw = b"".join(b"\x00" + pixel * width for _ in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", header)
+        + chunk(b"IDAT", zlib.compress(raw))
+        + chunk(b"IEND", b"")
+    )
+
+
+def _chapter(name: str, level: int, spec: VaultSpec, rng: random.Random, images: List[str]) -> List[str]:
+    lines = [
+        "<!--\n",
+        f'title: "{name}"\n',
+        'author: "textwrench benchmark"\n',
+        "-->\n",
+        f"# {name}\n",
+        "\n",
+    ]
+    for h in range(spec["headings"]):
+        depth = 2 + min(h % 3, 1) + (1 if level > 0 and h % 4 == 3 else 0)
+        lines += [f"{'#' * depth} {name} Section {h + 1}\n", "\n"]
+        lines += [_LOREM, "\n"] * spec["paragraphs"]
+    for c in range(spec["comments"]):
+        lines += ["<!--\n", f"Comment {c} in {name}\n", "# not a heading\n", "-->\n"]
+    for f in range(spec["fences"]):
+        lines += ["```python\n", "# not a heading either\n", f"x = {f}\n", "```\n", "\n"]
+    for _ in range(spec["images"]):
+        image = rng.choice(images)
+        lines += [f"![Figure]({image})\n", "\n"]
+    return lines
+
+
+def generate_vault(root: str | Path, spec: VaultSpec) -> Path:
+    """
+    Writes a synthetic vault.
+
+    Args:
+        root (str or Path object): the vault directory (created if needed)
+        spec (VaultSpec): the vault parameters. `chapters` is the number of top level chapters,
+            each of which links sub-chapters down to `depth` levels.
+
+    Returns:
+        the path of the main document
+    """
+    root = Path(root)
+    (root / ".obsidian").mkdir(parents=True, exist_ok=True)
+    (root / "images").mkdir(exist_ok=True)
+    rng = random.Random(spec["seed"])
+
+    images = []
+    for i in range(max(1, min(spec["images"] * 4, 50))):
+        name = f"images/figure-{i}.png"
+        (root / name).write_bytes(_png(32, 24, i))
+        images.append(name)
+
+    main = [
+        "<!--\n",
+        'title: "Synthetic Document"\n',
+        "-->\n",
+        "![Logo](images/figure-0.png)\n",
+        "\n",
+        *_PAGE_BREAK,
+        "```toc\n",
+        "min_depth: 1\n",
+        "max_depth: 3\n",
+        "```\n",
+        *_PAGE_BREAK,
+    ]
+    for c in range(spec["chapters"]):
+        name = f"chapter-{c:04d}"
+        main += [f"[[{name}]]\n", "\n", *_PAGE_BREAK]
+        pending = [(name, 0, root / "chapters")]
+        while pending:
+            doc, level, folder = pending.pop()
+            folder.mkdir(parents=True, exist_ok=True)
+            # Image links are relative to the main document, which the chapters are assembled into
+            lines = _chapter(doc, level, spec, rng, images)
+            if level + 1 < spec["depth"]:
+                child = f"{doc}-{level + 1}"
+                lines += [f"[[{child}]]\n", "\n"]
+                pending.append((child, level + 1, folder / doc))
+            (folder / f"{doc}.md").write_text("".join(lines))
+
+    main_path = root / "main.md"
+    main_path.write_text("".join(main))
+    return main_path
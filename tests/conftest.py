@@ -0,0 +1,23 @@
+import pytest
+from pathlib import Path
+from typing import List
+from textwrench import PathMgr
+
+
+def toc_marker(min_depth: int = 1, max_depth: int = 2) -> List[str]:
+    """The lines of a TOC plugin marker block."""
+    return ["```toc\n", f"min_depth: {min_depth}\n", f"max_depth: {max_depth}\n", "```\n"]
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache_dir(tmp_path_factory: pytest.TempPathFactory, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Keeps the textwrench cache directory out of the user's home directory during tests."""
+    cache = tmp_path_factory.mktemp("cache")
+    monkeypatch.setenv("TEXTWRENCH_CACHE_DIR", str(cache))
+    return cache
+
+
+@pytest.fixture
+def path_manager(tmp_path: Path) -> PathMgr:
+    """Provides a PathMgr instance with a temporary directory for each test."""
+    return PathMgr(relative_dir=str(tmp_path))
@@ -0,0 +1,70 @@
+import importlib.metadata
+import os
+import pytest
+from pathlib import Path
+from textwrench import artifactcache
+from textwrench.artifactcache import ArtifactCache, tool_version
+
+
+def test_store_and_fetch(tmp_path: Path):
+    """Test that an artifact stored under a key is returned for identical inputs only."""
+    cache = ArtifactCache(tmp_path / "cache")
+    css = tmp_path / "style.css"
+    css.write_text("body {}")
+    key = cache.key(["# Title\n"], [str(css)], [])
+    assert key == cache.key(["# Title\n"], [str(css)], [])
+
+    out = tmp_path / "doc.pdf"
+    assert not cache.fetch(key, out)
+    out.write_bytes(b"%PDF")
+    cache.store(key, out)
+    out.unlink()
+
+    assert cache.fetch(key, out)
+    assert out.read_bytes() == b"%PDF"
+    css.write_text("body { color: red; }")
+    assert cache.key(["# Title\n"], [str(css)], []) != key
+
+
+def test_evict_by_size_and_age(tmp_path: Path):
+    """Test that expired entries and least recently used entries are evicted."""
+    cache = ArtifactCache(tmp_path, max_bytes=10, max_age=100)
+    old, lru, new = (tmp_path / f"{n}.pdf" for n in ("old", "lru", "new"))
+    for path in (old, lru, new):
+        path.write_bytes(b"x" * 6)
+    os.utime(old, (0, 0))
+    stamp = os.stat(new).st_mtime
+    os.utime(lru, (stamp - 10, stamp - 10))
+
+    cache.evict()
+
+    assert not old.exists()
+    assert not lru.exists()
+    assert new.exists()
+
+
+@pytest.mark.skipif(os.name != "posix", reason="needs an executable shell script")
+def test_tool_versions_do_not_run_tools_on_every_start(tmp_path: Path, monkeypatch):
+    """Test that tool versions are cached on disk until the tool changes, or come from metadata."""
+    runs = tmp_path / "runs"
+    tool = tmp_path / "bin" / "fakepandoc"
+    tool.parent.mkdir()
+    tool.write_text(f"#!/bin/sh\necho run >> {runs}\necho 'fakepandoc 3.1'\n")
+    tool.chmod(0o755)
+    monkeypatch.setenv("PATH", str(tool.parent), prepend=os.pathsep)
+    monkeypatch.setattr(importlib.metadata, "version", lambda name: "62.3")
+
+    for _ in range(2):
+        # A new process: nothing cached in memory
+        tool_version.cache_clear()
+        assert tool_version("fakepandoc") == "fakepandoc 3.1"
+    assert runs.read_text().count("run") == 1
+
+    tool.write_text(tool.read_text().replace("3.1", "3.2.1"))
+    tool_version.cache_clear()
+    assert tool_version("fakepandoc") == "fakepandoc 3.2.1"
+    assert runs.read_text().count("run") == 2
+
+    assert tool_version("weasyprint") == "weasyprint 62.3"
+    assert artifactcache._executable_version("no-such-tool") == "missing"
+    tool_version.cache_clear()
@@ -0,0 +1,61 @@
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from textwrench.batch import collect_inputs, run_batch, summarize
+
+
+def _build(args):
+    if "fail" in args.inp:
+        raise ValueError("broken document")
+    if "hang" in args.inp:
+        time.sleep(60)
+    Path(args.inp).with_suffix(".pdf").touch()
+
+
+def _pooled_build(args):
+    # Like a sharded weasyprint render, which renders its shards on a process pool
+    with ProcessPoolExecutor(2) as pool:
+        assert list(pool.map(abs, [-1, -2])) == [1, 2]
+    Path(args.inp).with_suffix(".pdf").touch()
+
+
+def test_collect_inputs(tmp_path: Path):
+    """Test that directories, globs and manifests are expanded and de-duplicated."""
+    (tmp_path / "sub").mkdir()
+    for name in ("a.md", "b.md", "a_work.md", "sub/c.md", "sub/d.txt"):
+        (tmp_path / name).touch()
+    manifest = tmp_path / "list.txt"
+    manifest.write_text("# documents\nsub/c.md\na.md\n")
+
+    inputs = collect_inputs([str(tmp_path), str(tmp_path / "**" / "*.md"), f"@{manifest}"])
+
+    assert [p.name for p in inputs] == ["a.md", "b.md", "c.md"]
+
+
+def test_run_batch(tmp_path: Path):
+    """Test that jobs succeed, fail with retries and time out independently."""
+    inputs = [tmp_path / n for n in ("ok.md", "fail.md", "hang.md")]
+    args = argparse.Namespace(inp=None)
+
+    results = run_batch(inputs, args, _build, jobs=3, timeout=1, retries=1, mem_per_job=0)
+
+    assert [r["status"] for r in results] == ["ok", "failed", "timeout"]
+    assert results[1]["attempts"] == 2
+    assert "broken document" in results[1]["error"]
+    assert (tmp_path / "ok.pdf").exists()
+    assert args.inp is None
+
+    report = tmp_path / "report.json"
+    assert not summarize(results, str(report))
+    assert report.exists()
+
+
+def test_batch_jobs_can_start_process_pools(tmp_path: Path):
+    """Test that a batch job can render on a process pool of its own (e.g. --shards N)."""
+    inputs = [tmp_path / n for n in ("a.md", "b.md")]
+
+    results = run_batch(inputs, argparse.Namespace(inp=None), _pooled_build, jobs=2, mem_per_job=0)
+
+    assert [r["status"] for r in results] == ["ok", "ok"], [r["error"] for r in results]
+    assert (tmp_path / "a.pdf").exists() and (tmp_path / "b.pdf").exists()
@@ -0,0 +1,106 @@
+import os
+from pathlib import Path
+from textwrench.__main__ import build_parser, select
+from textwrench.catalog import Catalog, parse_metadata
+
+
+def _vault(root: Path) -> Path:
+    (root / ".obsidian").mkdir(parents=True)
+    (root / "projects").mkdir()
+    (root / "projects" / "alpha.md").write_text(
+        "---\n"
+        "status: active\n"
+        "tags: [patent, Research]\n"
+        "owners:\n"
+        "  - ann\n"
+        "  - bob\n"
+        "---\n"
+        "# Alpha\n"
+        "[[beta#Scope]]\n"
+        "![chart](img/chart.png)\n"
+        "```python\n"
+        "# not a heading\n"
+        "```\n"
+    )
+    (root / "beta.md").write_text(
+        "<!--\n"
+        "status: archived\n"
+        "-->\n"
+        "## Scope\n"
+        "![[diagram.svg|300]]\n"
+        "```mermaid\n"
+        "```\n"
+    )
+    (root / ".trash").mkdir()
+    (root / ".trash" / "old.md").write_text("---\nstatus: active\n---\n")
+    return root
+
+
+def test_parse_metadata():
+    """Test the supported YAML forms."""
+    lines = ["title: 'A: B'\n", "tags: [x, \"y\"]\n", "list:\n", "  - one\n", "nested:\n", "  a: 1\n"]
+    assert parse_metadata(lines) == [("title", "A: B"), ("tags", "x"), ("tags", "y"), ("list", "one")]
+
+
+def test_catalog_contents(tmp_path: Path):
+    """Test that notes, metadata, links, images, headings and fences are cataloged."""
+    root = _vault(tmp_path / "vault")
+    with Catalog(root, tmp_path / "cat.sqlite") as catalog:
+        catalog.refresh()
+        assert len(catalog) == 2
+        alpha = "projects/alpha.md"
+        assert catalog.metadata(alpha) == {
+            "status": ["active"],
+            "tags": ["patent", "Research"],
+            "owners": ["ann", "bob"],
+        }
+        assert catalog.metadata(root / "beta.md") == {"status": ["archived"]}
+        assert catalog.links(alpha) == ["beta"]
+        assert catalog.images(alpha) == ["img/chart.png"]
+        assert catalog.images("beta.md") == ["diagram.svg"]
+        assert [h["text"] for h in catalog.headings(alpha)] == ["Alpha"]
+        assert catalog.fence_langs(alpha) == ["python"]
+
+
+def test_catalog_select(tmp_path: Path):
+    """Test selecting notes by metadata, links, fence language and heading."""
+    root = _vault(tmp_path / "vault")
+    alpha, beta = root / "projects" / "alpha.md", root / "beta.md"
+    with Catalog(root, tmp_path / "cat.sqlite") as catalog:
+        catalog.refresh()
+        assert catalog.select({"status": "ACTIVE"}) == [alpha]
+        assert catalog.select({"status": None}) == [beta, alpha]
+        assert catalog.select({"tags": "research", "owners": "b*"}) == [alpha]
+        assert catalog.select({"tags": "patent", "status": "archived"}) == []
+        assert catalog.select(links_to="beta.md") == [alpha]
+        assert catalog.select(lang="mermaid") == [beta]
+        assert catalog.select(heading="scope") == [beta]
+
+
+def test_catalog_refresh_is_incremental(tmp_path: Path):
+    """Test that only changed notes are parsed again, and deleted notes are removed."""
+    root = _vault(tmp_path / "vault")
+    db = tmp_path / "cat.sqlite"
+    with Catalog(root, db) as catalog:
+        assert catalog.refresh().notes_parsed == 2
+    with Catalog(root, db) as catalog:
+        assert catalog.refresh().notes_parsed == 0
+
+        beta = root / "beta.md"
+        beta.write_text("<!--\nstatus: active\n-->\n")
+        os.utime(beta, ns=(1, 1))
+        (root / "projects" / "alpha.md").unlink()
+        assert catalog.refresh().notes_parsed == 1
+        assert catalog.select({"status": "active"}) == [beta]
+        assert len(catalog) == 1
+        assert catalog.links("projects/alpha.md") == []
+
+
+def test_select_cli(tmp_path: Path, monkeypatch):
+    """Test the --select query, relative to the working directory."""
+    _vault(tmp_path / "vault")
+    monkeypatch.chdir(tmp_path / "vault")
+    args = build_parser().parse_args(["--select", "tags=patent", "--lang", "python"])
+    assert select(args) == ["projects/alpha.md"]
+    args = build_parser().parse_args(["--select", "--links-to", "beta"])
+    assert select(args) == ["projects/alpha.md"]
@@ -0,0 +1,70 @@
+import json
+import pytest
+from pathlib import Path
+from textwrench.__main__ import build_parser, check
+from textwrench.checker import check_document, check_documents, check_files
+from tests.conftest import toc_marker
+
+
+def write(path: Path, lines: list) -> Path:
+    path.write_text("".join(lines), encoding="utf-8")
+    return path
+
+
+def test_clean_document_has_no_diagnostics(tmp_path: Path):
+    """Test that a document whose links, images and anchors all resolve passes."""
+    (tmp_path / "a.png").write_bytes(b"png")
+    write(tmp_path / "chap.md", ["## Chapter\n", "![A](a.png)\n", "See [root](#root).\n"])
+    root = write(tmp_path / "root.md", ["# Root\n", *toc_marker(), "[[chap]]\n", "[up](#chapter)\n"])
+
+    assert check_document(root) == []
+
+
+def test_broken_links_images_and_anchors(tmp_path: Path):
+    """Test that problems are reported in the file, and at the line, where they are."""
+    chap = write(tmp_path / "chap.md", ["## Chapter\n", "![A](gone.png)\n", "[x](#nowhere)\n"])
+    root = write(tmp_path / "root.md", ["# Root\n", "[[chap]]\n", "[[missing]]\n"])
+
+    found = [(d["file"], d["line"], d["check"], d["severity"]) for d in check_document(root)]
+
+    assert found == [
+        (str(chap), 2, "image", "error"),
+        (str(chap), 3, "anchor", "error"),
+        (str(root), None, "toc", "warning"),
+        (str(root), 3, "link", "error"),
+    ]
+
+
+def test_include_cycle_and_malformed_toc(tmp_path: Path):
+    """Test that an include cycle and an unterminated TOC marker are errors."""
+    write(tmp_path / "a.md", ["[[b]]\n"])
+    write(tmp_path / "b.md", ["[[a]]\n"])
+    root = write(tmp_path / "root.md", ["# Root\n", "```toc\n", *["x\n"] * 5, "```\n", "[[a]]\n"])
+
+    checks = {d["check"] for d in check_document(root) if d["severity"] == "error"}
+
+    assert checks == {"include", "toc"}
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_check_documents_in_parallel(tmp_path: Path, jobs: int):
+    """Test that many documents give the same diagnostics serially and in worker processes."""
+    paths = [write(tmp_path / f"doc{n}.md", ["# Doc\n", f"[[note{n}]]\n"]) for n in range(4)]
+    write(tmp_path / "note0.md", ["text\n"])
+
+    diagnostics = check_documents(paths, jobs=jobs, toc=False)
+
+    assert [(d["file"], d["check"]) for d in diagnostics] == [(str(p), "link") for p in paths[1:]]
+
+
+def test_check_cli_prints_json_and_fails_on_errors(tmp_path: Path, monkeypatch, capsys):
+    """Test that --check prints one JSON diagnostic per line, including a missing CSS file."""
+    write(tmp_path / "doc.md", ["# Doc\n", "[[missing]]\n"])
+    monkeypatch.chdir(tmp_path)
+
+    args = build_parser().parse_args(["-i", "doc.md", "--check", "-a", "y", "-j", "1"])
+    assert not check(args)
+
+    diagnostics = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert {d["check"] for d in diagnostics} == {"template", "link"}
+    assert check_files([tmp_path / "doc.md"]) == []
@@ -0,0 +1,62 @@
+import io
+from pathlib import Path
+from textwrench.__main__ import affected, build_parser
+from textwrench.depgraph import DepGraph, missing_names
+
+
+def test_graph_persists_per_root(tmp_path: Path):
+    """Test that roots saved separately load into one graph, and deleted roots are dropped."""
+    graph_dir = tmp_path / "graph"
+    roots = {name: tmp_path / name for name in ("a.md", "b.md", "gone.md")}
+    for path in roots.values():
+        path.write_text("text\n")
+    for name, deps in (("a.md", ["ch1.md", "img.png"]), ("b.md", ["ch1.md"]), ("gone.md", [])):
+        graph = DepGraph()
+        graph.set_deps(str(roots[name]), deps)
+        graph.save(graph_dir, [str(roots[name])])
+    roots["gone.md"].unlink()
+
+    graph = DepGraph.load(graph_dir)
+
+    assert graph.roots() == {str(roots["a.md"]), str(roots["b.md"])}
+    assert graph.affected_roots(["img.png"]) == {str(roots["a.md"])}
+    assert graph.affected_roots(["ch1.md"]) == {str(roots["a.md"]), str(roots["b.md"])}
+    assert len(list(graph_dir.glob("*.json"))) == 2
+
+
+def test_affected_query(tmp_path: Path, monkeypatch):
+    """Test the --affected query with relative paths, and changed files read from stdin."""
+    (tmp_path / "docs").mkdir()
+    for name in ("docs/a.md", "docs/b.md", "docs/ch1.md", "docs/ch2.md"):
+        (tmp_path / name).write_text("text\n")
+    graph = DepGraph()
+    graph.set_deps(str(tmp_path / "docs/a.md"), [str(tmp_path / "docs/ch1.md")])
+    graph.set_deps(str(tmp_path / "docs/b.md"), [str(tmp_path / "docs/ch2.md")])
+    graph.save(tmp_path / "graph")
+    monkeypatch.chdir(tmp_path)
+
+    args = build_parser().parse_args(["--affected", "docs/ch2.md", "--graph", "graph"])
+    assert affected(args) == ["docs/b.md"]
+
+    monkeypatch.setattr("sys.stdin", io.StringIO("docs/ch1.md\nREADME.md\ndocs/b.md\n"))
+    args = build_parser().parse_args(["--affected", "-", "--graph", "graph"])
+    assert affected(args) == ["docs/a.md", "docs/b.md"]
+
+
+def test_creating_a_missing_chapter_affects_the_root(tmp_path: Path, monkeypatch):
+    """Test that a new file named by a dangling link or image affects the roots waiting for it."""
+    (tmp_path / "ch1.md").write_text("![Fig](img/fig.png)\n")
+    root = tmp_path / "book.md"
+    root.write_text("# Book\n[[ch1]]\n[[Ch2#Intro]]\n")
+    deps = {str(root), str(tmp_path / "ch1.md")}
+    graph = DepGraph()
+    graph.set_deps(str(root), deps, missing_names(deps))
+    graph.save(tmp_path / "graph")
+    monkeypatch.chdir(tmp_path)
+
+    (tmp_path / "ch2.md").write_text("text\n")
+    args = build_parser().parse_args(["--affected", "ch2.md", "--graph", "graph"])
+    assert affected(args) == ["book.md"]
+    graph = DepGraph.load(tmp_path / "graph")
+    assert graph.affected_roots([str(tmp_path / "img" / "FIG.png")]) == {str(root)}
+    assert graph.affected_roots([str(tmp_path / "ch1.png"), str(tmp_path / "ch3.md")]) == set()
@@ -0,0 +1,64 @@
+from textwrench.document import CODE, COMMENT, HEADING, WIKILINK, Document
+
+LINES = [
+    "# Title\n",
+    "<!--\n",
+    "# not a heading\n",
+    "-->\n",
+    "```python\n",
+    "# not a heading either\n",
+    "```\n",
+    "[[chapter]]\n",
+    "![img](a.png)\n",
+    "## Section\n",
+]
+
+
+def test_classification():
+    """Test that lines are classified once into blocks, headings, links and images."""
+    doc = Document(LINES)
+
+    assert [(h["line"], h["depth"], h["text"]) for h in doc.headings] == [
+        (0, 1, "Title"),
+        (9, 2, "Section"),
+    ]
+    assert doc.kind(2) & COMMENT and not doc.kind(2) & HEADING
+    assert doc.kind(5) & CODE
+    assert [(f["start"], f["end"], f["lang"]) for f in doc.fences()] == [(4, 6, "python")]
+    assert [link["target"] for link in doc.wiki_links] == ["chapter"]
+    assert doc.image_lines == [8]
+    assert doc.content_lines() == LINES[:1] + LINES[4:]
+
+
+def test_incremental_replace_matches_full_scan():
+    """Test that an edit outside blocks updates the index like a full scan would."""
+    doc = Document(LINES)
+    doc.replace(7, 8, ["### New\n", "text\n", "[[other]]\n"])
+
+    fresh = Document(doc.lines)
+    assert doc.rescans == 0
+    assert doc.headings == fresh.headings
+    assert doc.wiki_links == fresh.wiki_links
+    assert doc.image_lines == fresh.image_lines
+    assert doc.blocks() == fresh.blocks()
+    assert doc.kind(9) & WIKILINK
+
+
+def test_replace_crossing_a_block_rescans():
+    """Test that an edit opening a block re-scans the rest of the document."""
+    doc = Document(LINES)
+    doc.replace(7, 8, ["```\n"])
+
+    assert doc.rescans == 1
+    assert doc.headings == Document(doc.lines).headings
+    assert doc.wiki_links == []
+
+
+def test_rewrite_inside_block_does_not_rescan():
+    """Test that editing a line without changing the block structure avoids a re-scan."""
+    doc = Document(["<div>\n", "![img](a.png)\n", "</div>\n"])
+    doc.set_line(1, "![img](/abs/a.png)\n")
+
+    assert doc.rescans == 0
+    assert doc.image_lines == [1]
+    assert doc.lines[1] == "![img](/abs/a.png)\n"
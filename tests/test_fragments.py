@@ -0,0 +1,136 @@
+import asyncio
+import re
+import pytest
+from pathlib import Path
+from textwrench import PathMgr
+from textwrench.artifactcache import ArtifactCache
+from textwrench.document import Document
+from textwrench.fragments import FragmentRenderer, apply_toc_to_chapters, chapter_ranges, stitch
+from textwrench.mdbuilder import assemble
+from textwrench.pdfbuilder import PdfBuilder
+from textwrench.tocbuilder import HeadingIndex
+from tests.conftest import toc_marker
+
+_CSS = "standard.css"
+_TEMPLATE = str(Path(__file__).resolve().parent.parent / "templates" / "default.html5")
+
+
+async def _fake_pandoc(self, lines, source, css_file=None, html_template_file=None, id_prefix=None):
+    # Headings get ids the way pandoc gives them, de-duplicated within this conversion only.
+    # Footnotes are numbered from 1 in each conversion, and the prefix goes on every id and link.
+    p = id_prefix or ""
+    lines = list(lines)
+    doc = Document(lines)
+    index = HeadingIndex(doc.headings)
+    body, notes = [], []
+    for i, line in enumerate(lines):
+        slug = index.slug(i)
+        note = re.match(r"\[\^(\w+)\]: (.*)", line)
+        if slug is not None:
+            body.append(f'<h2 id="{p}{slug}">{line.strip().lstrip("# ")}</h2>')
+        elif note:
+            n = len(notes) + 1
+            notes.append(f'<li id="{p}fn{n}">{note.group(2)}<a href="#{p}fnref{n}">↩</a></li>')
+        elif line.strip():
+            text = re.sub(r"\[\^\w+\]", lambda m: f'<a href="#{p}fn1" id="{p}fnref1">1</a>', line)
+            text = re.sub(r"\[([^]]*)\]\(#([^)]+)\)", rf'<a href="#{p}\2">\1</a>', text)
+            body.append(f"<p>{text.strip()}</p>")
+    if notes:
+        body.append(f'<section id="{p}footnotes"><ol>{"".join(notes)}</ol></section>')
+    html = "\n".join(body)
+    if html_template_file is not None:
+        html = f"<html><body>\n{html}\n</body></html>"
+    return html
+
+
+@pytest.fixture
+def chapters(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """An assembled document with a TOC and three chapters that share heading names."""
+    monkeypatch.setattr(PdfBuilder, "to_html", _fake_pandoc)
+    fmgr = PathMgr(tmp_path)
+    for c in range(3):
+        fmgr.write_lines(f"chap{c}.md", [f"# Chapter {c}\n", "## Intro\n", f"Text {c}.\n"])
+    root = [*toc_marker(), "[[chap0]]\n", "[[chap1]]\n", "[[chap2]]\n"]
+    boundaries = []
+    doc = Document(assemble(root, fmgr, boundaries=boundaries))
+    return fmgr, doc, apply_toc_to_chapters(doc, boundaries)
+
+
+def test_chapter_ranges():
+    """Test that a document is split at its chapters, with the part before the first one."""
+    assert chapter_ranges([3, 6, 6], 9) == [(0, 3), (3, 6), (6, 9)]
+    assert chapter_ranges([0, 4], 6) == [(0, 4), (4, 6)]
+    assert chapter_ranges([], 5) == [(0, 5)]
+
+
+def test_boundaries_follow_the_toc(chapters):
+    """Test that the chapter boundaries move with the lines added by the TOC."""
+    _, doc, boundaries = chapters
+
+    assert [doc.lines[b] for b in boundaries] == ["# Chapter 0\n", "# Chapter 1\n", "# Chapter 2\n"]
+
+
+def test_stitched_ids_match_toc_links(chapters):
+    """Test that the heading ids of the stitched HTML are those the TOC links point at."""
+    fmgr, doc, boundaries = chapters
+    renderer = FragmentRenderer(fmgr, cache=ArtifactCache(fmgr.directory / "cache"))
+
+    html = asyncio.run(renderer.to_html(doc, boundaries, _CSS, _TEMPLATE))
+
+    links = re.findall(r'<a href="#([^"]+)">', html)
+    ids = re.findall(r'id="([^"]+)"', html)
+    assert links == ["chapter-0", "intro", "chapter-1", "intro-1", "chapter-2", "intro-2"]
+    assert ids == ["table-of-contents", *links]
+    assert html.index("Text 0.") < html.index("Text 1.") < html.index("</body>")
+
+
+def test_only_changed_chapters_are_converted(chapters):
+    """Test that unchanged chapters come from the cache."""
+    fmgr, doc, boundaries = chapters
+    cache = ArtifactCache(fmgr.directory / "cache")
+    first = FragmentRenderer(fmgr, cache=cache)
+    html = asyncio.run(first.to_html(doc, boundaries, _CSS, _TEMPLATE))
+    assert (first.misses, first.hits) == (4, 0)
+
+    doc.set_line(boundaries[1] + 2, "Changed.\n")
+    second = FragmentRenderer(fmgr, cache=cache)
+    changed = asyncio.run(second.to_html(doc, boundaries, _CSS, _TEMPLATE))
+
+    assert (second.misses, second.hits) == (1, 3)
+    assert changed == html.replace("Text 1.", "Changed.")
+
+
+def test_stitch_without_placeholder():
+    """Test that the chapters go at the end of the body if the placeholder is missing."""
+    assert stitch("<body>\nA\n</body>", ["B", "C"]) == "<body>\nA\nB\nC</body>"
+
+
+def test_footnote_ids_are_unique_per_chapter(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    """Test that footnotes in two chapters get distinct ids, and links stay in their chapter."""
+    monkeypatch.setattr(PdfBuilder, "to_html", _fake_pandoc)
+    fmgr = PathMgr(tmp_path)
+    for c in range(2):
+        text = f"Claim {c}[^1] and [next](#chapter-1).\n"
+        fmgr.write_lines(f"chap{c}.md", [f"# Chapter {c}\n", text, f"[^1]: Note {c}\n"])
+    boundaries = []
+    root = ["# Book\n", "[[chap0]]\n", "[[chap1]]\n"]
+    doc = Document(assemble(root, fmgr, boundaries=boundaries))
+    renderer = FragmentRenderer(fmgr, cache=ArtifactCache(fmgr.directory / "cache"))
+
+    html = asyncio.run(renderer.to_html(doc, boundaries, _CSS, _TEMPLATE))
+
+    ids = re.findall(r'id="([^"]+)"', html)
+    assert ids == [
+        "book",
+        "chapter-0",
+        "c1-fnref1",
+        "c1-footnotes",
+        "c1-fn1",
+        "chapter-1",
+        "c2-fnref1",
+        "c2-footnotes",
+        "c2-fn1",
+    ]
+    # Footnote links stay in their chapter, links to headings go to the whole document's ids
+    hrefs = re.findall(r'href="#([^"]+)"', html)
+    assert hrefs == ["c1-fn1", "chapter-1", "c1-fnref1", "c2-fn1", "chapter-1", "c2-fnref1"]
@@ -0,0 +1,106 @@
+import os
+import sys
+import types
+import pytest
+from pathlib import Path
+from textwrench import PathMgr, htmlrender
+from textwrench.pdfbuilder import PdfBuilder
+
+
+@pytest.fixture
+def weasyprint(monkeypatch: pytest.MonkeyPatch):
+    """A fake weasyprint package that records what is parsed and rendered, with empty caches."""
+    fake = types.SimpleNamespace(parsed=[], rendered=[], fonts=[])
+
+    class FontConfiguration:
+        def __init__(self):
+            fake.fonts.append(self)
+
+    class CSS:
+        def __init__(self, filename, font_config):
+            fake.parsed.append(filename)
+            self.filename = filename
+
+    class HTML:
+        def __init__(self, string, base_url):
+            self.string = string
+            self.base_url = base_url
+
+        def write_pdf(self, target, stylesheets, font_config):
+            Path(target).write_bytes(b"%PDF-fake")
+            fake.rendered.append((self, target, stylesheets, font_config))
+
+    package = types.ModuleType("weasyprint")
+    package.CSS, package.HTML = CSS, HTML
+    fonts = types.ModuleType("weasyprint.text.fonts")
+    fonts.FontConfiguration = FontConfiguration
+    package.text = types.ModuleType("weasyprint.text")
+    package.text.fonts = fonts
+    monkeypatch.setitem(sys.modules, "weasyprint", package)
+    monkeypatch.setitem(sys.modules, "weasyprint.text", package.text)
+    monkeypatch.setitem(sys.modules, "weasyprint.text.fonts", fonts)
+    monkeypatch.setattr(htmlrender, "_weasyprint", lambda: package)
+    monkeypatch.setattr(htmlrender, "_font_config", None)
+    monkeypatch.setattr(htmlrender, "_stylesheets", {})
+    return fake
+
+
+def test_font_config_is_created_once(weasyprint):
+    """Test that the font configuration is shared."""
+    assert htmlrender.font_config() is htmlrender.font_config()
+    assert len(weasyprint.fonts) == 1
+
+
+def test_stylesheets_are_parsed_once_until_changed(weasyprint, tmp_path: Path):
+    """Test that documents share a parsed stylesheet, and a changed file is parsed again."""
+    css = tmp_path / "style.css"
+    css.write_text("body { color: black; }")
+    for n in range(2):
+        htmlrender.render_pdf(f"<p>{n}</p>", tmp_path / f"{n}.pdf", [str(css)], str(tmp_path))
+
+    assert weasyprint.parsed == [str(css)]
+    assert weasyprint.rendered[0][2][0] is weasyprint.rendered[1][2][0]
+
+    os.utime(css, ns=(1, 1))
+    htmlrender.render_pdf("<p>2</p>", tmp_path / "2.pdf", [str(css)], str(tmp_path))
+
+    assert weasyprint.parsed == [str(css)] * 2
+    assert htmlrender.cached() == {"stylesheets": 1, "fonts": True}
+
+
+def test_warm_up_loads_fonts_and_stylesheets(weasyprint, tmp_path: Path):
+    """Test that warm_up parses ahead of rendering, and rendering then parses nothing."""
+    css = tmp_path / "style.css"
+    css.write_text("p {}")
+
+    htmlrender.warm_up([str(css)])
+    assert htmlrender.cached() == {"stylesheets": 1, "fonts": True}
+
+    htmlrender.render_pdf("<p>x</p>", tmp_path / "x.pdf", [str(css)], "/base")
+    document, target, _, font_config = weasyprint.rendered[0]
+    assert weasyprint.parsed == [str(css)]
+    assert (document.string, document.base_url) == ("<p>x</p>", "/base")
+    assert target == str(tmp_path / "x.pdf")
+    assert font_config is htmlrender.font_config()
+
+
+def test_weasyprint_engine_renders_in_process(weasyprint, tmp_path: Path, monkeypatch):
+    """Test that the weasyprint engine runs pandoc only for the HTML, then calls render_pdf."""
+    css = tmp_path / "style.css"
+    css.write_text("p {}")
+    commands = []
+
+    async def fake_pandoc(self, command, source, lines=None):
+        commands.append(command)
+        return "<html><p>doc</p></html>"
+
+    monkeypatch.setattr(PdfBuilder, "_run_pandoc_async", fake_pandoc)
+    builder = PdfBuilder(PathMgr(tmp_path), engine="weasyprint")
+
+    builder.convert_lines_to_pdf(["# Doc\n"], "doc.pdf", str(css), "template.html5")
+
+    assert "-o" not in commands[0] and not any(c.startswith("--css") for c in commands[0])
+    document, target, stylesheets, _ = weasyprint.rendered[0]
+    assert (document.string, document.base_url) == ("<html><p>doc</p></html>", str(tmp_path))
+    assert target == str(tmp_path / "doc.pdf") and stylesheets[0].filename == str(css)
+    assert (tmp_path / "doc.pdf").read_bytes() == b"%PDF-fake"
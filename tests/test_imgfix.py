@@ -0,0 +1,71 @@
+import pytest
+from pathlib import Path
+from textwrench.imgfix import find_image_paths, resolve_image_links
+from textwrench.vaultindex import VaultIndex
+
+
+@pytest.fixture
+def vault(tmp_path: Path) -> Path:
+    """A directory with a document folder and an attachments folder."""
+    (tmp_path / "doc" / "images").mkdir(parents=True)
+    (tmp_path / "attachments").mkdir()
+    (tmp_path / "doc" / "images" / "a.png").touch()
+    (tmp_path / "attachments" / "b.png").touch()
+    return tmp_path
+
+
+def test_rewrites_every_link_on_a_line(vault: Path):
+    """Test that all image references on a line are resolved, not just the first."""
+    md_dir = vault / "doc"
+    a = md_dir / "images" / "a.png"
+    lines = ['![one](images/a.png) and ![two](images/a.png "Title") <img src="images/a.png">\n']
+
+    deps = set()
+    result = resolve_image_links(lines, str(md_dir), deps)
+
+    assert result == [f'![one]({a}) and ![two]({a} "Title") <img src="{a}">\n']
+    assert deps == {str(a)}
+
+
+def test_embeds_resolve_through_the_vault_index(vault: Path):
+    """Test that Obsidian image embeds are found anywhere in the vault."""
+    index = VaultIndex(vault, vault / "index.json").refresh()
+    lines = ["![[b.png]]\n"]
+
+    result = resolve_image_links(lines, str(vault / "doc"), index=index)
+
+    assert result == [f"![b.png]({vault / 'attachments' / 'b.png'})\n"]
+
+
+def test_embed_sizes_are_kept(vault: Path):
+    """Test that the width (and height) of a resized embed carry over to the rewritten image."""
+    index = VaultIndex(vault, vault / "index.json").refresh()
+    lines = ["![[b.png|300]]\n", "![[b.png|300x200]]\n", "![[gone.png|300]]\n"]
+
+    result = resolve_image_links(lines, str(vault / "doc"), index=index)
+
+    path = vault / "attachments" / "b.png"
+    assert result[:2] == [
+        f'<img src="{path}" alt="b.png" width="300">\n',
+        f'<img src="{path}" alt="b.png" width="300" height="200">\n',
+    ]
+    assert result[2] == "![gone.png](ERROR: Image file not found: gone.png)\n"
+    assert find_image_paths(result[:2]) == [str(path), str(path)]
+
+
+def test_missing_external_and_code_links(vault: Path):
+    """Test missing images are flagged, and external links and code blocks are left alone."""
+    lines = [
+        "![x](missing.png) ![y](https://example.com/y.png)\n",
+        "```\n",
+        "![z](images/a.png)\n",
+        "```\n",
+    ]
+
+    result = resolve_image_links(lines, str(vault / "doc"), workers=4)
+
+    assert result[0] == (
+        "![x](ERROR: Image file not found: missing.png) ![y](https://example.com/y.png)\n"
+    )
+    assert result[1:] == lines[1:]
+    assert find_image_paths(lines[:1]) == ["missing.png"]
@@ -0,0 +1,54 @@
+import pytest
+from pathlib import Path
+from textwrench import imgprep
+from textwrench.imgfix import resolve_image_links
+from textwrench.imgprep import ImagePrep
+
+
+def test_passes_images_through_without_pillow(tmp_path: Path, monkeypatch):
+    """Test that images are used unchanged when Pillow is not installed."""
+    monkeypatch.setattr(imgprep, "_pillow", lambda: None)
+    (tmp_path / "a.png").write_bytes(b"not really a png")
+    prep = ImagePrep(dpi=100, directory=tmp_path / "cache")
+
+    result = resolve_image_links(["![a](a.png)\n"], str(tmp_path), prepare=prep.process_all)
+
+    assert result == [f"![a]({tmp_path / 'a.png'})\n"]
+
+
+def test_downsamples_and_caches(tmp_path: Path):
+    """Test that wide images are scaled to the page width and processed only once."""
+    Image = pytest.importorskip("PIL.Image")
+    src = tmp_path / "wide.png"
+    Image.new("RGB", (2000, 1000), (200, 10, 10)).save(src)
+    prep = ImagePrep(dpi=100, page_width=5, directory=tmp_path / "cache")
+
+    first = prep.process_all([str(src)])[str(src)]
+    with Image.open(first) as img:
+        assert img.size == (500, 250)
+    mtime = Path(first).stat().st_mtime_ns
+    assert prep.process(str(src)) == first
+    assert Path(first).stat().st_mtime_ns == mtime
+
+
+def test_metadata_is_stripped_when_recompressing_does_not_help(tmp_path: Path):
+    """Test that an image recompression cannot shrink is still saved without its metadata."""
+    Image = pytest.importorskip("PIL.Image")
+    PngImagePlugin = pytest.importorskip("PIL.PngImagePlugin")
+    src = tmp_path / "small.png"
+    info = PngImagePlugin.PngInfo()
+    info.add_text("Comment", "private")
+    Image.new("RGB", (10, 10), (0, 0, 0)).save(src, optimize=True, pnginfo=info)
+    jpeg = tmp_path / "small.jpg"
+    # Noise saved at a low quality: recompressing at the default quality makes it bigger
+    noise = Image.effect_noise((200, 200), 100).convert("RGB")
+    noise.save(jpeg, quality=10, exif=b"Exif\x00\x00private")
+    prep = ImagePrep(dpi=100, directory=tmp_path / "cache")
+
+    processed = prep.process_all([str(src), str(jpeg)])
+
+    with Image.open(processed[str(src)]) as img:
+        assert "Comment" not in img.info
+    with Image.open(processed[str(jpeg)]) as img:
+        assert "exif" not in img.info
+    assert b"private" not in Path(processed[str(jpeg)]).read_bytes()
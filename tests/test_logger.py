@@ -0,0 +1,51 @@
+import io
+import logging
+from textwrench.logger import configure, counts, shutdown
+
+log = logging.getLogger("textwrench.test")
+
+
+class Formatted:
+    """Counts how often it is formatted."""
+
+    calls = 0
+
+    def __str__(self) -> str:
+        Formatted.calls += 1
+        return "value"
+
+
+def test_quiet_mode_counts_and_summarizes():
+    """Test that quiet mode only writes warnings, never formats the rest, and summarizes it."""
+    stream = io.StringIO()
+    configure(quiet=True, stream=stream)
+    try:
+        Formatted.calls = 0
+        for i in range(3):
+            log.info("Read %s: %d", Formatted(), i)
+        log.warning("Careful: %s", "x")
+        assert ("textwrench.test", "Read %s: %d", 3) in counts()
+        assert Formatted.calls == 0
+    finally:
+        shutdown()
+
+    out = stream.getvalue()
+    assert "Careful: x" in out
+    assert "Read value" not in out
+    assert "3 messages not shown (1 kinds)" in out
+    assert "3 x [textwrench.test] Read %s: %d" in out
+
+
+def test_console_output_is_written_by_the_listener():
+    """Test that all records reach the stream once the listener is stopped."""
+    stream = io.StringIO()
+    configure(stream=stream)
+    try:
+        for i in range(100):
+            log.info("line %d", i)
+    finally:
+        shutdown()
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == 100 and lines[-1].endswith("line 99")
+    assert "not shown" not in stream.getvalue()
+    assert logging.getLogger("textwrench").propagate
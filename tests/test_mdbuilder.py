@@ -0,0 +1,62 @@
+import pytest
+from pathlib import Path
+from textwrench import PathMgr
+from textwrench.mdbuilder import assemble
+
+
+def test_assemble_nested_documents(path_manager: PathMgr):
+    """Test that linked documents are expanded depth first in one call."""
+    path_manager.write_lines("chap1.md", ["# Chapter 1\n", "[[section1]]\n"])
+    path_manager.write_lines("section1.md", ["## Section 1\n", "text\n"])
+    root = ["# Root\n", "[[chap1]]\n", "end\n"]
+
+    assert assemble(root, path_manager) == [
+        "# Root\n",
+        "# Chapter 1\n",
+        "## Section 1\n",
+        "text\n",
+        "end\n",
+    ]
+
+
+def test_assemble_strips_comments_and_keeps_unknown_links(path_manager: PathMgr):
+    """Test that comment blocks are removed and unresolved links are kept."""
+    path_manager.write_lines("chap.md", ["<!--\n", "meta\n", "-->\n", "body\n"])
+    root = ["[[chap]]\n", "[[missing]]\n"]
+
+    assert assemble(root, path_manager) == ["body\n", "[[missing]]\n"]
+
+
+def test_assemble_ignores_links_in_code_blocks(path_manager: PathMgr):
+    """Test that a link inside a fenced code block is not expanded."""
+    path_manager.write_lines("chap.md", ["body\n"])
+    root = ["```\n", "[[chap]]\n", "```\n"]
+
+    assert assemble(root, path_manager) == root
+
+
+def test_assemble_repeated_link_reuses_expansion(path_manager: PathMgr):
+    """Test that a document linked twice is inserted twice."""
+    path_manager.write_lines("shared.md", ["shared\n"])
+    root = ["[[shared]]\n", "[[shared]]\n"]
+
+    assert assemble(root, path_manager) == ["shared\n", "shared\n"]
+
+
+def test_assemble_detects_cycles(path_manager: PathMgr):
+    """Test that documents including each other raise an error."""
+    path_manager.write_lines("a.md", ["[[b]]\n"])
+    path_manager.write_lines("b.md", ["[[a]]\n"])
+
+    with pytest.raises(ValueError, match="a -> b -> a"):
+        assemble(["[[a]]\n"], path_manager)
+
+
+def test_assemble_depth_limit(path_manager: PathMgr):
+    """Test that exceeding the maximum include depth raises an error."""
+    path_manager.write_lines("a.md", ["[[b]]\n"])
+    path_manager.write_lines("b.md", ["b\n"])
+
+    assert assemble(["[[a]]\n"], path_manager, max_depth=2) == ["b\n"]
+    with pytest.raises(ValueError):
+        assemble(["[[a]]\n"], path_manager, max_depth=1)
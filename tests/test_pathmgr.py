@@ -1,12 +1,13 @@
+import os
+import subprocess
+import sys
+import threading
+import time
 import pytest
 from pathlib import Path
 from textwrench import PathMgr
-
-
-@pytest.fixture
-def path_manager(tmp_path: Path) -> PathMgr:
-    """Provides a TextFile instance with a temporary directory for each test."""
-    return PathMgr(relative_dir=str(tmp_path))
+from textwrench.contentcache import ContentCache
+from textwrench.pathmgr import fcntl, file_lock
 
 
 def test_init_creates_directory(tmp_path: Path):
@@ -77,3 +78,173 @@ def test_write_empty_file(path_manager: PathMgr):
     lines = path_manager.read_lines(filename)
     assert lines == []
     assert (path_manager.directory / filename).stat().st_size == 0
+
+
+def test_resolve_link_without_index(path_manager: PathMgr):
+    """Test that links resolve to the PathMgr directory when there is no vault index."""
+    (path_manager.directory / "note.md").touch()
+
+    assert path_manager.resolve_link("note") == path_manager.directory / "note.md"
+    assert path_manager.resolve_link("missing") is None
+
+
+def test_resolve_link_with_vault_index(path_manager: PathMgr):
+    """Test that the vault index resolves names, case-folded names and aliases anywhere in the vault."""
+    sub = path_manager.directory / "deep" / "folder"
+    sub.mkdir(parents=True)
+    (sub / "Chapter One.md").write_text("---\naliases: [First, Intro]\n---\ntext\n")
+
+    index = path_manager.index_vault()
+    expected = sub / "Chapter One.md"
+    assert path_manager.resolve_link("Chapter One") == expected
+    assert path_manager.resolve_link("chapter one") == expected
+    assert path_manager.resolve_link("intro") == expected
+    assert path_manager.resolve_link("folder/Chapter One") is None
+    assert path_manager.resolve_link("deep/folder/Chapter One") == expected
+    assert index.cache_file.exists()
+
+
+def test_vault_index_refreshes_incrementally(path_manager: PathMgr):
+    """Test that a persisted index only rescans changed directories."""
+    (path_manager.directory / "a").mkdir()
+    (path_manager.directory / "b").mkdir()
+    path_manager.index_vault()
+
+    (path_manager.directory / "b" / "new.md").touch()
+    index = path_manager.index_vault()
+
+    assert index.dirs_scanned == 1
+    assert path_manager.resolve_link("new") == path_manager.directory / "b" / "new.md"
+
+
+def test_read_lines_is_cached_until_the_file_changes(tmp_path: Path):
+    """Test that repeated reads hit the content cache, and a changed file is re-read."""
+    cache = ContentCache()
+    fmgr = PathMgr(tmp_path, cache=cache)
+    (tmp_path / "chap.md").write_text("one\n")
+
+    assert fmgr.read_lines("chap.md") == ["one\n"]
+    lines = fmgr.read_lines("chap.md")
+    lines.append("mutated\n")
+    assert fmgr.read_lines("chap.md") == ["one\n"]
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    (tmp_path / "chap.md").write_text("one\ntwo\n")
+    assert fmgr.read_lines("chap.md") == ["one\n", "two\n"]
+    fmgr.write_lines("chap.md", ["three\n"])
+    assert fmgr.read_lines("chap.md") == ["three\n"]
+    assert cache.misses == 3
+
+
+def test_content_cache_evicts_least_recently_used():
+    """Test that the content cache stays within its byte budget."""
+    cache = ContentCache(max_bytes=10)
+    cache.put("a", 1, 4, ["aaaa"])
+    cache.put("b", 1, 4, ["bbbb"])
+    assert cache.get("a", 1, 4) == ["aaaa"]
+    cache.put("c", 1, 4, ["cccc"])
+
+    assert cache.get("b", 1, 4) is None
+    assert cache.get("a", 1, 4) == ["aaaa"]
+    assert cache.get("a", 2, 4) is None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 8
+
+
+def test_write_lines_only_if_changed(path_manager: PathMgr):
+    """Test that rewriting identical content is skipped and keeps the mtime."""
+    path = path_manager.directory / "work.md"
+    assert path_manager.write_lines("work.md", ["same\n"], only_if_changed=True)
+    os.utime(path, ns=(1, 1))
+
+    assert not path_manager.write_lines("work.md", ["same\n"], only_if_changed=True)
+    assert path.stat().st_mtime_ns == 1
+    assert path_manager.write_lines("work.md", ["same\n"])
+    assert path.stat().st_mtime_ns != 1
+    assert path_manager.write_lines("work.md", ["other\n"], only_if_changed=True)
+    assert path.read_text() == "other\n"
+
+
+def test_write_lines_is_atomic(path_manager: PathMgr):
+    """Test that a write replaces the file, keeps its mode and leaves no temporary file."""
+    path = path_manager.directory / "doc.md"
+    path.write_text("old\n")
+    os.chmod(path, 0o600)
+    inode = path.stat().st_ino
+
+    path_manager.write_lines("doc.md", ["new\n"])
+
+    assert path.read_text() == "new\n"
+    assert path.stat().st_ino != inode
+    assert path.stat().st_mode & 0o777 == 0o600
+    assert os.listdir(path_manager.directory) == ["doc.md"]
+
+
+def test_file_lock_is_reentrant_and_excludes_threads(tmp_path: Path):
+    """Test that a thread can nest the lock, and other threads wait for it."""
+    events = []
+
+    def other():
+        with file_lock(tmp_path / "a.md"):
+            events.append("t")
+
+    with file_lock(tmp_path / "a.md"):
+        with file_lock(tmp_path / "a.md"):
+            thread = threading.Thread(target=other)
+            thread.start()
+            time.sleep(0.1)
+            events.append("main")
+    thread.join(5)
+    assert events == ["main", "t"]
+
+
+def test_builds_holding_their_output_lock_do_not_deadlock(tmp_path: Path):
+    """Test that writes under another path's lock do not nest locks (no ABBA deadlock)."""
+    fmgr = PathMgr(tmp_path)
+    barrier = threading.Barrier(2)
+
+    def build(n: int):
+        with fmgr.lock(f"doc{n}.pdf"):
+            barrier.wait(5)
+            # The file the other thread holds the lock on
+            fmgr.write_lines(f"doc{1 - n}.pdf", ["x\n"])
+
+    threads = [threading.Thread(target=build, args=(n,), daemon=True) for n in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert not any(thread.is_alive() for thread in threads)
+
+    # Unrelated paths do not wait for each other
+    def other():
+        with file_lock(tmp_path / "b.md"):
+            pass
+
+    with file_lock(tmp_path / "a.md"):
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join(5)
+        assert not thread.is_alive()
+
+
+@pytest.mark.skipif(fcntl is None, reason="advisory locks need fcntl")
+def test_file_lock_excludes_processes(tmp_path: Path):
+    """Test that another process waits for the lock."""
+    script = (
+        "import sys, time\n"
+        "from textwrench.pathmgr import file_lock\n"
+        "with file_lock(sys.argv[1]):\n"
+        "    print(time.time())\n"
+    )
+    with file_lock(tmp_path / "a.md"):
+        child = subprocess.Popen(
+            [sys.executable, "-c", script, str(tmp_path / "a.md")],
+            stdout=subprocess.PIPE,
+            text=True,
+            cwd=Path(__file__).parent.parent,
+        )
+        time.sleep(0.5)
+        released = time.time()
+    acquired = float(child.communicate(timeout=10)[0].strip().splitlines()[-1])
+    assert acquired >= released
@@ -0,0 +1,70 @@
+import asyncio
+import subprocess
+import time
+import pytest
+from pathlib import Path
+from textwrench import PathMgr
+from textwrench.pdfbuilder import PdfBuilder
+
+
+def test_streams_lines_to_stdin(tmp_path: Path):
+    """Test that lines are streamed to the process without blocking on a large output."""
+    builder = PdfBuilder(PathMgr(tmp_path))
+    lines = (f"line {i}\n" for i in range(200000))
+
+    output = builder._run_pandoc(["cat"], "<stdin>", lines)
+
+    assert output.count("\n") == 200000
+    assert output.endswith("line 199999\n")
+
+
+def test_failure_raises(tmp_path: Path):
+    """Test that a non-zero exit status raises with the captured stderr."""
+    builder = PdfBuilder(PathMgr(tmp_path))
+
+    with pytest.raises(subprocess.CalledProcessError) as e:
+        builder._run_pandoc(["sh", "-c", "echo bad >&2; exit 3"], "<stdin>", ["x\n"])
+
+    assert e.value.returncode == 3
+    assert e.value.stderr == "bad"
+
+
+@pytest.mark.skipif(not Path("/proc").exists(), reason="needs /proc")
+def test_timeout_kills_the_process_tree(tmp_path: Path):
+    """Test that a run exceeding the timeout is killed, including its children."""
+    builder = PdfBuilder(PathMgr(tmp_path), timeout=0.5)
+    pid_file = tmp_path / "child.pid"
+
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        builder._run_pandoc(["sh", "-c", f"sleep 30 & echo $! > {pid_file}; wait"], "<stdin>")
+
+    assert time.monotonic() - start < 5
+    time.sleep(0.1)
+    status = Path(f"/proc/{pid_file.read_text().strip()}/status")
+    # Gone, or a zombie waiting to be reaped by init
+    assert not status.exists() or "\nState:\tZ" in status.read_text()
+
+
+def test_concurrency_limit_and_cancellation(tmp_path: Path):
+    """Test that concurrent runs are bounded, and cancelled runs are killed."""
+    builder = PdfBuilder(PathMgr(tmp_path), max_concurrency=2)
+    command = ["sh", "-c", "echo start >&2; sleep 0.3"]
+
+    async def bounded():
+        start = time.monotonic()
+        await asyncio.gather(*(builder._run_pandoc_async(command, str(i)) for i in range(4)))
+        return time.monotonic() - start
+
+    assert asyncio.run(bounded()) >= 0.6
+
+    async def cancelled():
+        task = asyncio.create_task(builder._run_pandoc_async(["sleep", "30"], "slow"))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        start = time.monotonic()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return time.monotonic() - start
+
+    assert asyncio.run(cancelled()) < 5
@@ -0,0 +1,116 @@
+import tracemalloc
+import pytest
+from pathlib import Path
+from textwrench import PathMgr
+from textwrench.imgfix import iter_images, resolve_image_links
+from textwrench.mdbuilder import assemble, iter_assemble
+from textwrench.pipeline import Pipeline, tee, write_to
+from textwrench.tocbuilder import build_toc, iter_toc
+from tests.conftest import toc_marker
+
+
+def test_iter_assemble_matches_assemble(path_manager: PathMgr):
+    """Test that the streamed assembly has the same lines, deps and boundaries."""
+    path_manager.write_lines("chap1.md", ["# Chapter 1\n", "[[shared]]\n", "<!--\n", "x\n", "-->\n"])
+    path_manager.write_lines("chap2.md", ["# Chapter 2\n", "```\n", "[[chap1]]\n", "```\n"])
+    path_manager.write_lines("shared.md", ["shared\n"])
+    root = ["# Root\n", "[[chap1]]\n", "[[chap2]]\n", "[[shared]]\n", "[[missing]]\n"]
+
+    deps, boundaries = set(), []
+    expected = assemble(root, path_manager, deps=deps, boundaries=boundaries)
+    stream_deps, stream_boundaries = set(), []
+    streamed = iter_assemble(iter(root), path_manager, deps=stream_deps, boundaries=stream_boundaries)
+
+    assert list(streamed) == expected
+    assert stream_deps == deps
+    assert stream_boundaries == boundaries
+
+
+def test_iter_assemble_detects_cycles(path_manager: PathMgr):
+    """Test that documents including each other raise an error while streaming."""
+    path_manager.write_lines("a.md", ["[[b]]\n"])
+    path_manager.write_lines("b.md", ["[[a]]\n"])
+
+    with pytest.raises(ValueError, match="a -> b -> a"):
+        list(iter_assemble(["[[a]]\n"], path_manager))
+
+
+@pytest.mark.parametrize("spool_bytes", [1 << 20, 16])
+def test_iter_toc_matches_build_toc(spool_bytes: int):
+    """Test that the streamed TOC is the same, also when the spool moves to a file."""
+    lines = ["---\n", "title: x\n", "---\n", "# Intro\n", *toc_marker(), "# Intro\n", "## Ünïcode\n"]
+    lines += ["```\n", "# code\n", "```\n", "### Deep\n", "## Table of Contents\n", "last"]
+
+    assert list(iter_toc(iter(lines), spool_bytes=spool_bytes)) == build_toc(lines)
+
+
+def test_iter_toc_without_or_with_unterminated_marker():
+    """Test that documents without a complete marker are passed on unchanged."""
+    plain = ["# A\n", "text\n"]
+    unterminated = ["# A\n", "```toc\n", "min_depth: 1\n", "# B\n"]
+
+    assert list(iter_toc(plain)) == build_toc(plain) == plain
+    assert list(iter_toc(unterminated)) == build_toc(unterminated) == unterminated
+
+
+def test_iter_toc_rejects_long_marker():
+    """Test that a TOC block that is too long raises an error."""
+    with pytest.raises(ValueError, match="too long"):
+        list(iter_toc(["```toc\n", *["x\n"] * 5, "```\n"]))
+
+
+def test_iter_images_matches_resolve_image_links(tmp_path: Path):
+    """Test that streamed image links resolve to the same paths, and deps are recorded."""
+    (tmp_path / "a.png").write_bytes(b"png")
+    lines = ["![A](a.png)\n", "![[a.png|200]]\n", "`![B](a.png)`\n", "```\n", "![C](a.png)\n"]
+    lines += ["```\n", "![M](missing.png)\n"]
+
+    deps, stream_deps = set(), set()
+    expected = resolve_image_links(lines, str(tmp_path), deps)
+
+    assert list(iter_images(iter(lines), str(tmp_path), stream_deps)) == expected
+    assert stream_deps == deps == {str(tmp_path / "a.png")}
+
+
+def test_pipeline_stages_and_sinks(path_manager: PathMgr):
+    """Test that a pipeline can be iterated twice, and the sinks write the streamed lines."""
+    path_manager.write_lines("root.md", ["# Root\n", *toc_marker(), "[[chap]]\n"])
+    path_manager.write_lines("chap.md", ["## Chapter\n", "text\n"])
+    pipeline = Pipeline.from_file(path_manager, "root.md").then(iter_assemble, path_manager)
+    with_toc = pipeline.then(iter_toc)
+
+    expected = build_toc(assemble(path_manager.read_lines("root.md"), path_manager))
+    assert list(with_toc) == list(with_toc) == expected
+    assert len(list(pipeline)) == 7
+
+    assert write_to(with_toc, path_manager, "out.md") == len(expected)
+    assert path_manager.read_lines("out.md") == expected
+    assert list(with_toc.then(tee, path_manager, "tee.md")) == expected
+    assert path_manager.read_lines("tee.md") == expected
+
+
+def test_streaming_memory_does_not_grow_with_document(path_manager: PathMgr):
+    """Test that the peak memory of the streamed stages is bounded by the spool budget."""
+    body = "".join(f"## Section {n}\n" + "Lorem ipsum dolor sit amet. " * 100 + "\n" for n in range(100))
+    path_manager.write_lines("chap.md", [body])
+    root = ["# Root\n", *toc_marker(), *["[[chap]]\n"] * 40]
+    path_manager.write_lines("root.md", root)
+
+    pipeline = (
+        Pipeline.from_file(path_manager, "root.md")
+        .then(iter_assemble, path_manager)
+        .then(iter_toc, spool_bytes=64 * 1024)
+        .then(iter_images, str(path_manager.directory))
+    )
+    size = 0
+    tracemalloc.start()
+    try:
+        for line in pipeline:
+            size += len(line)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    # The document is about 10 MB; what is kept is the spool budgets and the used slugs
+    assert size > 10 * 1024 * 1024
+    assert peak < 2 * 1024 * 1024
@@ -0,0 +1,72 @@
+import json
+import pstats
+import time
+from argparse import Namespace
+from pathlib import Path
+from textwrench import profiler
+from textwrench.__main__ import profiled
+
+
+@profiler.timed("work")
+def _work(n: int) -> int:
+    return sum(range(n))
+
+
+def test_report_structure_and_values(tmp_path: Path):
+    """Test that stages, counters, subprocesses and peak memory end up in the JSON report."""
+    prof = profiler.start()
+    try:
+        with profiler.stage("sleep"):
+            time.sleep(0.05)
+        with profiler.stage("sleep"):
+            pass
+        with profiler.stage("busy"):
+            buffer = bytearray(4 * 1024 * 1024)
+            sum(range(200000))
+        assert _work(10) == 45
+        profiler.count("files")
+        profiler.count("files", 2)
+        profiler.count("bytes", 100)
+        profiler.record_subprocess("pandoc", 0.5, 0)
+    finally:
+        stopped = profiler.stop()
+    del buffer
+    assert stopped is prof
+
+    report_file = tmp_path / "profile.json"
+    stopped.write(str(report_file))
+    report = json.loads(report_file.read_text())
+
+    assert report["version"] == 1
+    assert set(report["stages"]) == {"sleep", "busy", "work"}
+    sleep = report["stages"]["sleep"]
+    assert sleep["calls"] == 2 and sleep["wall"] >= 0.05 and sleep["cpu"] < sleep["wall"]
+    assert report["stages"]["busy"]["cpu"] > 0
+    assert report["stages"]["work"]["calls"] == 1
+    assert report["counters"] == {"bytes": 100, "files": 3}
+    assert list(report["counters"]) == ["bytes", "files"]
+    assert report["subprocesses"] == [{"command": "pandoc", "duration": 0.5, "returncode": 0}]
+    assert report["peak_memory"] >= 4 * 1024 * 1024
+    assert report["wall"] >= sleep["wall"]
+
+
+def test_helpers_do_nothing_without_a_profiler():
+    """Test that the module level helpers work, and record nothing, when no profiler is active."""
+    assert profiler.stop() is None
+    with profiler.stage("x"):
+        profiler.count("y")
+        profiler.record_subprocess("pandoc", 1.0, None)
+    assert _work(3) == 3
+
+
+def test_profile_and_pstats_options(tmp_path: Path):
+    """Test that a profiled run writes the JSON report and the cProfile stats."""
+    args = Namespace(profile=str(tmp_path / "report.json"), pstats=str(tmp_path / "run.pstats"))
+
+    profiled(lambda a: _work(1000), args)
+
+    report = json.loads((tmp_path / "report.json").read_text())
+    assert report["stages"]["work"]["calls"] == 1
+    assert report["peak_memory"] > 0
+    stats = pstats.Stats(args.pstats)
+    assert any(func[2] == "_work" for func in stats.stats)
@@ -0,0 +1,150 @@
+import json
+import os
+import re
+import threading
+import time
+import pytest
+from pathlib import Path
+from textwrench.__main__ import build_parser, rewrite
+from textwrench.pathmgr import file_lock
+from textwrench.rewrite import compile_rules, load_rules, rewrite_file, rewrite_files, rewrite_lines
+
+DOC = (
+    "---\n"
+    "title: widget notes\n"
+    "---\n"
+    "# Widget overview\n"
+    "A widget, `widget()` and WIDGET.\r\n"
+    "```python\n"
+    "widget = 1\n"
+    "```\n"
+    "<!-- widget -->\n"
+)
+
+
+def upper_first(line: str) -> str:
+    return line[:1].upper() + line[1:]
+
+
+def test_rewrite_lines_respects_blocks_and_code_spans():
+    """Test that code fences, comments, front matter and code spans are left alone."""
+    rules = compile_rules([{"pattern": r"\bwidget\b", "replace": "gadget", "ignore_case": True}])
+    new, count = rewrite_lines(DOC.splitlines(keepends=True), rules)
+    assert "".join(new) == DOC.replace("# Widget overview", "# gadget overview").replace(
+        "A widget, `widget()` and WIDGET.", "A gadget, `widget()` and gadget."
+    )
+    assert count == 3
+
+
+def test_rewrite_lines_scope_all_and_functions():
+    """Test rules that apply everywhere, and function rules."""
+    rules = compile_rules([{"pattern": "widget", "replace": "gadget", "scope": "all"}, upper_first])
+    new, _ = rewrite_lines(DOC.splitlines(keepends=True), rules)
+    assert new[1] == "title: gadget notes\n"
+    assert new[6] == "gadget = 1\n"
+    assert new[4] == "A gadget, `gadget()` and WIDGET.\r\n"
+
+
+def bad_template(line: str) -> str:
+    return re.sub("widget", r"\2", line)
+
+
+def test_invalid_rules(tmp_path: Path):
+    """Test that invalid rules files are rejected."""
+    invalid = [
+        {"pattern": "x"},
+        [{"pattern": "x"}],
+        [{"pattern": "(", "replace": ""}],
+        [{"pattern": "foo", "replace": "\\1"}],
+        [{"pattern": "foo", "replace": "\\g<x>"}],
+    ]
+    for rules in invalid:
+        (tmp_path / "rules.json").write_text(json.dumps(rules))
+        with pytest.raises(ValueError):
+            load_rules(tmp_path / "rules.json")
+    with pytest.raises(ValueError):
+        compile_rules([{"pattern": "x", "replace": "y", "scope": "code"}])
+
+
+def test_failing_replacement_is_reported(tmp_path: Path):
+    """Test that a replacement that fails at rewrite time is an error in the result."""
+    doc = tmp_path / "doc.md"
+    doc.write_bytes(DOC.encode())
+
+    result = rewrite_file(doc, compile_rules([bad_template]))
+
+    assert "invalid group reference" in result["error"]
+    assert doc.read_bytes() == DOC.encode()
+
+
+def test_rewrite_holds_the_lock_from_read_to_write(tmp_path: Path):
+    """Test that an edit made under the file lock is rewritten, not lost."""
+    doc = tmp_path / "doc.md"
+    doc.write_text("widget\n")
+    rules = compile_rules([{"pattern": "widget", "replace": "gadget"}])
+    locked = threading.Event()
+
+    def edit():
+        with file_lock(doc):
+            locked.set()
+            time.sleep(0.2)
+            doc.write_text("widget, edited\n")
+
+    editor = threading.Thread(target=edit)
+    editor.start()
+    locked.wait()
+    result = rewrite_file(doc, rules)
+    editor.join()
+
+    assert result["error"] is None
+    assert doc.read_text() == "gadget, edited\n"
+
+
+def test_unlocked_edit_during_rewrite_is_a_conflict(tmp_path: Path):
+    """Test that a file changed between the read and the write is kept, and reported."""
+    doc = tmp_path / "doc.md"
+    doc.write_text("widget\n")
+
+    def edit_on_disk(line: str) -> str:
+        doc.write_text("edited in an editor\n")
+        return line.replace("widget", "gadget")
+
+    result = rewrite_file(doc, compile_rules([edit_on_disk]))
+
+    assert result["changed"] and result["error"].startswith("Conflict")
+    assert doc.read_text() == "edited in an editor\n"
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_rewrite_files_writes_only_changed_files(tmp_path: Path, jobs: int):
+    """Test that changed files are rewritten atomically, and unchanged files are not touched."""
+    changed, same = tmp_path / "changed.md", tmp_path / "same.md"
+    changed.write_bytes(DOC.encode())
+    same.write_text("nothing to see\n")
+    os.chmod(changed, 0o640)
+    os.utime(same, ns=(1, 1))
+    rules = [{"pattern": r"\bwidget\b", "replace": "gadget"}]
+
+    results = rewrite_files([changed, same, tmp_path / "missing.md"], rules, jobs=jobs)
+
+    assert [r["changed"] for r in results] == [True, False, False]
+    assert "FileNotFoundError" in results[2]["error"]
+    assert b"A gadget, `widget()` and WIDGET.\r\n" in changed.read_bytes()
+    assert os.stat(changed).st_mode & 0o777 == 0o640
+    assert os.stat(same).st_mtime_ns == 1
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["changed.md", "same.md"]
+
+
+def test_rewrite_dry_run_cli(tmp_path: Path, monkeypatch, capsys):
+    """Test that a dry run prints a unified diff and writes nothing."""
+    doc = tmp_path / "doc.md"
+    doc.write_text(DOC)
+    (tmp_path / "rules.json").write_text(json.dumps([{"pattern": "A widget", "replace": "A gadget"}]))
+    monkeypatch.chdir(tmp_path)
+
+    args = build_parser().parse_args(["-i", "doc.md", "--rewrite", "rules.json", "--dry-run"])
+    assert rewrite(args)
+
+    out = capsys.readouterr().out
+    assert "-A widget, `widget()` and WIDGET." in out and "+A gadget, `widget()`" in out
+    assert doc.read_bytes() == DOC.encode()
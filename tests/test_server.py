@@ -0,0 +1,76 @@
+import threading
+import time
+import pytest
+from argparse import Namespace
+from pathlib import Path
+from textwrench.server import RenderServer, forward, request
+
+
+@pytest.fixture
+def server(tmp_path: Path):
+    """A render server with a build function that records its arguments, on a thread."""
+    built = []
+    release = threading.Event()
+    release.set()
+
+    def build(args):
+        release.wait(5)
+        if args.inp == "bad.md":
+            raise ValueError("broken document")
+        built.append((args.inp, args.cwd))
+
+    socket_path = str(tmp_path / "render.sock")
+    srv = RenderServer(
+        lambda argv: Namespace(inp=argv[1]), build, socket_path, workers=2, stats=lambda: {"x": 1}
+    )
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    for _ in range(100):
+        if request({"op": "status"}, socket_path):
+            break
+        time.sleep(0.02)
+    yield srv, socket_path, built, release
+    request({"op": "shutdown"}, socket_path)
+    thread.join(5)
+
+
+def test_forward_builds_in_the_server(server):
+    """Test that forwarded builds run with the client's working directory, and errors come back."""
+    srv, socket_path, built, _ = server
+
+    assert forward(["-i", "doc.md"], "/work", socket_path)["ok"]
+    result = forward(["-i", "bad.md"], "/work", socket_path)
+
+    assert built == [("doc.md", "/work")]
+    assert not result["ok"] and "broken document" in result["error"]
+    status = request({"op": "status"}, socket_path)
+    assert (status["completed"], status["failed"], status["x"]) == (1, 1, 1)
+
+
+def test_status_reports_jobs_in_flight(server):
+    """Test that the status shows running and queued builds."""
+    srv, socket_path, built, release = server
+    release.clear()
+    clients = [
+        threading.Thread(target=forward, args=(["-i", f"d{i}.md"], "/w", socket_path))
+        for i in range(3)
+    ]
+    for client in clients:
+        client.start()
+    # Jobs are queued before the pool threads pick them up, so wait until both workers have
+    for _ in range(250):
+        status = request({"op": "status"}, socket_path)
+        if (status["in_flight"], status["queued"]) == (2, 1):
+            break
+        time.sleep(0.02)
+
+    assert (status["in_flight"], status["queued"]) == (2, 1)
+    release.set()
+    for client in clients:
+        client.join(5)
+    assert len(built) == 3
+
+
+def test_no_server_falls_back(tmp_path: Path):
+    """Test that clients can tell there is no server."""
+    assert forward(["-i", "doc.md"], "/work", str(tmp_path / "none.sock")) is None
@@ -0,0 +1,104 @@
+import shutil
+import pytest
+from pathlib import Path
+from textwrench import PathMgr
+from textwrench.document import Document
+from textwrench.mdbuilder import assemble
+from textwrench.pdfbuilder import PdfBuilder
+from textwrench.shards import ANCHOR_SCHEME, merge_pdfs, plan_shards, prepare_shards, render_sharded
+from textwrench.tocbuilder import apply_toc
+from tests.conftest import toc_marker
+
+_CSS = str(Path(__file__).resolve().parent.parent / "templates" / "standard.css")
+_TEMPLATE = str(Path(__file__).resolve().parent.parent / "templates" / "default.html5")
+_PAGE_BREAK = ['<div style="page-break-after: always;"></div>\n', "\n"]
+
+
+@pytest.fixture
+def chapters(tmp_path: Path):
+    """An assembled document with a TOC and three chapters, and its chapter boundaries."""
+    fmgr = PathMgr(tmp_path)
+    for c in range(3):
+        fmgr.write_lines(
+            f"chap{c}.md",
+            [f"# Chapter {c}\n", "\n", "## Intro\n", "\n", f"Text {c}.\n", "\n", *_PAGE_BREAK],
+        )
+    root = [*toc_marker(), *_PAGE_BREAK]
+    root += ["[[chap0]]\n", "[[chap1]]\n", "[[chap2]]\n"]
+    boundaries = []
+    lines = assemble(root, fmgr, boundaries=boundaries)
+    return fmgr, lines, boundaries
+
+
+def test_assemble_records_top_level_boundaries(chapters):
+    """Test that assembly reports where each top level chapter starts."""
+    _, lines, boundaries = chapters
+
+    assert [lines[b] for b in boundaries] == ["# Chapter 0\n", "# Chapter 1\n", "# Chapter 2\n"]
+
+
+def test_plan_shards():
+    """Test that chapters are grouped into contiguous, roughly equal shards."""
+    assert plan_shards([10, 20, 30, 40, 50], 60, 3) == [(0, 20), (20, 40), (40, 60)]
+    assert plan_shards([10, 20], 30, 1) == [(0, 30)]
+    assert plan_shards([], 30, 4) == [(0, 30)]
+
+
+def test_prepare_shards_anchors_toc_headings(chapters):
+    """Test that TOC links use the anchor scheme, headings get anchors and boundaries move."""
+    _, lines, boundaries = chapters
+    doc = Document(lines)
+
+    moved = prepare_shards(doc, boundaries)
+
+    assert f"- [Chapter 1]({ANCHOR_SCHEME}tw-chapter-1)\n" in doc.lines
+    assert f"    - [Intro]({ANCHOR_SCHEME}tw-intro-1)\n" in doc.lines
+    assert [doc.lines[b] for b in moved] == [
+        '# <a id="tw-chapter-0"></a>Chapter 0\n',
+        '# <a id="tw-chapter-1"></a>Chapter 1\n',
+        '# <a id="tw-chapter-2"></a>Chapter 2\n',
+    ]
+
+
+def test_merge_resolves_links_across_parts(tmp_path: Path):
+    """Test that anchor links are turned into GoTo actions on the merged pages."""
+    pypdf = pytest.importorskip("pypdf")
+    from pypdf.annotations import Link
+
+    first = pypdf.PdfWriter()
+    first.add_blank_page(200, 200)
+    first.add_annotation(0, Link(rect=(10, 10, 50, 20), url=f"{ANCHOR_SCHEME}tw-b"))
+    first.write(tmp_path / "a.pdf")
+    second = pypdf.PdfWriter()
+    second.add_blank_page(200, 200)
+    second.add_blank_page(200, 200)
+    second.add_named_destination("tw-b", 1)
+    second.write(tmp_path / "b.pdf")
+
+    assert merge_pdfs([str(tmp_path / "a.pdf"), str(tmp_path / "b.pdf")], tmp_path / "m.pdf") == 1
+
+    merged = pypdf.PdfReader(tmp_path / "m.pdf")
+    action = merged.pages[0]["/Annots"][0].get_object()["/A"]
+    assert action["/S"] == "/GoTo"
+    assert merged.get_page_number(action["/D"][0].get_object()) == 2
+
+
+@pytest.mark.skipif(shutil.which("pandoc") is None, reason="needs pandoc")
+def test_sharded_render_matches_single_shot(chapters):
+    """Test that a sharded render has the same content as a single-shot render."""
+    pypdf = pytest.importorskip("pypdf")
+    pytest.importorskip("weasyprint")
+    fmgr, lines, boundaries = chapters
+
+    single = apply_toc(Document(lines)).lines
+    PdfBuilder(fmgr, engine="weasyprint").convert_lines_to_pdf(single, "single.pdf", _CSS, _TEMPLATE)
+    doc = Document(lines)
+    ranges = plan_shards(prepare_shards(doc, boundaries), len(doc), 3)
+    assert len(ranges) == 3
+    render_sharded(fmgr, "weasyprint", doc.lines, ranges, "sharded.pdf", _CSS, _TEMPLATE)
+
+    def content(name):
+        reader = pypdf.PdfReader(fmgr.directory / name)
+        return [" ".join(page.extract_text().split()) for page in reader.pages]
+
+    assert content("sharded.pdf") == content("single.pdf")
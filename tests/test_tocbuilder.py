@@ -0,0 +1,57 @@
+from textwrench.document import Document
+from textwrench.tocbuilder import broken_anchor_links, build_toc, heading_index, slugify
+from tests.conftest import toc_marker
+
+
+def test_slugify_matches_pandoc():
+    """Test that slugs follow pandoc's GitHub identifier rules."""
+    assert slugify("Hello, World!") == "hello-world"
+    assert slugify("A & B") == "a--b"
+    assert slugify("**Bold** and `a_b()`") == "bold-and-a_b"
+    assert slugify("[Link](http://x.org) __init__ snake_case") == "link-init-snake_case"
+    assert slugify("Ünïcode  ok") == "ünïcode-ok"
+    assert slugify("!!!") == ""
+
+
+def test_toc_slugs_count_all_headings():
+    """Test that duplicates outside the TOC depth range and the TOC title are counted."""
+    lines = ["# Intro\n", *toc_marker(2, 2), "# Table of Contents\n", "## Intro\n"]
+    lines += ["```\n", "# code\n", "```\n"]
+
+    result = build_toc(lines)
+
+    assert result[1:6] == [
+        "## Table of Contents\n",
+        "\n",
+        "    - [Intro](#intro-1)\n",
+        "\n",
+        "# Table of Contents\n",
+    ]
+    index = heading_index(result)
+    assert [a["slug"] for a in index.anchors] == [
+        "intro",
+        "table-of-contents",
+        "table-of-contents-1",
+        "intro-1",
+    ]
+
+
+def test_heading_index_lookup_and_broken_links():
+    """Test anchor lookups, explicit ids, and that links in code and #tags are ignored."""
+    doc = Document(
+        [
+            "# Overview\n",
+            "#tag is not a heading\n",
+            '<a id="custom"></a>\n',
+            "See [o](#overview), [c](#custom) and [x](#missing).\n",
+            "```\n",
+            "[y](#also-missing)\n",
+            "```\n",
+        ]
+    )
+    index = heading_index(doc)
+
+    assert len(index) == 1
+    assert "#overview" in index and "custom" in index
+    assert index.find("#overview")["line"] == 0
+    assert broken_anchor_links(doc, index) == [(3, "missing")]
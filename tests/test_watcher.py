@@ -0,0 +1,86 @@
+import argparse
+import os
+from pathlib import Path
+from textwrench import watcher as watcher_module
+from textwrench.watcher import Watcher
+
+
+def test_watcher_rebuilds_affected_roots(tmp_path: Path):
+    """Test that only the roots depending on a changed file are rebuilt."""
+    shared = tmp_path / "shared.md"
+    only_b = tmp_path / "only_b.md"
+    for path in (shared, only_b):
+        path.write_text("text\n")
+    deps = {"a.md": {str(shared)}, "b.md": {str(shared), str(only_b)}}
+    built = []
+
+    def build(args):
+        built.append(Path(args.inp).name)
+        return deps[Path(args.inp).name]
+
+    watcher = Watcher([tmp_path / "a.md", tmp_path / "b.md"], argparse.Namespace(), build)
+    watcher.build_all()
+    assert built == ["a.md", "b.md"]
+    assert watcher.poll() == set()
+
+    only_b.write_text("changed text\n")
+    changed = watcher.poll()
+    assert changed == {str(only_b)}
+    assert [Path(r).name for r in watcher.rebuild(changed)] == ["b.md"]
+
+    os.remove(shared)
+    assert [Path(r).name for r in watcher.rebuild(watcher.poll())] == ["a.md", "b.md"]
+
+
+def test_watcher_rebuilds_when_a_missing_target_appears(tmp_path: Path):
+    """Test that a new file named by a dangling link or image rebuilds the roots referring to it."""
+    (tmp_path / "img").mkdir()
+    a = tmp_path / "a.md"
+    b = tmp_path / "b.md"
+    a.write_text("# A\n[[Later Note]]\n")
+    b.write_text("# B\n![fig](img/fig.png)\n")
+    built = []
+
+    def build(args):
+        built.append(Path(args.inp).name)
+        return {args.inp}
+
+    watcher = Watcher([a, b], argparse.Namespace(vault=None), build)
+    watcher.build_all()
+    (tmp_path / "unrelated.md").write_text("x\n")
+    assert watcher.poll() == set()
+
+    (tmp_path / "later note.md").write_text("now it exists\n")
+    assert [Path(r).name for r in watcher.rebuild(watcher.poll())] == ["a.md"]
+
+    (tmp_path / "img" / "fig.png").write_bytes(b"png")
+    assert [Path(r).name for r in watcher.rebuild(watcher.poll())] == ["b.md"]
+    assert built == ["a.md", "b.md", "a.md", "b.md"]
+
+
+def test_watcher_walks_a_vault_once(tmp_path: Path, monkeypatch):
+    """Test that the vault is walked once for all roots, and new or removed folders are tracked."""
+    (tmp_path / ".obsidian").mkdir()
+    (tmp_path / "notes").mkdir()
+    roots = [tmp_path / "a.md", tmp_path / "notes" / "b.md"]
+    for root in roots:
+        root.write_text("# Doc\n[[Later]]\n")
+    walks = []
+    walk = watcher_module._vault_dirs
+    monkeypatch.setattr(watcher_module, "_vault_dirs", lambda d: walks.append(d) or walk(d))
+
+    watcher = Watcher(roots, argparse.Namespace(vault=None), lambda args: {args.inp})
+    watcher.build_all()
+    watcher.rebuild({str(roots[0])})
+    assert walks == [tmp_path]
+
+    # A folder moved into the vault, holding the note both roots wait for
+    (tmp_path / "notes" / "new").mkdir()
+    (tmp_path / "notes" / "new" / "later.md").write_text("text\n")
+    assert sorted(watcher.poll()) == [str(r) for r in roots]
+    assert str(tmp_path / "notes" / "new") in watcher._listings
+
+    (tmp_path / "notes" / "new" / "later.md").unlink()
+    (tmp_path / "notes" / "new").rmdir()
+    assert watcher.poll() == set()
+    assert str(tmp_path / "notes" / "new") not in watcher._listings
@@ -1,6 +1,6 @@
 """textwrench package initializer."""
 
-# This import configures logging as soon as the package is imported.
+# The package logger; console output is configured by logger.configure(), see textwrench.__main__
 from .logger import logger
 from .pathmgr import PathMgr
 
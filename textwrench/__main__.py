@@ -12,14 +12,35 @@ Description:
 """
 
 import argparse
+import cProfile
+import json
 import logging
+import os
 import sys
 from pathlib import Path
+from typing import List, Optional, Set
 from textwrench.pathmgr import PathMgr
-from textwrench.mdbuilder import assemble
-from textwrench.pdfbuilder import PdfBuilder
-from textwrench.tocbuilder import build_toc
-from textwrench.imgfix import resolve_image_links
+from textwrench.mdbuilder import assemble, iter_assemble
+from textwrench.pdfbuilder import PdfBuilder, ENGINES
+from textwrench import htmlrender, profiler
+from textwrench.logger import configure as configure_logging, shutdown as shutdown_logging
+from textwrench.tocbuilder import apply_toc, iter_toc
+from textwrench.imgfix import resolve_document_images, find_image_paths, iter_images
+from textwrench.imgprep import ImagePrep, DEFAULT_PAGE_WIDTH
+from textwrench.document import Document
+from textwrench.artifactcache import ArtifactCache
+from textwrench.contentcache import shared_cache
+from textwrench.vaultindex import find_vault_root
+from textwrench.batch import collect_inputs, run_batch, summarize
+from textwrench.watcher import Watcher
+from textwrench.shards import plan_shards, prepare_shards, render_sharded
+from textwrench.fragments import FragmentRenderer, apply_toc_to_chapters
+from textwrench.server import RenderServer, forward, request
+from textwrench.depgraph import DepGraph, missing_names, normalize
+from textwrench.catalog import Catalog
+from textwrench.rewrite import load_rules, rewrite_files
+from textwrench.pipeline import Pipeline, write_to
+from textwrench.checker import check_documents, check_files
 
 logger = logging.getLogger("textwrench.__main__")
 
@@ -31,7 +52,7 @@ DESCRIPTION = """TextWrench is a set of tools for markdown files. It can:
 
 Note: The intermediate and output files are written to the same directory as the input file
 and use the input file name provided. If the input file name is (say) bob.md, then:
-  - the assembled markdown is bob_assembled.md
+  - the final markdown is bob_work.md (only with --keep-work)
   - the PDF is bob.pdf
 """
 
@@ -43,64 +64,458 @@ _HTML_TEMPLATE = "templates/default.html5"
 def sanity_check():
     fm = PathMgr(Path.cwd())
     if fm.file_exists(_CSS_PROFFESSIONAL):
-        logger.info(f"Sanity check: found {_CSS_PROFFESSIONAL}")
+        logger.info("Sanity check: found %s", _CSS_PROFFESSIONAL)
     else:
-        logger.warning(f"Sanity check: {_CSS_PROFFESSIONAL} not found")
+        logger.warning("Sanity check: %s not found", _CSS_PROFFESSIONAL)
     if fm.file_exists(_CSS_STANDARD):
-        logger.info(f"Sanity check: found {_CSS_STANDARD}")
+        logger.info("Sanity check: found %s", _CSS_STANDARD)
     else:
-        logger.warning(f"Sanity check: {_CSS_STANDARD} not found")
+        logger.warning("Sanity check: %s not found", _CSS_STANDARD)
     if fm.file_exists(_HTML_TEMPLATE):
-        logger.info(f"Sanity check: found {_HTML_TEMPLATE}")
+        logger.info("Sanity check: found %s", _HTML_TEMPLATE)
     else:
-        logger.warning(f"Sanity check: {_HTML_TEMPLATE} not found")
+        logger.warning("Sanity check: %s not found", _HTML_TEMPLATE)
 
 
-def wrench(args):
+def _base_dir(args) -> Path:
+    # The directory relative paths are resolved against: the caller's, for a render server
+    return Path(getattr(args, "cwd", None) or Path.cwd())
+
+
+def _css_file(args) -> str:
+    return (
+        str(_base_dir(args) / _CSS_PROFFESSIONAL)
+        if args.css == "p"
+        else str(_base_dir(args) / _CSS_STANDARD)
+    )
+
+
+def wrench(args) -> Set[str]:
+    """
+    Builds one document, as described by the command line arguments.
+
+    Args:
+        args: the parsed command line arguments
+
+    Returns:
+        the paths of all files the document was built from
+    """
     # sanity_check()
-    logger.info(f"Processing {args.inp} with arguments: {args}")
-    filepath = Path(args.inp)
+    if args.stream:
+        return wrench_stream(args)
+    logger.info("Processing %s with arguments: %s", args.inp, args)
+    filepath = _base_dir(args) / args.inp
     filestem = str(filepath.stem)
     fmgr = PathMgr(filepath.parent)
     toc = args.toc == "y"
     asm = args.asm == "y"
-    css = (
-        str(Path.cwd() / _CSS_PROFFESSIONAL)
-        if args.css == "p"
-        else str(Path.cwd() / _CSS_STANDARD)
-    )
+    css = _css_file(args)
 
     # Read the file, then:
     # - if needed, assemble the file
     # - if needed, build the TOC
     # - store as a working file (replace existing)
     # - convert to PDF
-    lines = fmgr.read_lines(filepath.name)
+    with profiler.stage("read"):
+        lines = fmgr.read_lines(filepath.name)
+    deps = {str(fmgr.get_resolved_path(filepath.name))}
+    boundaries = []
     if asm:
         logger.info("Assembling document...")
-        lines = assemble(lines, fmgr)
+        if args.vault or find_vault_root(fmgr.directory):
+            with profiler.stage("vault_index"):
+                fmgr.index_vault(_base_dir(args) / args.vault if args.vault else None)
+        lines = assemble(
+            lines, fmgr, max_depth=args.depth, deps=deps, boundaries=boundaries
+        )
+    # One document model, classified once, shared by the TOC and image stages
+    with profiler.stage("classify"):
+        doc = Document(lines)
+    if args.fragments and args.shards > 1:
+        logger.warning("Shards are not used with --fragments.")
+    sharded = args.shards > 1 and len(boundaries) > 1 and not args.fragments
     if toc:
         logger.info("Building table of contents...")
-        lines = build_toc(lines)
-    lines = resolve_image_links(lines, str(fmgr.get_resolved_path()))
+        if sharded:
+            boundaries = prepare_shards(doc, boundaries)
+        elif args.fragments:
+            boundaries = apply_toc_to_chapters(doc, boundaries)
+        else:
+            apply_toc(doc)
+    prep = ImagePrep(args.image_dpi, args.page_width) if args.image_dpi else None
+    resolve_document_images(
+        doc,
+        str(fmgr.get_resolved_path()),
+        deps,
+        index=fmgr.index,
+        workers=args.io_workers,
+        prepare=prep.process_all if prep else None,
+    )
+    lines = doc.lines
+    ranges = plan_shards(boundaries, len(lines), args.shards if sharded else 1)
+
+    # Skip the render entirely if an identical one is in the artifact cache
+    template = str(_base_dir(args) / _HTML_TEMPLATE)
+    deps.update((css, template))
+    output = fmgr.get_resolved_path(f"{filestem}.pdf")
+    cache = None
+    if not args.no_cache:
+        with profiler.stage("cache"):
+            cache = ArtifactCache(max_bytes=args.cache_size * 1024 * 1024)
+            options = [args.engine, f"shards:{len(ranges)}"]
+            if args.fragments:
+                options.append("fragments")
+            key = cache.key(lines, [css, template], find_image_paths(lines), options=options)
+            hit = cache.fetch(key, output)
+        profiler.count("cache.hits" if hit else "cache.misses")
+        if hit:
+            return deps
+
+    # Concurrent builds of the same document write the same files; one at a time
+    with fmgr.lock(output.name):
+        if args.keep_work:
+            with profiler.stage("write_work"):
+                # An unchanged work file keeps its mtime, so make-style tools do not rebuild
+                fmgr.write_lines(f"{filestem}_work.md", lines, only_if_changed=True)
+        pdf_timeout = args.pdf_timeout or None
+        if len(ranges) > 1:
+            logger.info("Rendering %s shards...", len(ranges))
+            render_sharded(
+                fmgr, args.engine, lines, ranges, output.name, css, template, timeout=pdf_timeout
+            )
+        elif args.fragments:
+            # Only the chapters that changed since the last build go through pandoc
+            FragmentRenderer(fmgr, args.engine, timeout=pdf_timeout).render(
+                doc, boundaries, output.name, css, template
+            )
+        else:
+            # The markdown is streamed to pandoc, no intermediate file is needed
+            pdf = PdfBuilder(fmgr, engine=args.engine, timeout=pdf_timeout)
+            pdf.convert_lines_to_pdf(
+                lines,
+                output_pdf_file=output.name,
+                css_file=css,
+                html_template_file=template,
+            )
+        if cache:
+            with profiler.stage("cache"):
+                cache.store(key, output)
+    return deps
+
+
+def wrench_stream(args) -> Set[str]:
+    """
+    Builds one document like wrench, but streams it through the pipeline stages to pandoc
+    instead of holding it in memory (--stream). The document is not split into shards.
+
+    Args:
+        args: the parsed command line arguments
+
+    Returns:
+        the paths of all files the document was built from
+    """
+    logger.info("Streaming %s with arguments: %s", args.inp, args)
+    filepath = _base_dir(args) / args.inp
+    filestem = str(filepath.stem)
+    fmgr = PathMgr(filepath.parent)
+    css = _css_file(args)
+    template = str(_base_dir(args) / _HTML_TEMPLATE)
+    deps = {str(fmgr.get_resolved_path(filepath.name)), css, template}
+    images: Set[str] = set()
+    if args.shards > 1 or args.fragments:
+        logger.warning("Shards and fragments are not used when streaming.")
 
-    fmgr.write_lines(f"{filestem}_work.md", lines)
-    pdf = PdfBuilder(fmgr)
-    pdf.convert_to_pdf(
-        input_md_file=f"{filestem}_work.md",
-        output_pdf_file=f"{filestem}.pdf",
-        css_file=css,
-        html_template_file=str(Path.cwd() / _HTML_TEMPLATE),
+    pipeline = Pipeline.from_file(fmgr, filepath.name)
+    if args.asm == "y":
+        if args.vault or find_vault_root(fmgr.directory):
+            with profiler.stage("vault_index"):
+                fmgr.index_vault(_base_dir(args) / args.vault if args.vault else None)
+        pipeline = pipeline.then(iter_assemble, fmgr, max_depth=args.depth, deps=deps)
+    if args.toc == "y":
+        pipeline = pipeline.then(iter_toc)
+    prep = ImagePrep(args.image_dpi, args.page_width) if args.image_dpi else None
+    pipeline = pipeline.then(
+        iter_images,
+        str(fmgr.get_resolved_path()),
+        images,
+        index=fmgr.index,
+        prepare=prep.process_all if prep else None,
     )
 
+    output = fmgr.get_resolved_path(f"{filestem}.pdf")
+    cache = None
+    if not args.no_cache:
+        # The key takes a pass over the stream of its own. The images are only hashed after
+        # the lines, by which time the pass has collected them.
+        with profiler.stage("cache"):
+            cache = ArtifactCache(max_bytes=args.cache_size * 1024 * 1024)
+            key = cache.key(pipeline, [css, template], images, options=[args.engine, "shards:1"])
+            hit = cache.fetch(key, output)
+        profiler.count("cache.hits" if hit else "cache.misses")
+        if hit:
+            return deps | images
 
-def main():
+    with fmgr.lock(output.name):
+        pdf = PdfBuilder(fmgr, engine=args.engine, timeout=args.pdf_timeout or None)
+        if args.keep_work:
+            # Stream to the work file, and let pandoc read it from there
+            work = f"{filestem}_work.md"
+            write_to(pipeline, fmgr, work)
+            pdf.convert_to_pdf(
+                work, output_pdf_file=output.name, css_file=css, html_template_file=template
+            )
+        else:
+            pdf.convert_lines_to_pdf(
+                pipeline,
+                output_pdf_file=output.name,
+                css_file=css,
+                html_template_file=template,
+            )
+        if cache:
+            with profiler.stage("cache"):
+                cache.store(key, output)
+    return deps | images
+
+
+def _graph_dir(args) -> Optional[Path]:
+    return _base_dir(args) / args.graph if args.graph else None
+
+
+def build(args) -> Set[str]:
+    """
+    Builds one document (see wrench), and records what it was built from, and the names of the
+    links and images it did not find, in the persisted dependency graph.
+
+    Args:
+        args: the parsed command line arguments
+
+    Returns:
+        the paths of all files the document was built from
+    """
+    deps = wrench(args)
+    root = normalize(_base_dir(args) / args.inp)
+    graph = DepGraph()
+    paths = {normalize(d) for d in deps}
+    graph.set_deps(root, paths, missing_names(paths | {root}, links=args.asm == "y"))
+    graph.save(_graph_dir(args), [root])
+    return deps
+
+
+def affected(args) -> List[str]:
+    """
+    Looks up the root documents that must be rebuilt after some files changed, in the persisted
+    dependency graph. Only documents built (and so recorded) before are known.
+
+    Args:
+        args: the parsed command line arguments; `affected` holds the changed files, "-" reads
+            them from stdin, one per line (e.g. from `git diff --name-only`)
+
+    Returns:
+        the affected root documents, relative to the working directory where possible
+    """
+    changed = []
+    for path in args.affected:
+        if path == "-":
+            changed.extend(line.strip() for line in sys.stdin if line.strip())
+        else:
+            changed.append(path)
+    base = _base_dir(args)
+    roots = DepGraph.load(_graph_dir(args)).affected_roots(normalize(base / p) for p in changed)
+    logger.info("%s files changed, %s documents affected", len(changed), len(roots))
+    return sorted(os.path.relpath(r, base) if Path(r).is_relative_to(base) else r for r in roots)
+
+
+def select(args) -> List[str]:
+    """
+    Selects notes from the vault catalog, after bringing it up to date.
+
+    Args:
+        args: the parsed command line arguments; `select` holds KEY=VALUE (or KEY) metadata
+            criteria, and --links-to, --lang and --heading add more
+
+    Returns:
+        the matching notes, relative to the working directory where possible
+    """
+    base = _base_dir(args)
+    root = base / args.vault if args.vault else find_vault_root(base) or base
+    meta = {}
+    for criterion in args.select:
+        key, sep, value = criterion.partition("=")
+        meta[key.strip()] = value.strip() if sep else None
+    catalog_file = base / args.catalog if args.catalog else None
+    with Catalog(root, catalog_file) as catalog:
+        notes = catalog.refresh().select(meta, args.links_to, args.lang, args.heading)
+    logger.info("Selected %s notes from %s", len(notes), root)
+    return [os.path.relpath(p, base) if p.is_relative_to(base) else str(p) for p in notes]
+
+
+def rewrite(args) -> bool:
+    """
+    Applies the rules of a rules file to the input documents (--inp or --batch). With --dry-run
+    the changes are printed as unified diffs instead of written.
+
+    Args:
+        args: the parsed command line arguments
+
+    Returns:
+        True if every file could be rewritten
+    """
+    base = _base_dir(args)
+    paths = collect_inputs(args.batch) if args.batch else [base / args.inp]
+    results = rewrite_files(paths, load_rules(base / args.rewrite), args.dry_run, args.jobs)
+    if args.dry_run:
+        for r in results:
+            if r["diff"]:
+                sys.stdout.write(r["diff"])
+    return not any(r["error"] for r in results)
+
+
+def check(args) -> bool:
+    """
+    Runs the pre-flight checks on the input documents (--inp or --batch), without rendering
+    them, and prints the diagnostics to stdout as JSON, one per line.
+
+    Args:
+        args: the parsed command line arguments
+
+    Returns:
+        True if no check found an error (warnings are allowed)
+    """
+    base = _base_dir(args)
+    paths = collect_inputs(args.batch) if args.batch else [base / args.inp]
+    diagnostics = check_files([_css_file(args), str(base / _HTML_TEMPLATE)])
+    diagnostics += check_documents(
+        paths,
+        jobs=args.jobs,
+        asm=args.asm == "y",
+        toc=args.toc == "y",
+        vault=base / args.vault if args.vault else None,
+        max_depth=args.depth,
+    )
+    for d in diagnostics:
+        print(json.dumps(d))
+    return not any(d["severity"] == "error" for d in diagnostics)
+
+
+def _batch_job(args) -> Set[str]:
+    # Batch jobs run in their own process, so each one writes its own profile report
+    if not args.profile:
+        return build(args)
+    profiler.start()
+    try:
+        return build(args)
+    finally:
+        report = Path(args.profile)
+        profiler.stop().write(str(report.with_suffix(f".{Path(args.inp).stem}.json")))
+
+
+def run(args):
+    """
+    Runs textwrench in the mode selected by the command line arguments.
+
+    Args:
+        args: the parsed command line arguments
+    """
+    shared_cache().max_bytes = args.read_cache * 1024 * 1024
+    if args.check:
+        if not check(args):
+            sys.exit(1)
+    elif args.rewrite:
+        if not rewrite(args):
+            sys.exit(1)
+    elif args.watch:
+        roots = collect_inputs(args.batch) if args.batch else [Path(args.inp)]
+        Watcher(roots, args, build, args.interval, args.debounce).run()
+    elif args.batch:
+        if args.engine == "weasyprint":
+            htmlrender.warm_up([_css_file(args)])
+        results = run_batch(
+            collect_inputs(args.batch),
+            args,
+            _batch_job,
+            jobs=args.jobs,
+            timeout=args.timeout,
+            retries=args.retries,
+            mem_per_job=args.mem_per_job,
+        )
+        if not summarize(results, args.report):
+            sys.exit(1)
+    else:
+        build(args)
+
+
+def profiled(func, args):
+    """
+    Runs a function with the profiler (and optionally cProfile) enabled, then writes the reports.
+
+    Args:
+        func: the function to run, called with args
+        args: the parsed command line arguments
+    """
+    profiler.start()
+    cprof = cProfile.Profile() if args.pstats else None
+    if cprof:
+        cprof.enable()
+    try:
+        func(args)
+    finally:
+        if cprof:
+            cprof.disable()
+            cprof.dump_stats(args.pstats)
+            logger.info("Wrote pstats: %s", args.pstats)
+        report = profiler.stop()
+        if args.profile:
+            report.write(args.profile)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the command line parser.
+    """
     parser = argparse.ArgumentParser(
         prog="textwrench",
         description=DESCRIPTION,
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
-    parser.add_argument("--inp", "-i", type=str, required=True, help="input file path")
+    inputs = parser.add_mutually_exclusive_group(required=True)
+    inputs.add_argument("--inp", "-i", type=str, help="input file path")
+    inputs.add_argument(
+        "--batch",
+        "-b",
+        type=str,
+        nargs="+",
+        help="Batch mode: input directories, globs, or @manifest files",
+    )
+    inputs.add_argument(
+        "--affected",
+        type=str,
+        nargs="+",
+        metavar="FILE",
+        help="Print the root documents that must be rebuilt after these files changed, one per "
+        "line ('-' reads the changed files from stdin, e.g. from git diff --name-only)",
+    )
+    inputs.add_argument(
+        "--select",
+        type=str,
+        nargs="*",
+        metavar="KEY[=VALUE]",
+        help="Print the vault notes whose metadata (front matter or comment blocks) matches, one "
+        "per line. Values are case insensitive and may use * and ? wildcards.",
+    )
+    inputs.add_argument(
+        "--server",
+        action="store_true",
+        help="Run a render server, which builds the documents requested by other textwrench "
+        "invocations with warm caches",
+    )
+    inputs.add_argument(
+        "--server-status",
+        action="store_true",
+        help="Print the render server's queue, jobs and cache statistics as JSON",
+    )
+    inputs.add_argument(
+        "--server-stop", action="store_true", help="Stop the render server"
+    )
 
     parser.add_argument(
         "-a",
@@ -110,6 +525,21 @@ def main():
         required=False,
         help="Assemble markdown from linked documents, 'y' or 'n' (default 'n')",
     )
+    parser.add_argument(
+        "-d",
+        "--depth",
+        type=int,
+        default=32,
+        required=False,
+        help="Maximum depth of linked documents to assemble (default 32)",
+    )
+    parser.add_argument(
+        "--vault",
+        type=str,
+        required=False,
+        help="Vault root used to resolve linked documents anywhere in the vault "
+        "(default: the enclosing Obsidian vault, if any)",
+    )
     parser.add_argument(
         "-t",
         "--toc",
@@ -127,6 +557,237 @@ def main():
         help="Which CSS template to use, 's' = standard or 'p' = profesional (default 's')",
     )
 
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="Only show warnings and errors, and a summary of the other messages at the end",
+    )
+    parser.add_argument(
+        "--graph",
+        type=str,
+        help="Directory of the persisted dependency graph, recorded by every build and used by "
+        "--affected (default: in the textwrench cache directory)",
+    )
+    parser.add_argument(
+        "--pdf-timeout",
+        type=float,
+        default=0,
+        help="Kill pandoc (and weasyprint) if a conversion takes longer than this many seconds (default 0 = no limit)",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=0,
+        help="Split an assembled document at its chapters into up to this many parts, render them in parallel and merge the PDFs (needs pypdf, default 0 = off)",
+    )
+    parser.add_argument(
+        "--fragments",
+        action="store_true",
+        help="Convert each chapter of an assembled document to HTML separately, and cache the "
+        "HTML, so that only the chapters that changed go through pandoc (no shards)",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Stream the document through the build stages to pandoc, line by line, instead of "
+        "holding it in memory. For very large documents; no shards.",
+    )
+    parser.add_argument(
+        "--keep-work",
+        action="store_true",
+        help="Also write the final markdown to <input>_work.md, for debugging",
+    )
+    parser.add_argument(
+        "--read-cache",
+        type=int,
+        default=64,
+        help="Memory budget in MB for caching the contents of documents read (default 64, 0 = off)",
+    )
+    parser.add_argument(
+        "--io-workers",
+        type=int,
+        default=0,
+        help="Resolve image links on this many threads, useful on network mounts (default 0 = serial)",
+    )
+    parser.add_argument(
+        "--image-dpi",
+        type=int,
+        default=0,
+        help="Downsample and recompress images to this resolution before rendering (needs Pillow, default 0 = off)",
+    )
+    parser.add_argument(
+        "--page-width",
+        type=float,
+        default=DEFAULT_PAGE_WIDTH,
+        help=f"Printable page width in inches, used with --image-dpi (default {DEFAULT_PAGE_WIDTH})",
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        type=str,
+        choices=ENGINES,
+        default="pandoc",
+        help="PDF engine: 'pandoc' runs pandoc + weasyprint, 'weasyprint' renders the HTML "
+        "in-process with the weasyprint Python package (default 'pandoc')",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always render, do not use the artifact cache",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=1024,
+        required=False,
+        help="Maximum size of the artifact cache in MB (default 1024)",
+    )
+
+    watch = parser.add_argument_group("watch mode")
+    watch.add_argument(
+        "-w",
+        "--watch",
+        action="store_true",
+        help="Keep running, and rebuild documents when the files they are built from change",
+    )
+    watch.add_argument(
+        "--interval",
+        type=float,
+        default=1.0,
+        help="Seconds between checks for changed files (default 1.0)",
+    )
+    watch.add_argument(
+        "--debounce",
+        type=float,
+        default=0.5,
+        help="Seconds to wait for edits to settle before rebuilding (default 0.5)",
+    )
+
+    profiling = parser.add_argument_group("profiling")
+    profiling.add_argument(
+        "--profile",
+        type=str,
+        help="Write a JSON report of per-stage timings, counters and peak memory to this file",
+    )
+    profiling.add_argument(
+        "--pstats",
+        type=str,
+        help="Also run cProfile, and dump the pstats data to this file",
+    )
+
+    batch = parser.add_argument_group("batch mode")
+    batch.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=0,
+        help="Maximum number of documents built in parallel (default: one per CPU)",
+    )
+    batch.add_argument(
+        "--timeout",
+        type=float,
+        default=600,
+        help="Seconds after which a document build is killed, 0 = no limit (default 600)",
+    )
+    batch.add_argument(
+        "--retries",
+        type=int,
+        default=1,
+        help="How many times a failed document build is retried (default 1)",
+    )
+    batch.add_argument(
+        "--mem-per-job",
+        type=int,
+        default=1024,
+        help="Free memory in MB required to start another build, 0 = no check (default 1024)",
+    )
+    batch.add_argument("--report", type=str, help="Write a JSON summary report to this file")
+
+    bulk = parser.add_argument_group("bulk rewrite")
+    bulk.add_argument(
+        "--rewrite",
+        type=str,
+        metavar="RULES",
+        help="Apply the replacement rules in this JSON file to the input documents (--inp or "
+        "--batch) instead of building them. Code blocks, comments and front matter are left alone.",
+    )
+    bulk.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="With --rewrite, print the changes as unified diffs instead of writing them",
+    )
+
+    preflight = parser.add_argument_group("pre-flight check")
+    preflight.add_argument(
+        "--check",
+        action="store_true",
+        help="Check the input documents (--inp or --batch) instead of building them: wiki links, "
+        "images, internal anchors, the TOC marker, CSS and template. Prints one JSON diagnostic "
+        "per line, and exits with 1 if any check found an error.",
+    )
+
+    catalog = parser.add_argument_group("vault catalog (--select)")
+    catalog.add_argument(
+        "--links-to", type=str, help="Only notes with a wiki link to this note"
+    )
+    catalog.add_argument(
+        "--lang", type=str, help="Only notes with a code fence in this language"
+    )
+    catalog.add_argument(
+        "--heading", type=str, help="Only notes with a heading with this text"
+    )
+    catalog.add_argument(
+        "--catalog",
+        type=str,
+        help="The catalog database (default: named after the vault, in the textwrench cache "
+        "directory)",
+    )
+
+    server = parser.add_argument_group("render server")
+    server.add_argument(
+        "--socket",
+        type=str,
+        help="The render server's unix socket (default: in the textwrench cache directory)",
+    )
+    server.add_argument(
+        "--no-server",
+        action="store_true",
+        help="Build in this process, even if a render server is running",
+    )
+    return parser
+
+
+def serve(parser: argparse.ArgumentParser, args):
+    """
+    Runs the render server until it is stopped.
+
+    Args:
+        parser: the command line parser, used for the forwarded arguments
+        args: the parsed command line arguments of the server
+    """
+    shared_cache().max_bytes = args.read_cache * 1024 * 1024
+    if args.engine == "weasyprint":
+        htmlrender.warm_up([_css_file(args)])
+
+    def stats():
+        return {"content_cache": shared_cache().stats(), "weasyprint": htmlrender.cached()}
+
+    server = RenderServer(parser.parse_args, build, args.socket, workers=args.jobs, stats=stats)
+    server.serve_forever()
+
+
+def _forwardable(args) -> bool:
+    # Only single builds; watch and batch mode manage their own processes, and the profiler
+    # measures the process it runs in
+    return bool(args.inp) and not (
+        args.no_server or args.watch or args.rewrite or args.check or args.profile or args.pstats
+    )
+
+
+def main():
+    parser = build_parser()
+
     # No arguments, show the help
     if len(sys.argv) == 1:
         parser.print_help()
@@ -135,12 +796,43 @@ def main():
     # Parse the arguments
     try:
         args = parser.parse_args()
-        wrench(args)
+        configure_logging(quiet=args.quiet)
+        if args.server:
+            serve(parser, args)
+            return
+        if args.server_status or args.server_stop:
+            response = request({"op": "status" if args.server_status else "shutdown"}, args.socket)
+            if response is None:
+                print("No render server is running.")
+                sys.exit(1)
+            print(json.dumps(response, indent=2))
+            return
+        if args.select is not None:
+            for note in select(args):
+                print(note)
+            return
+        if args.affected:
+            for root in affected(args):
+                print(root)
+            return
+        if _forwardable(args):
+            result = forward(sys.argv[1:], os.getcwd(), args.socket)
+            if result is not None:
+                logger.info("Built by the render server in %.2f s", result.get("duration", 0))
+                if not result["ok"]:
+                    logger.error(result["error"])
+                    sys.exit(1)
+                return
+        if args.profile or args.pstats:
+            profiled(run, args)
+        else:
+            run(args)
+        logger.info("Processing complete.")
     except SystemExit:
         # argparse prints help automatically on error, we just exit
         sys.exit(1)
-
-    logger.info("Processing complete.")
+    finally:
+        shutdown_logging()
 
 
 if __name__ == "__main__":
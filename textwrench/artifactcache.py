@@ -0,0 +1,259 @@
+"""
+Filename: artifactcache.py
+
+Author: mg4news
+
+Date: 2025-09-04
+
+License: Unlicense
+
+Description:
+    Content addressed cache for rendered artifacts (PDFs). The key is a hash of everything that
+    goes into a render: the final markdown, the CSS, the HTML template, the referenced images and
+    the versions of the external tools. If the key is in the cache, the PDF is copied out of it
+    instead of running pandoc/weasyprint. Entries are evicted by age and by total size.
+"""
+
+import functools
+import hashlib
+import importlib.metadata
+import json
+import logging
+import os
+import shutil
+import subprocess
+import time
+from pathlib import Path
+from typing import Iterable, List, Optional
+from textwrench.cachedir import cache_dir
+
+logger = logging.getLogger(__name__)
+
+_DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+_DEFAULT_MAX_AGE = 30 * 24 * 3600
+_TOOLS = ("pandoc", "weasyprint")
+# Tools that are also Python packages; their version comes from the package metadata
+_PACKAGES = ("weasyprint",)
+
+
+def _run_version(tool: str) -> str:
+    try:
+        result = subprocess.run(
+            [tool, "--version"], check=True, capture_output=True, text=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return "missing"
+    lines = result.stdout.strip().splitlines()
+    return lines[0] if lines else "unknown"
+
+
+def _executable_version(tool: str) -> str:
+    # `<tool> --version`, kept on disk until the executable changes: running pandoc (or the
+    # weasyprint script) takes longer than the cache lookup it is needed for
+    path = shutil.which(tool)
+    if path is None:
+        return "missing"
+    st = os.stat(path)
+    executable = f"{path}:{st.st_mtime_ns}:{st.st_size}"
+    cache_file = cache_dir("tools") / f"{tool}.json"
+    try:
+        with open(cache_file, "r") as f:
+            cached = json.load(f)
+        if cached.get("executable") == executable:
+            return cached["version"]
+    except (OSError, ValueError, KeyError):
+        pass
+    version = _run_version(tool)
+    tmp = cache_file.with_name(f".{cache_file.name}.{os.getpid()}.tmp")
+    with open(tmp, "w") as f:
+        json.dump({"executable": executable, "version": version}, f)
+    os.replace(tmp, cache_file)
+    return version
+
+
+@functools.lru_cache(maxsize=None)
+def tool_version(tool: str) -> str:
+    """
+    Returns the version of an external tool. The version of a Python package (weasyprint) is
+    read from its metadata; otherwise it is the first line of `<tool> --version`, cached on disk
+    per executable (path, mtime and size). Cached for the life of the process.
+
+    Args:
+        tool (str): the executable name
+
+    Returns:
+        the version string, or "missing" if the tool cannot be run
+    """
+    if tool in _PACKAGES:
+        try:
+            return f"{tool} {importlib.metadata.version(tool)}"
+        except importlib.metadata.PackageNotFoundError:
+            pass
+    return _executable_version(tool)
+
+
+def _hash_file(h, path: str):
+    h.update(path.encode())
+    try:
+        with open(path, "rb") as f:
+            h.update(hashlib.file_digest(f, "sha256").digest())
+    except OSError:
+        h.update(b"<missing>")
+
+
+class ArtifactCache:
+
+    def __init__(
+        self,
+        directory: str | Path | None = None,
+        max_bytes: int = _DEFAULT_MAX_BYTES,
+        max_age: float = _DEFAULT_MAX_AGE,
+    ) -> None:
+        """
+        Initialize an artifact cache.
+
+        Args:
+            directory (str or Path object): the cache directory. Defaults to `artifacts` in
+                the textwrench cache directory.
+            max_bytes (int): the maximum total size of the cached artifacts
+            max_age (float): the maximum time, in seconds, since an artifact was last used
+        """
+        self.directory = Path(directory) if directory else cache_dir("artifacts")
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+    def key(
+        self,
+        lines: Iterable[str],
+        files: Iterable[str],
+        images: Iterable[str],
+        options: Optional[List[str]] = None,
+    ) -> str:
+        """
+        Computes the cache key for a render.
+
+        Args:
+            lines (Iterable[str]): the final markdown lines handed to pandoc
+            files (Iterable[str]): the paths of the CSS, HTML template, etc.
+            images (Iterable[str]): the paths of the referenced images
+            options (List[str]): any other options that change the output
+
+        Returns:
+            the hex digest key
+        """
+        h = hashlib.sha256()
+        for tool in _TOOLS:
+            h.update(tool_version(tool).encode())
+        for option in options or []:
+            h.update(option.encode())
+            h.update(b"\0")
+        for line in lines:
+            h.update(line.encode())
+        for path in files:
+            _hash_file(h, path)
+        for path in sorted(set(images)):
+            _hash_file(h, path)
+        return h.hexdigest()
+
+    def _entry(self, key: str, suffix: str) -> Path:
+        return self.directory / f"{key}{suffix}"
+
+    def fetch(self, key: str, dest: Path) -> bool:
+        """
+        Copies a cached artifact to its destination, if there is one.
+
+        Args:
+            key (str): the cache key
+            dest (Path): where to copy the artifact to
+
+        Returns:
+            True if the artifact was in the cache, False otherwise
+        """
+        entry = self._entry(key, dest.suffix)
+        try:
+            shutil.copyfile(entry, dest)
+        except FileNotFoundError:
+            logger.info("Artifact cache miss: %s", dest.name)
+            return False
+        os.utime(entry)
+        logger.info("Artifact cache hit: %s (%s)", dest.name, key[:12])
+        return True
+
+    def store(self, key: str, src: Path):
+        """
+        Stores a freshly rendered artifact, then evicts old entries.
+
+        Args:
+            key (str): the cache key
+            src (Path): the rendered artifact
+        """
+        entry = self._entry(key, src.suffix)
+        tmp = entry.with_name(f".{entry.name}.{os.getpid()}.tmp")
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, entry)
+        logger.info("Stored artifact in cache: %s (%s)", src.name, key[:12])
+        self.evict()
+
+    def get_bytes(self, key: str, suffix: str) -> Optional[bytes]:
+        """
+        Returns the content of a cached artifact, for artifacts kept in memory (e.g. HTML
+        fragments) rather than copied to a file.
+
+        Args:
+            key (str): the cache key
+            suffix (str): the artifact's file suffix, e.g. ".html"
+
+        Returns:
+            the content, or None if it is not in the cache
+        """
+        entry = self._entry(key, suffix)
+        try:
+            data = entry.read_bytes()
+        except FileNotFoundError:
+            return None
+        os.utime(entry)
+        return data
+
+    def put_bytes(self, key: str, suffix: str, data: bytes):
+        """
+        Stores the content of an artifact. Unlike store, this does not evict; call evict once
+        a set of artifacts is stored.
+
+        Args:
+            key (str): the cache key
+            suffix (str): the artifact's file suffix, e.g. ".html"
+            data (bytes): the content
+        """
+        entry = self._entry(key, suffix)
+        tmp = entry.with_name(f".{entry.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, entry)
+
+    def evict(self):
+        """
+        Removes entries not used within max_age, then the least recently used entries
+        until the cache is within max_bytes.
+        """
+        now = time.time()
+        entries = []
+        for path in self.directory.iterdir():
+            if path.name.startswith("."):
+                continue
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            if now - st.st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+                logger.info("Evicted expired artifact: %s", path.name)
+            else:
+                entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            logger.info("Evicted artifact to limit cache size: %s", path.name)
@@ -0,0 +1,293 @@
+"""
+Filename: batch.py
+
+Author: mg4news
+
+Date: 2025-09-06
+
+License: Unlicense
+
+Description:
+    Batch mode. Collects input documents from directories, globs and manifests, and runs the
+    full pipeline (assemble -> TOC -> imgfix -> PdfBuilder) for each document on a pool of worker
+    processes. The scheduler limits concurrency, only admits a new job when there is enough free
+    memory, kills jobs (including their pandoc/weasyprint children) that exceed a timeout, retries
+    failed jobs, and produces a summary report.
+"""
+
+import copy
+import glob
+import json
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable, List, Optional
+from textwrench.models import BatchResult
+
+logger = logging.getLogger(__name__)
+
+_POLL_INTERVAL = 0.5
+# A job that started less than this many seconds ago may not have allocated its memory yet
+_WARMUP = 5.0
+_WORK_SUFFIX = "_work.md"
+
+
+def _expand_spec(spec: str) -> List[Path]:
+    path = Path(spec)
+    if path.is_dir():
+        return sorted(p for p in path.glob("*.md") if p.is_file())
+    if glob.has_magic(spec):
+        return sorted(Path(p) for p in glob.glob(spec, recursive=True) if Path(p).is_file())
+    return [path]
+
+
+def collect_inputs(specs: List[str]) -> List[Path]:
+    """
+    Collects the input documents for a batch. Each spec is one of:
+    - a directory: every markdown file directly inside it
+    - a glob, e.g. `vault/**/report-*.md`
+    - a manifest, prefixed with @: a text file with one path or glob per line (# starts a comment)
+    - a plain file path
+
+    Intermediate `_work.md` files are skipped, and duplicates are removed.
+
+    Args:
+        specs (List[str]): the input specifications
+
+    Returns:
+        a list of resolved document paths, in the order they were specified
+    """
+    found: List[Path] = []
+    for spec in specs:
+        if spec.startswith("@"):
+            manifest = Path(spec[1:])
+            with open(manifest, "r") as f:
+                entries = [e.split("#", 1)[0].strip() for e in f]
+            for entry in filter(None, entries):
+                # Manifest entries are relative to the manifest itself
+                entry_path = Path(entry)
+                if not entry_path.is_absolute():
+                    entry = str(manifest.parent / entry_path)
+                found.extend(_expand_spec(entry))
+        else:
+            found.extend(_expand_spec(spec))
+
+    inputs = []
+    seen = set()
+    for path in found:
+        path = path.resolve()
+        if path.name.endswith(_WORK_SUFFIX) or path in seen:
+            continue
+        seen.add(path)
+        inputs.append(path)
+    logger.info("Collected %s input documents from %s specs", len(inputs), len(specs))
+    return inputs
+
+
+def available_memory_mb() -> Optional[int]:
+    """
+    Returns the memory available for new processes (MemAvailable), in MB.
+
+    Returns:
+        the available memory, or None if it cannot be determined on this platform
+    """
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _worker(build: Callable, args, conn):
+    # Own process group, so that a timeout also kills pandoc/weasyprint
+    if hasattr(os, "setsid"):
+        os.setsid()
+    try:
+        build(args)
+    except BaseException as e:
+        conn.send(f"{type(e).__name__}: {e}")
+        conn.close()
+        os._exit(1)
+    conn.close()
+    os._exit(0)
+
+
+def _receive_error(conn) -> Optional[str]:
+    try:
+        return conn.recv() if conn.poll() else None
+    except EOFError:
+        return None
+
+
+def _kill(process: multiprocessing.Process):
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+    process.kill()
+    process.join()
+
+
+class _Running:
+
+    __slots__ = ("result", "process", "conn", "started")
+
+    def __init__(self, result: BatchResult, process, conn) -> None:
+        self.result = result
+        self.process = process
+        self.conn = conn
+        self.started = time.monotonic()
+
+
+def run_batch(
+    inputs: List[Path],
+    args,
+    build: Callable,
+    jobs: int = 0,
+    timeout: float = 600.0,
+    retries: int = 1,
+    mem_per_job: int = 1024,
+) -> List[BatchResult]:
+    """
+    Runs a build for each input document on a pool of worker processes.
+
+    Args:
+        inputs (List[Path]): the input documents
+        args: the parsed command line arguments, copied per job with `inp` set to the document
+        build (Callable): the pipeline to run for each job, called with the job's arguments
+        jobs (int): the maximum number of concurrent jobs. 0 means one per CPU.
+        timeout (float): seconds after which a job is killed. 0 disables the timeout.
+        retries (int): how many times a failed or timed out job is retried
+        mem_per_job (int): memory (MB) a job is expected to need. A job is only started when
+            that much memory is available; 0 disables the check.
+
+    Returns:
+        a list of results, one per input document, in input order
+    """
+    jobs = jobs or os.cpu_count() or 1
+    ctx = multiprocessing.get_context(
+        "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+    )
+    results = [
+        BatchResult(inp=str(p), status="pending", attempts=0, duration=0.0, error=None)
+        for p in inputs
+    ]
+    pending = deque(results)
+    running: List[_Running] = []
+    logger.info(
+        "Batch of %s documents: %s jobs, timeout %ss, %s retries, %s MB per job",
+        len(inputs),
+        jobs,
+        timeout,
+        retries,
+        mem_per_job,
+    )
+
+    def admit() -> bool:
+        if not running or not mem_per_job:
+            return True
+        available = available_memory_mb()
+        if available is None:
+            return True
+        now = time.monotonic()
+        warming = sum(1 for r in running if now - r.started < _WARMUP)
+        return available - warming * mem_per_job >= mem_per_job
+
+    def finish(job: _Running, status: str, error: Optional[str]):
+        result = job.result
+        result["duration"] += time.monotonic() - job.started
+        result["error"] = error
+        if status != "ok" and result["attempts"] <= retries:
+            logger.warning("Retrying %s (%s): %s", result["inp"], status, error)
+            pending.append(result)
+            return
+        result["status"] = status
+        log = logger.info if status == "ok" else logger.error
+        log("Batch job %s: %s (%.1fs)", status, result["inp"], result["duration"])
+
+    try:
+        while pending or running:
+            while pending and len(running) < jobs and admit():
+                result = pending.popleft()
+                result["attempts"] += 1
+                job_args = copy.copy(args)
+                job_args.inp = result["inp"]
+                recv, send = ctx.Pipe(duplex=False)
+                # Not a daemon: a build may start worker processes of its own (e.g. a sharded
+                # weasyprint render)
+                process = ctx.Process(target=_worker, args=(build, job_args, send))
+                process.start()
+                send.close()
+                running.append(_Running(result, process, recv))
+
+            multiprocessing.connection.wait(
+                [r.process.sentinel for r in running], timeout=_POLL_INTERVAL
+            )
+            now = time.monotonic()
+            for job in list(running):
+                if not job.process.is_alive():
+                    job.process.join()
+                    error = _receive_error(job.conn)
+                    if job.process.exitcode and not error:
+                        error = f"exit code {job.process.exitcode}"
+                elif timeout and now - job.started > timeout:
+                    _kill(job.process)
+                    error = f"timed out after {timeout}s"
+                else:
+                    continue
+                job.conn.close()
+                running.remove(job)
+                if error is None:
+                    finish(job, "ok", None)
+                else:
+                    finish(job, "timeout" if error.startswith("timed out") else "failed", error)
+    except BaseException:
+        # The workers are not daemons, so they would outlive an interrupted batch
+        for job in running:
+            _kill(job.process)
+        raise
+
+    return results
+
+
+def summarize(results: List[BatchResult], report_file: str | None = None) -> bool:
+    """
+    Logs a summary of a batch run, and optionally writes it as a JSON report.
+
+    Args:
+        results (List[BatchResult]): the batch results
+        report_file (str): the path of the JSON report, if one is wanted
+
+    Returns:
+        True if every job succeeded, False otherwise
+    """
+    failed = [r for r in results if r["status"] != "ok"]
+    total = sum(r["duration"] for r in results)
+    logger.info(
+        "Batch summary: %s ok, %s failed, %.1fs of job time",
+        len(results) - len(failed),
+        len(failed),
+        total,
+    )
+    for r in failed:
+        logger.error(
+            "  %s: %s after %s attempts - %s", r["status"], r["inp"], r["attempts"], r["error"]
+        )
+    if report_file:
+        with open(report_file, "w") as f:
+            json.dump(
+                {"ok": len(results) - len(failed), "failed": len(failed), "jobs": results},
+                f,
+                indent=2,
+            )
+        logger.info("Wrote batch report: %s", report_file)
+    return not failed
@@ -0,0 +1,35 @@
+"""
+Filename: cachedir.py
+
+Author: mg4news
+
+Date: 2025-09-02
+
+License: Unlicense
+
+Description:
+    Location of the local textwrench cache directory. Follows the XDG convention, and can be
+    overridden with the TEXTWRENCH_CACHE_DIR environment variable.
+"""
+
+import os
+from pathlib import Path
+
+
+def cache_dir(*parts: str) -> Path:
+    """
+    Returns a directory inside the textwrench cache directory, creating it if needed.
+
+    Args:
+        parts (str): sub directory names
+
+    Returns:
+        Path: the cache (sub) directory
+    """
+    base = os.environ.get("TEXTWRENCH_CACHE_DIR")
+    if not base:
+        xdg = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+        base = str(Path(xdg) / "textwrench")
+    path = Path(base, *parts)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
@@ -0,0 +1,425 @@
+"""
+Filename: catalog.py
+
+Author: mg4news
+
+Date: 2025-10-04
+
+License: Unlicense
+
+Description:
+    Vault catalog. An SQLite database of every note in a vault: its path, the metadata in its front
+    matter and HTML comment blocks, its outgoing wiki links and image links, its headings and the
+    languages of its code fences. The catalog is maintained incrementally: a refresh stats every
+    note, and only parses the notes whose mtime or size changed, so selecting documents by metadata
+    is a database query instead of a re-parse of the vault.
+    The metadata parser understands the simple YAML used in notes: `key: value`, `key: [a, b]`
+    and block lists (`key:` followed by `- item` lines). Every value is stored as text.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from textwrench.cachedir import cache_dir
+from textwrench.document import Document, COMMENT, IMAGE_REF_RE
+from textwrench.models import Heading
+from textwrench import profiler
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA_VERSION = 1
+_NOTE_SUFFIX = ".md"
+_KEY_RE = re.compile(r"^([A-Za-z_][\w\- ]*?)\s*:\s*(.*)$")
+_LIST_ITEM_RE = re.compile(r"^\s*-\s*(.+?)\s*$")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    name TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    note INTEGER NOT NULL REFERENCES notes(id) ON DELETE CASCADE,
+    source TEXT NOT NULL,
+    key TEXT NOT NULL COLLATE NOCASE,
+    value TEXT NOT NULL COLLATE NOCASE
+);
+CREATE TABLE IF NOT EXISTS links (
+    note INTEGER NOT NULL REFERENCES notes(id) ON DELETE CASCADE,
+    line INTEGER NOT NULL,
+    target TEXT NOT NULL COLLATE NOCASE,
+    embed INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS images (
+    note INTEGER NOT NULL REFERENCES notes(id) ON DELETE CASCADE,
+    line INTEGER NOT NULL,
+    target TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS headings (
+    note INTEGER NOT NULL REFERENCES notes(id) ON DELETE CASCADE,
+    line INTEGER NOT NULL,
+    depth INTEGER NOT NULL,
+    text TEXT NOT NULL COLLATE NOCASE
+);
+CREATE TABLE IF NOT EXISTS fences (
+    note INTEGER NOT NULL REFERENCES notes(id) ON DELETE CASCADE,
+    line INTEGER NOT NULL,
+    lang TEXT COLLATE NOCASE
+);
+CREATE INDEX IF NOT EXISTS meta_key_value ON meta(key, value);
+CREATE INDEX IF NOT EXISTS meta_note ON meta(note);
+CREATE INDEX IF NOT EXISTS links_target ON links(target);
+CREATE INDEX IF NOT EXISTS links_note ON links(note);
+CREATE INDEX IF NOT EXISTS images_note ON images(note);
+CREATE INDEX IF NOT EXISTS headings_note ON headings(note);
+CREATE INDEX IF NOT EXISTS headings_text ON headings(text);
+CREATE INDEX IF NOT EXISTS fences_lang ON fences(lang);
+CREATE INDEX IF NOT EXISTS fences_note ON fences(note);
+"""
+
+_TABLES = ("meta", "links", "images", "headings", "fences")
+
+
+def _strip_quotes(value: str) -> str:
+    return value.strip().strip("\"'").strip()
+
+
+def parse_metadata(lines: Iterable[str]) -> List[Tuple[str, str]]:
+    """
+    Parses simple YAML metadata: `key: value`, `key: [a, b]` and block lists. Nested mappings
+    and multi-line strings are not supported; their lines are skipped.
+
+    Args:
+        lines (Iterable[str]): the metadata lines, without the `---` or comment delimiters
+
+    Returns:
+        a list of (key, value) pairs, one per list item
+    """
+    pairs: List[Tuple[str, str]] = []
+    key = None
+    for line in lines:
+        if not line.strip() or line.lstrip().startswith("#"):
+            continue
+        item = _LIST_ITEM_RE.match(line) if key else None
+        if item:
+            pairs.append((key, _strip_quotes(item.group(1))))
+            continue
+        match = _KEY_RE.match(line.strip()) if not line[0].isspace() else None
+        if not match:
+            key = None
+            continue
+        key, value = match.group(1), match.group(2).strip()
+        if value.startswith("[") and value.endswith("]"):
+            pairs.extend((key, _strip_quotes(v)) for v in value[1:-1].split(",") if v.strip())
+        elif value:
+            pairs.append((key, _strip_quotes(value)))
+            key = None
+    return pairs
+
+
+def _link_target(target: str) -> str:
+    # The note a wiki link points at: no heading or block reference, no .md suffix
+    target = target.split("#", 1)[0].strip()
+    return target[: -len(_NOTE_SUFFIX)] if target.lower().endswith(_NOTE_SUFFIX) else target
+
+
+def _metadata(doc: Document) -> List[Tuple[str, str, str]]:
+    rows = []
+    front = doc.front_matter
+    if front:
+        for key, value in parse_metadata(doc.lines[front["start"] + 1 : front["end"]]):
+            rows.append(("front", key, value))
+    for block in doc.blocks(COMMENT):
+        body = doc.lines[block["start"] : block["end"] + 1]
+        body[0] = body[0].split("<!--", 1)[-1]
+        body[-1] = body[-1].rsplit("-->", 1)[0]
+        for key, value in parse_metadata(body):
+            rows.append(("comment", key, value))
+    return rows
+
+
+class Catalog:
+
+    def __init__(self, root: str | Path, db_file: str | Path | None = None) -> None:
+        """
+        Initialize a vault catalog, opening (or creating) its database. Call refresh() to bring
+        it up to date.
+
+        Args:
+            root (str or Path object): the root directory of the vault
+            db_file (str or Path object): the SQLite database. Defaults to a file named after the
+                vault root in the textwrench cache directory.
+        """
+        self.root = Path(root).resolve()
+        if db_file:
+            self.db_file = Path(db_file)
+        else:
+            key = hashlib.sha256(str(self.root).encode()).hexdigest()[:16]
+            self.db_file = cache_dir("catalogs") / f"{self.root.name}-{key}.sqlite"
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.db_file)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != _SCHEMA_VERSION:
+            # Built by another version: start over, it is only a cache of the vault
+            for table in ("notes", *_TABLES):
+                self.db.execute(f"DROP TABLE IF EXISTS {table}")
+            self.db.executescript(_SCHEMA)
+            self.db.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+            self.db.commit()
+        self.notes_parsed = 0
+
+    def __enter__(self) -> "Catalog":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM notes").fetchone()[0]
+
+    def close(self):
+        """
+        Closes the database.
+        """
+        self.db.close()
+
+    def _walk(self) -> Dict[str, Tuple[int, int]]:
+        # Every note in the vault: relative path -> (mtime, size). Hidden folders (.obsidian,
+        # .trash, .git) are skipped, like in the vault index.
+        found = {}
+        pending = [self.root]
+        while pending:
+            path = pending.pop()
+            try:
+                it = os.scandir(path)
+            except OSError:
+                continue
+            with it:
+                for entry in it:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(Path(entry.path))
+                    elif entry.name.endswith(_NOTE_SUFFIX) and entry.is_file():
+                        st = entry.stat()
+                        rel = Path(entry.path).relative_to(self.root).as_posix()
+                        found[rel] = (st.st_mtime_ns, st.st_size)
+        profiler.count("catalog.stat", len(found))
+        return found
+
+    def _index_note(self, rel: str, stamp: Tuple[int, int], note_id: Optional[int]):
+        try:
+            with open(self.root / rel, "r", encoding="utf-8") as f:
+                doc = Document(f.readlines())
+        except (OSError, UnicodeDecodeError) as e:
+            logger.warning("Could not catalog %s: %s", rel, e)
+            return
+        if note_id is None:
+            name = Path(rel).name[: -len(_NOTE_SUFFIX)]
+            note_id = self.db.execute(
+                "INSERT INTO notes (path, name, mtime_ns, size) VALUES (?, ?, ?, ?)",
+                (rel, name, *stamp),
+            ).lastrowid
+        else:
+            self.db.execute(
+                "UPDATE notes SET mtime_ns = ?, size = ? WHERE id = ?", (*stamp, note_id)
+            )
+            for table in _TABLES:
+                self.db.execute(f"DELETE FROM {table} WHERE note = ?", (note_id,))
+        db = self.db
+        db.executemany(
+            "INSERT INTO meta VALUES (?, ?, ?, ?)", ((note_id, *m) for m in _metadata(doc))
+        )
+        db.executemany(
+            "INSERT INTO links VALUES (?, ?, ?, ?)",
+            (
+                (note_id, link["line"], _link_target(link["target"]), link["embed"])
+                for link in doc.wiki_links
+            ),
+        )
+        db.executemany(
+            "INSERT INTO images VALUES (?, ?, ?)",
+            (
+                (note_id, i, m.group("link") or m.group("embed") or m.group("src"))
+                for i in doc.image_lines
+                for m in IMAGE_REF_RE.finditer(doc.lines[i])
+            ),
+        )
+        db.executemany(
+            "INSERT INTO headings VALUES (?, ?, ?, ?)",
+            ((note_id, h["line"], h["depth"], h["text"]) for h in doc.headings),
+        )
+        db.executemany(
+            "INSERT INTO fences VALUES (?, ?, ?)",
+            ((note_id, b["start"], b["lang"]) for b in doc.fences()),
+        )
+        self.notes_parsed += 1
+
+    @profiler.timed("catalog")
+    def refresh(self, full: bool = False) -> "Catalog":
+        """
+        Brings the catalog up to date: notes whose mtime or size changed (and new notes) are
+        parsed again, and deleted notes are removed. All in one transaction.
+
+        Args:
+            full (bool): parse every note again
+
+        Returns:
+            the catalog itself, for chaining
+        """
+        found = self._walk()
+        known = {
+            path: (note_id, (mtime, size))
+            for note_id, path, mtime, size in self.db.execute(
+                "SELECT id, path, mtime_ns, size FROM notes"
+            )
+        }
+        self.notes_parsed = 0
+        with self.db:
+            gone = [(known[path][0],) for path in known.keys() - found.keys()]
+            self.db.executemany("DELETE FROM notes WHERE id = ?", gone)
+            for rel, stamp in found.items():
+                note_id, old = known.get(rel, (None, None))
+                if full or old != stamp:
+                    self._index_note(rel, stamp, note_id)
+        profiler.count("catalog.notes_parsed", self.notes_parsed)
+        logger.info(
+            "Catalog refreshed: %s notes, %s parsed, %s removed",
+            len(found),
+            self.notes_parsed,
+            len(gone),
+        )
+        return self
+
+    def select(
+        self,
+        meta: Optional[Dict[str, Optional[str]]] = None,
+        links_to: Optional[str] = None,
+        lang: Optional[str] = None,
+        heading: Optional[str] = None,
+    ) -> List[Path]:
+        """
+        Selects notes. All the given criteria must match; values are compared case-insensitively,
+        and may use the glob wildcards * and ?.
+
+        Args:
+            meta (Dict[str, str]): metadata key -> value, from the front matter or a comment
+                block. A value of None only requires the key to be present.
+            links_to (str): the note has a wiki link to this note name (or vault relative path)
+            lang (str): the note has a code fence in this language
+            heading (str): the note has a heading with this text
+
+        Returns:
+            the absolute paths of the matching notes, sorted
+        """
+        where = []
+        params: List[str] = []
+
+        def value_match(column: str, value: str) -> str:
+            # The columns are NOCASE, so an exact match can use the index; GLOB cannot
+            if any(c in value for c in "*?["):
+                params.append(value.lower())
+                return f"lower({column}) GLOB ?"
+            params.append(value)
+            return f"{column} = ?"
+
+        for key, value in (meta or {}).items():
+            params.append(key)
+            cond = "key = ?"
+            if value is not None:
+                cond += " AND " + value_match("value", value)
+            where.append(f"n.id IN (SELECT note FROM meta WHERE {cond})")
+        for table, column, value in (
+            ("links", "target", _link_target(links_to) if links_to is not None else None),
+            ("fences", "lang", lang),
+            ("headings", "text", heading),
+        ):
+            if value is not None:
+                cond = value_match(column, value)
+                where.append(f"n.id IN (SELECT note FROM {table} WHERE {cond})")
+
+        sql = "SELECT n.path FROM notes n"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        rows = self.db.execute(sql + " ORDER BY n.path", params).fetchall()
+        return [self.root / path for (path,) in rows]
+
+    def _note_id(self, path: str | Path) -> Optional[int]:
+        path = Path(path)
+        rel = (path.resolve().relative_to(self.root) if path.is_absolute() else path).as_posix()
+        row = self.db.execute("SELECT id FROM notes WHERE path = ?", (rel,)).fetchone()
+        return row[0] if row else None
+
+    def metadata(self, path: str | Path) -> Dict[str, List[str]]:
+        """
+        Returns the metadata of a note: key -> values, front matter first.
+
+        Args:
+            path (str or Path object): the note, absolute or vault relative
+        """
+        meta: Dict[str, List[str]] = {}
+        for key, value in self.db.execute(
+            "SELECT key, value FROM meta WHERE note = ? ORDER BY source DESC, rowid",
+            (self._note_id(path),),
+        ):
+            meta.setdefault(key, []).append(value)
+        return meta
+
+    def links(self, path: str | Path) -> List[str]:
+        """
+        Returns the wiki link targets of a note, in document order.
+
+        Args:
+            path (str or Path object): the note, absolute or vault relative
+        """
+        rows = self.db.execute(
+            "SELECT target FROM links WHERE note = ? ORDER BY line", (self._note_id(path),)
+        )
+        return [target for (target,) in rows]
+
+    def images(self, path: str | Path) -> List[str]:
+        """
+        Returns the image link targets of a note, as written, in document order.
+
+        Args:
+            path (str or Path object): the note, absolute or vault relative
+        """
+        rows = self.db.execute(
+            "SELECT target FROM images WHERE note = ? ORDER BY line, rowid",
+            (self._note_id(path),),
+        )
+        return [target for (target,) in rows]
+
+    def headings(self, path: str | Path) -> List[Heading]:
+        """
+        Returns the headings of a note, in document order.
+
+        Args:
+            path (str or Path object): the note, absolute or vault relative
+        """
+        rows = self.db.execute(
+            "SELECT line, depth, text FROM headings WHERE note = ? ORDER BY line",
+            (self._note_id(path),),
+        )
+        return [Heading(line=line, depth=depth, text=text) for line, depth, text in rows]
+
+    def fence_langs(self, path: str | Path) -> List[Optional[str]]:
+        """
+        Returns the languages of the code fences of a note, in document order (None if a
+        fence has no language).
+
+        Args:
+            path (str or Path object): the note, absolute or vault relative
+        """
+        rows = self.db.execute(
+            "SELECT lang FROM fences WHERE note = ? ORDER BY line", (self._note_id(path),)
+        )
+        return [lang for (lang,) in rows]
@@ -0,0 +1,211 @@
+"""
+Filename: checker.py
+
+Author: mg4news
+
+Date: 2025-10-17
+
+License: Unlicense
+
+Description:
+    Pre-flight checks. Validates what a build would use, without rendering anything: every wiki
+    link resolves to a document and the include tree has no cycles, every image reference resolves
+    to a file, every internal #anchor link matches a heading or id of the assembled document, the
+    TOC marker is well formed, and the CSS and HTML template exist. Documents are checked on a pool
+    of worker processes. Diagnostics name the file and line (1 based) they were found at, and are
+    JSON serializable.
+"""
+
+import functools
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+from textwrench.document import Document
+from textwrench.imgfix import ImageResolver, image_refs
+from textwrench.mdbuilder import assemble
+from textwrench.models import Diagnostic
+from textwrench.pathmgr import PathMgr
+from textwrench.tocbuilder import apply_toc, broken_anchor_links, find_toc_marker, heading_index
+from textwrench.vaultindex import VaultIndex, find_vault_root
+from textwrench import profiler
+
+logger = logging.getLogger(__name__)
+
+SEVERITIES = ("error", "warning")
+
+# Vault indexes, refreshed once per process (worker processes inherit the parent's)
+_indexes: Dict[str, VaultIndex] = {}
+
+
+def _diagnostic(
+    file: str | Path, line: Optional[int], check: str, message: str, severity: str = "error"
+) -> Diagnostic:
+    return Diagnostic(
+        file=str(file),
+        line=None if line is None else line + 1,
+        check=check,
+        severity=severity,
+        message=message,
+    )
+
+
+def vault_index(root: str | Path) -> VaultIndex:
+    """
+    Returns the vault index of a vault root, refreshed the first time it is used in this process.
+
+    Args:
+        root (str or Path object): the vault root
+    """
+    key = str(Path(root).resolve())
+    index = _indexes.get(key)
+    if index is None:
+        index = _indexes[key] = VaultIndex(key).refresh()
+    return index
+
+
+def check_files(paths: Iterable[str | Path]) -> List[Diagnostic]:
+    """
+    Checks that files the build needs (CSS, HTML template) exist.
+
+    Args:
+        paths (Iterable): the file paths
+
+    Returns:
+        a diagnostic for each missing file
+    """
+    return [
+        _diagnostic(path, None, "template", "File not found")
+        for path in paths
+        if not Path(path).is_file()
+    ]
+
+
+def check_document(
+    path: str | Path,
+    asm: bool = True,
+    toc: bool = True,
+    vault: Optional[str | Path] = None,
+    max_depth: int = 32,
+) -> List[Diagnostic]:
+    """
+    Checks one root document and the documents it includes, as a build with the same options
+    would assemble them.
+
+    Args:
+        path (str or Path object): the root document
+        asm (bool): check the wiki links, and the documents they include
+        toc (bool): check the TOC marker
+        vault (str or Path object): the vault root (default: the enclosing Obsidian vault)
+        max_depth (int): the maximum include depth
+
+    Returns:
+        the diagnostics, in file and line order
+    """
+    path = Path(path).resolve()
+    fmgr = PathMgr(path.parent)
+    diagnostics: List[Diagnostic] = []
+    try:
+        lines = fmgr.read_lines(path.name)
+    except (OSError, UnicodeDecodeError) as e:
+        return [_diagnostic(path, None, "read", f"{type(e).__name__}: {e}")]
+
+    deps: set = set()
+    if asm:
+        root = vault or find_vault_root(fmgr.directory)
+        if root:
+            fmgr.index = vault_index(root)
+        try:
+            lines = assemble(lines, fmgr, max_depth=max_depth, deps=deps)
+        except ValueError as e:
+            diagnostics.append(_diagnostic(path, None, "include", str(e)))
+    docs = {str(path): Document(fmgr.read_lines(path.name))}
+    for dep in sorted(deps - {str(path)}):
+        docs[dep] = Document(fmgr.read_lines(dep))
+
+    # The same document model as a build: the TOC in place, then the ids of the whole document
+    doc = Document(lines)
+    if toc:
+        try:
+            if find_toc_marker(doc):
+                apply_toc(doc)
+            else:
+                diagnostics.append(
+                    _diagnostic(path, None, "toc", "No TOC marker found", severity="warning")
+                )
+        except ValueError as e:
+            diagnostics.append(_diagnostic(path, None, "toc", str(e)))
+    index = heading_index(doc)
+
+    # Images resolve against the root document's directory, as in a build
+    resolver = ImageResolver(str(fmgr.directory), fmgr.index)
+    for file, part in docs.items():
+        if asm:
+            for link in part.wiki_links:
+                if fmgr.resolve_link(link["target"]) is None:
+                    message = f"Linked document not found: {link['target']}"
+                    diagnostics.append(_diagnostic(file, link["line"], "link", message))
+        for i in part.image_lines:
+            for target, embed in image_refs(part.lines[i]):
+                if resolver.resolve(target, embed) is None:
+                    message = f"Image file not found: {target}"
+                    diagnostics.append(_diagnostic(file, i, "image", message))
+        for i, anchor in broken_anchor_links(part, index):
+            diagnostics.append(_diagnostic(file, i, "anchor", f"No heading or id for #{anchor}"))
+    profiler.count("checker.files", len(docs))
+    return sorted(diagnostics, key=lambda d: (d["file"], d["line"] or 0))
+
+
+def _check_in_worker(path: str, options: dict) -> List[Diagnostic]:
+    try:
+        return check_document(path, **options)
+    except Exception as e:
+        # One broken document must not hide the diagnostics of the others
+        return [_diagnostic(path, None, "internal", f"{type(e).__name__}: {e}")]
+
+
+@profiler.timed("check")
+def check_documents(
+    paths: Sequence[str | Path],
+    jobs: int = 0,
+    asm: bool = True,
+    toc: bool = True,
+    vault: Optional[str | Path] = None,
+    max_depth: int = 32,
+) -> List[Diagnostic]:
+    """
+    Checks many root documents (see check_document), on a pool of worker processes.
+
+    Args:
+        paths (Sequence): the root documents
+        jobs (int): the number of worker processes, 0 = one per CPU, 1 = in this process
+        asm, toc, vault, max_depth: see check_document
+
+    Returns:
+        the diagnostics of all the documents, in the order of the paths
+    """
+    options = {"asm": asm, "toc": toc, "vault": vault, "max_depth": max_depth}
+    workers = min(len(paths), jobs or os.cpu_count() or 1)
+    if asm:
+        # Refresh the vault indexes once, before the workers are forked
+        roots = {vault} if vault else {find_vault_root(Path(p).resolve().parent) for p in paths}
+        for root in roots - {None}:
+            vault_index(root)
+    check = functools.partial(_check_in_worker, options=options)
+    if workers <= 1:
+        results = [check(str(p)) for p in paths]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            chunksize = max(1, len(paths) // (workers * 8))
+            results = list(pool.map(check, [str(p) for p in paths], chunksize=chunksize))
+    diagnostics = [d for result in results for d in result]
+    errors = sum(d["severity"] == "error" for d in diagnostics)
+    profiler.count("checker.documents", len(paths))
+    logger.info(
+        "Checked %s documents: %s errors, %s warnings.",
+        len(paths),
+        errors,
+        len(diagnostics) - errors,
+    )
+    return diagnostics
@@ -0,0 +1,119 @@
+"""
+Filename: contentcache.py
+
+Author: mg4news
+
+Date: 2025-09-26
+
+License: Unlicense
+
+Description:
+    In-memory LRU cache of text file contents, with a byte budget. Entries are validated against
+    (st_mtime_ns, st_size) on every lookup, so a changed file is re-read. Used by PathMgr, so a
+    chapter that is transcluded many times (or into many documents built in the same process) is
+    only read and decoded once.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+_DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+class ContentCache:
+
+    def __init__(self, max_bytes: int = _DEFAULT_MAX_BYTES) -> None:
+        """
+        Initialize a content cache.
+
+        Args:
+            max_bytes (int): the budget for the cached file sizes; 0 disables the cache
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._entries: OrderedDict[str, Tuple[int, int, List[str]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str, mtime_ns: int, size: int) -> Optional[List[str]]:
+        """
+        Returns the cached lines of a file, if they are still valid.
+
+        Args:
+            path (str): the resolved file path
+            mtime_ns (int): the current modification time of the file
+            size (int): the current size of the file
+
+        Returns:
+            a copy of the cached lines, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[0] != mtime_ns or entry[1] != size:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(path)
+            self.hits += 1
+            return list(entry[2])
+
+    def put(self, path: str, mtime_ns: int, size: int, lines: List[str]):
+        """
+        Stores the lines of a file, evicting the least recently used entries to stay in budget.
+        Files larger than the whole budget are not cached.
+        """
+        with self._lock:
+            self._discard(path)
+            if size > self.max_bytes:
+                return
+            self._entries[path] = (mtime_ns, size, list(lines))
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, old_size, _) = self._entries.popitem(last=False)
+                self._bytes -= old_size
+                self.evictions += 1
+
+    def invalidate(self, path: str):
+        """
+        Drops a file from the cache, e.g. after writing it.
+        """
+        with self._lock:
+            self._discard(path)
+
+    def clear(self):
+        """
+        Drops all entries. The statistics are kept.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _discard(self, path: str):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the cache statistics: hits, misses, evictions, entries and bytes.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+_shared = ContentCache()
+
+
+def shared_cache() -> ContentCache:
+    """
+    Returns the process wide content cache that PathMgr instances use by default.
+    """
+    return _shared
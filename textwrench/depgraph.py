@@ -0,0 +1,230 @@
+"""
+Filename: depgraph.py
+
+Author: mg4news
+
+Date: 2025-09-11
+
+License: Unlicense
+
+Description:
+    Dependency graph between root documents and the files they are built from: transcluded
+    chapters, images, CSS and the HTML template. Keeps the reverse mapping so that the root documents
+    affected by a set of changed files can be looked up directly. The names of the links and images
+    that did not resolve are kept too, so that creating the file one of them names affects the root.
+    The graph is persisted to a directory, one small JSON file per root document, so that every
+    build (also the parallel builds of batch mode) records its own root without rewriting, or
+    racing on, a shared file.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Set
+from textwrench.cachedir import cache_dir
+from textwrench.document import Document
+from textwrench.imgfix import image_refs
+from textwrench.pathmgr import PathMgr
+
+logger = logging.getLogger(__name__)
+
+_GRAPH_VERSION = 1
+
+
+def default_graph_dir() -> Path:
+    """
+    Returns the default directory of the persisted dependency graph, in the textwrench cache
+    directory.
+    """
+    return cache_dir("depgraph")
+
+
+def _entry_file(directory: Path, root: str) -> Path:
+    key = hashlib.sha256(root.encode()).hexdigest()[:24]
+    return directory / f"{key}.json"
+
+
+def normalize(path: str | Path) -> str:
+    """
+    Returns the canonical form of a path as stored in the graph: absolute, symlinks resolved.
+    """
+    return os.path.realpath(path)
+
+
+def missing_names(deps: Iterable[str], links: bool = True) -> Set[str]:
+    """
+    Returns the names that the wiki links and images of the markdown files among the
+    dependencies point at, but that no dependency has: the links and images that did not resolve.
+    Names are case folded file names; a link to a note also names `<note>.md`.
+
+    Args:
+        deps (Iterable[str]): the paths of the files a root document was built from
+        links (bool): include the wiki links (only resolved when the document is assembled)
+
+    Returns:
+        the set of names
+    """
+    deps = list(deps)
+    found = {Path(dep).name.casefold() for dep in deps}
+    names: Set[str] = set()
+    for dep in deps:
+        if not dep.endswith(".md"):
+            continue
+        path = Path(dep)
+        try:
+            doc = Document(PathMgr(path.parent).read_lines(path.name))
+        except (OSError, UnicodeDecodeError):
+            continue
+        if links:
+            for link in doc.wiki_links:
+                name = Path(link["target"].split("#", 1)[0].strip()).name.casefold()
+                if name and not {name, f"{name}.md"} & found:
+                    names.update((name, f"{name}.md"))
+        for i in doc.image_lines:
+            for target, _ in image_refs(doc.lines[i]):
+                name = Path(target).name.casefold()
+                if name not in found:
+                    names.add(name)
+    return names
+
+
+class DepGraph:
+
+    def __init__(self) -> None:
+        """
+        Initialize an empty dependency graph.
+        """
+        self._deps: Dict[str, Set[str]] = {}
+        self._rdeps: Dict[str, Set[str]] = {}
+        self._missing: Dict[str, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._deps)
+
+    def set_deps(self, root: str, deps: Iterable[str], missing: Iterable[str] = ()):
+        """
+        Records (or replaces) the dependencies of a root document. The root document
+        always depends on itself.
+
+        Args:
+            root (str): the path of the root document
+            deps (Iterable[str]): the paths of the files it was built from
+            missing (Iterable[str]): the names of the files it refers to that were not found
+                (see missing_names)
+        """
+        new = set(deps) | {root}
+        for dep in self._deps.get(root, set()) - new:
+            users = self._rdeps[dep]
+            users.discard(root)
+            if not users:
+                del self._rdeps[dep]
+        for dep in new:
+            self._rdeps.setdefault(dep, set()).add(root)
+        self._deps[root] = new
+        self._missing[root] = set(missing)
+        logger.info("Dependencies of %s: %s files", root, len(new))
+
+    def deps(self, root: str) -> Set[str]:
+        """
+        Returns the files a root document depends on.
+
+        Args:
+            root (str): the path of the root document
+
+        Returns:
+            a set of file paths, empty if the root is unknown
+        """
+        return set(self._deps.get(root, ()))
+
+    def roots(self) -> Set[str]:
+        """
+        Returns all known root documents.
+        """
+        return set(self._deps)
+
+    def files(self) -> Set[str]:
+        """
+        Returns every file that any root document depends on.
+        """
+        return set(self._rdeps)
+
+    def save(self, directory: Optional[str | Path] = None, roots: Optional[Iterable[str]] = None):
+        """
+        Persists the dependencies of root documents. Only the given roots are written, so a
+        build only touches the file of the document it built.
+
+        Args:
+            directory (str or Path object): the graph directory. Defaults to default_graph_dir().
+            roots (Iterable[str]): the roots to write. Defaults to all roots.
+        """
+        directory = Path(directory) if directory else default_graph_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        for root in self._deps if roots is None else roots:
+            entry = _entry_file(directory, root)
+            tmp = entry.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp, "w") as f:
+                data = {
+                    "version": _GRAPH_VERSION,
+                    "root": root,
+                    "deps": sorted(self._deps[root]),
+                    "missing": sorted(self._missing.get(root, ())),
+                }
+                json.dump(data, f)
+            os.replace(tmp, entry)
+        logger.info("Saved dependency graph: %s", directory)
+
+    @classmethod
+    def load(cls, directory: Optional[str | Path] = None) -> "DepGraph":
+        """
+        Loads a persisted dependency graph. Roots that no longer exist are dropped, and their
+        files removed.
+
+        Args:
+            directory (str or Path object): the graph directory. Defaults to default_graph_dir().
+
+        Returns:
+            the graph, empty if nothing was persisted
+        """
+        directory = Path(directory) if directory else default_graph_dir()
+        graph = cls()
+        for entry in sorted(directory.glob("*.json")):
+            try:
+                with open(entry, "r") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping unreadable dependency graph entry %s: %s", entry, e)
+                continue
+            if data.get("version") != _GRAPH_VERSION:
+                continue
+            root = data["root"]
+            if not os.path.exists(root):
+                logger.info("Dropping deleted root document from the graph: %s", root)
+                entry.unlink(missing_ok=True)
+                continue
+            graph.set_deps(root, data["deps"], data.get("missing", ()))
+        logger.info("Loaded dependency graph: %s root documents", len(graph))
+        return graph
+
+    def affected_roots(self, changed: Iterable[str]) -> Set[str]:
+        """
+        Returns the root documents that must be rebuilt after some files changed: those that
+        depend on a changed file, and those that refer to the name of a changed file they did not
+        find (it may have been created since).
+
+        Args:
+            changed (Iterable[str]): the paths of the changed files
+
+        Returns:
+            the set of affected root documents
+        """
+        affected: Set[str] = set()
+        names = set()
+        for path in changed:
+            affected |= self._rdeps.get(path, set())
+            names.add(os.path.basename(path).casefold())
+        for root, missing in self._missing.items():
+            if missing & names:
+                affected.add(root)
+        return affected
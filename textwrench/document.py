@@ -0,0 +1,377 @@
+"""
+Filename: document.py
+
+Author: mg4news
+
+Date: 2025-09-14
+
+License: Unlicense
+
+Description:
+    Block level document model. Classifies every line of a markdown document once (code fences and
+    their language, HTML comments, YAML front matter, HTML blocks, headings, wiki links, image links)
+    and keeps indexed views that the assembly, TOC and image stages query directly. Edits go through
+    Document.replace(), which updates the index for the edited lines instead of re-scanning the whole
+    document whenever the edit starts and ends outside any block. classify() applies the same
+    classification to a stream of lines, one at a time, for documents too large to hold in memory.
+"""
+
+import bisect
+import logging
+import re
+from typing import Iterable, Iterator, List, Optional, Tuple
+from textwrench.mdstate import MdState
+from textwrench.models import Block, Heading, WikiLink
+from textwrench import profiler
+
+logger = logging.getLogger(__name__)
+
+# Line kinds, a line can be several at once
+CODE = 1
+COMMENT = 2
+YAML = 4
+HTML = 8
+HEADING = 16
+WIKILINK = 32
+IMAGE = 64
+_BLOCKS = (CODE, COMMENT, YAML, HTML)
+# Lines of these kinds are not markdown content (no headings, links or images)
+_NOT_CONTENT = CODE | COMMENT | YAML
+
+# ATX headings as CommonMark/pandoc see them: 1-6 #s followed by a space (so #tags are not
+# headings), an optional closing sequence of #s
+_HEADING_RE = re.compile(r"^ {0,3}(#{1,6})(?:[ \t]+(.*?))?(?:[ \t]+#+)?[ \t]*$")
+
+# Explanation of regex:
+# 	^ → start of line
+# 	\s* → allow optional whitespace before the link
+# 	(!)? → Optional embed character i.e. !
+# 	\[\[ ... \]\] → the wiki link itself
+# 	\s* → allow trailing spaces
+# 	$ → end of line
+DOC_LINK_RE = re.compile(r"^\s*(!)?\[\[([^\]|]+)(?:\|([^\]]+))?\]\]\s*$")
+IMG_LINK_RE = re.compile(r"!\[([^\]]*)\]\(([^)]+)\)")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".bmp", ".tif", ".tiff")
+# Any image reference: a markdown image link, an Obsidian embed (`![[image.png|300]]`),
+# or an HTML <img src="...">
+IMAGE_REF_RE = re.compile(
+    r"!\[(?P<alt>[^\]]*)\]\((?P<link>[^)]+)\)"
+    r"|!\[\[(?P<embed>[^\]|]+?\.(?:png|jpe?g|gif|svg|webp|bmp|tiff?))(?:\|(?P<size>[^\]]*))?\]\]"
+    r"|(?P<img><img\b[^>]*?\bsrc\s*=\s*)(?P<quote>[\"'])(?P<src>[^\"']+)(?P=quote)",
+    re.IGNORECASE,
+)
+
+
+class _Scan:
+    """
+    The result of classifying a run of lines.
+    """
+
+    __slots__ = ("kinds", "settled", "headings", "links", "images", "blocks", "done")
+
+    def __init__(self) -> None:
+        self.kinds: List[int] = []
+        # settled[i]: the line after line i starts outside of any block
+        self.settled: List[bool] = []
+        self.headings: List[Heading] = []
+        self.links: List[WikiLink] = []
+        self.images: List[int] = []
+        self.blocks: List[Block] = []
+        self.done = True
+
+
+def _structure(line: str) -> tuple:
+    # Everything MdState looks at to open and close blocks
+    s = line.strip()
+    return (
+        s.startswith("```") and s,
+        s.startswith("<!--"),
+        s.endswith("-->"),
+        s == "---",
+        s.startswith("<"),
+        s.endswith(">"),
+        s.startswith("</"),
+    )
+
+
+def parse_heading(line: str) -> Optional[Tuple[int, str]]:
+    """
+    Parses an ATX heading line. Only meaningful for content lines (see the HEADING kind).
+
+    Args:
+        line (str): the line
+
+    Returns:
+        (depth, text) if the line is a heading, else None
+    """
+    if "#" not in line[:4]:
+        return None
+    match = _HEADING_RE.match(line)
+    if not match:
+        return None
+    return len(match.group(1)), (match.group(2) or "").strip()
+
+
+def _content(line: str, i: int, result: _Scan) -> int:
+    # Classifies a content line (not in a code, comment or YAML block)
+    kind = 0
+    heading = parse_heading(line)
+    if heading:
+        kind |= HEADING
+        result.headings.append(Heading(line=i, depth=heading[0], text=heading[1]))
+    if "[[" in line:
+        match = DOC_LINK_RE.match(line)
+        # An embedded image is not a document link
+        if match and not match.group(2).lower().endswith(IMAGE_EXTENSIONS):
+            kind |= WIKILINK
+            embed, target, alias = match.groups()
+            result.links.append(WikiLink(line=i, target=target, alias=alias, embed=bool(embed)))
+    if ("![" in line or "<img" in line) and IMAGE_REF_RE.search(line):
+        kind |= IMAGE
+        result.images.append(i)
+    return kind
+
+
+def _block_kind(state: MdState) -> int:
+    kind = 0
+    if state.in_code_block:
+        kind |= CODE
+    if state.in_comment_block:
+        kind |= COMMENT
+    if state.in_yaml_block:
+        kind |= YAML
+    if state.in_html_block:
+        kind |= HTML
+    return kind
+
+
+def _scan(lines: Iterable[str], offset: int) -> _Scan:
+    result = _Scan()
+    state = MdState()
+    state.line_count = offset
+    open_blocks: dict[int, Block] = {}
+    i = offset - 1
+
+    for i, line in enumerate(lines, offset):
+        state.process_line(line)
+        kind = _block_kind(state)
+        for block_kind in _BLOCKS:
+            if kind & block_kind and block_kind not in open_blocks:
+                lang = state.code_block_type if block_kind == CODE else None
+                open_blocks[block_kind] = Block(start=i, end=i, kind=block_kind, lang=lang)
+
+        if not kind & _NOT_CONTENT:
+            kind |= _content(line, i, result)
+
+        settled = not state.in_block or state.at_block_end
+        if state.at_block_end:
+            for block in open_blocks.values():
+                block["end"] = i
+                result.blocks.append(block)
+            open_blocks = {}
+        result.kinds.append(kind)
+        result.settled.append(settled)
+
+    # Unterminated blocks run to the end of the lines
+    for block in open_blocks.values():
+        block["end"] = i
+        result.blocks.append(block)
+        result.done = False
+    result.blocks.sort(key=lambda b: (b["start"], b["kind"]))
+    return result
+
+
+def classify(lines: Iterable[str]) -> Iterator[Tuple[str, int]]:
+    """
+    Classifies lines one at a time, as they are consumed, without keeping them. The kinds are the
+    same as those of a Document built from all the lines.
+
+    Args:
+        lines (Iterable[str]): the markdown lines (any iterator of lines)
+
+    Yields:
+        (line, kind flags) for every line, in order
+    """
+    state = MdState()
+    scratch = _Scan()
+    count = 0
+    for count, line in enumerate(lines, 1):
+        state.process_line(line)
+        kind = _block_kind(state)
+        if not kind & _NOT_CONTENT:
+            kind |= _content(line, count - 1, scratch)
+            if kind & (HEADING | WIKILINK | IMAGE):
+                scratch.headings.clear()
+                scratch.links.clear()
+                scratch.images.clear()
+        yield line, kind
+    profiler.count("document.lines_streamed", count)
+
+
+def _splice(entries: list, key: str, start: int, end: int, delta: int, new: list):
+    lo = bisect.bisect_left(entries, start, key=lambda e: e[key])
+    hi = bisect.bisect_left(entries, end, key=lambda e: e[key])
+    if delta:
+        for entry in entries[hi:]:
+            entry[key] += delta
+            if key == "start":
+                entry["end"] += delta
+    entries[lo:hi] = new
+
+
+def _splice_lines(entries: List[int], start: int, end: int, delta: int, new: List[int]):
+    lo = bisect.bisect_left(entries, start)
+    hi = bisect.bisect_left(entries, end)
+    tail = [n + delta for n in entries[hi:]] if delta else entries[hi:]
+    entries[lo:] = new + tail
+
+
+class Document:
+
+    def __init__(self, lines: Iterable[str]) -> None:
+        """
+        Initialize a document model, classifying every line once.
+
+        Args:
+            lines (Iterable[str]): the markdown lines. The document keeps (and edits) its own list.
+        """
+        self.lines: List[str] = list(lines)
+        self._index(_scan(self.lines, 0))
+        profiler.count("document.lines_scanned", len(self.lines))
+        self.rescans = 0
+
+    def _index(self, scan: _Scan):
+        self._kinds = scan.kinds
+        self._settled = scan.settled
+        self._headings = scan.headings
+        self._links = scan.links
+        self._images = scan.images
+        self._blocks = scan.blocks
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def kind(self, line: int) -> int:
+        """
+        Returns the kind flags of a line (CODE, COMMENT, YAML, HTML, HEADING, WIKILINK, IMAGE).
+
+        Args:
+            line (int): the line number (0 based)
+        """
+        return self._kinds[line]
+
+    @property
+    def headings(self) -> List[Heading]:
+        """The headings outside code, comment and YAML blocks, in document order."""
+        return self._headings
+
+    @property
+    def wiki_links(self) -> List[WikiLink]:
+        """The lines consisting of a single wiki link (`[[doc]]`), in document order."""
+        return self._links
+
+    @property
+    def image_lines(self) -> List[int]:
+        """The numbers of lines containing an image reference, outside code and comments."""
+        return self._images
+
+    def blocks(self, kind: Optional[int] = None) -> List[Block]:
+        """
+        Returns the blocks of the document, in document order.
+
+        Args:
+            kind (int): only return blocks of this kind (CODE, COMMENT, YAML or HTML)
+
+        Returns:
+            a list of blocks. Block start and end are both inclusive line numbers.
+        """
+        if kind is None:
+            return list(self._blocks)
+        return [b for b in self._blocks if b["kind"] == kind]
+
+    def fences(self, lang: Optional[str] = None) -> List[Block]:
+        """
+        Returns the fenced code blocks, optionally only those of a given language.
+
+        Args:
+            lang (str): the language, e.g. "toc" or "python"
+        """
+        return [
+            b for b in self._blocks if b["kind"] == CODE and (lang is None or b["lang"] == lang)
+        ]
+
+    @property
+    def front_matter(self) -> Optional[Block]:
+        """The YAML front matter block, if the document starts with one."""
+        if self._blocks and self._blocks[0]["kind"] == YAML and self._blocks[0]["start"] == 0:
+            return self._blocks[0]
+        return None
+
+    def content_lines(self) -> List[str]:
+        """
+        Returns the lines that are not part of an HTML comment block.
+        """
+        kinds = self._kinds
+        return [line for i, line in enumerate(self.lines) if not kinds[i] & COMMENT]
+
+    def _boundary(self, line: int) -> bool:
+        # True if line starts outside any block
+        return line == 0 or self._settled[line - 1]
+
+    def _rewrite(self, start: int, new_lines: List[str]):
+        # Same number of lines, same block structure: only the content kinds can change
+        result = _Scan()
+        for i, line in enumerate(new_lines, start):
+            block = self._kinds[i] & (CODE | COMMENT | YAML | HTML)
+            self._kinds[i] = block if block & _NOT_CONTENT else block | _content(line, i, result)
+        end = start + len(new_lines)
+        self.lines[start:end] = new_lines
+        _splice(self._headings, "line", start, end, 0, result.headings)
+        _splice(self._links, "line", start, end, 0, result.links)
+        _splice_lines(self._images, start, end, 0, result.images)
+
+    def replace(self, start: int, end: int, new_lines: Iterable[str]):
+        """
+        Replaces lines[start:end] with new lines, keeping the index up to date. Only the new lines
+        are classified if the edit does not change the block structure (e.g. a rewritten link), or if
+        it starts and ends outside any block. Otherwise the document is re-scanned.
+
+        Args:
+            start (int): the first line to replace
+            end (int): the line after the last line to replace
+            new_lines (Iterable[str]): the replacement lines
+        """
+        new_lines = list(new_lines)
+        if len(new_lines) == end - start and all(
+            _structure(old) == _structure(new) for old, new in zip(self.lines[start:end], new_lines)
+        ):
+            self._rewrite(start, new_lines)
+            return
+        delta = len(new_lines) - (end - start)
+        incremental = start > 0 and self._boundary(start) and self._boundary(end)
+        scan = _scan(new_lines, start) if incremental else None
+        self.lines[start:end] = new_lines
+
+        if scan is None or not scan.done or (new_lines and not scan.settled[-1]):
+            self.rescans += 1
+            profiler.count("document.rescans")
+            logger.debug("Edit of lines %s-%s crosses a block, re-scanning document.", start, end)
+            self._index(_scan(self.lines, 0))
+            return
+
+        self._kinds[start:end] = scan.kinds
+        self._settled[start:end] = scan.settled
+        _splice(self._headings, "line", start, end, delta, scan.headings)
+        _splice(self._links, "line", start, end, delta, scan.links)
+        _splice(self._blocks, "start", start, end, delta, scan.blocks)
+        _splice_lines(self._images, start, end, delta, scan.images)
+
+    def set_line(self, line: int, text: str):
+        """
+        Replaces a single line.
+
+        Args:
+            line (int): the line number
+            text (str): the new line
+        """
+        self.replace(line, line + 1, [text])
@@ -0,0 +1,258 @@
+"""
+Filename: fragments.py
+
+Author: mg4news
+
+Date: 2025-10-16
+
+License: Unlicense
+
+Description:
+    Incremental rendering with per-chapter HTML fragments. The chapters of an assembled document
+    (the documents linked from the root document) are converted to HTML fragments one by one, and
+    each fragment is cached by the hash of its markdown, the tool versions and the options. A build
+    only sends the chapters that changed through pandoc. The part before the first chapter (front
+    matter, title, TOC) is converted into the standalone HTML shell of the template, the fragments
+    are stitched into it, and the result is rendered to PDF.
+    pandoc de-duplicates heading ids within one conversion, so the ids in a chapter converted on its
+    own can differ from those in the whole document (e.g. two chapters with an "Overview" heading).
+    When a fragment is stitched, its heading ids are mapped to the ids of the whole document, which
+    are the ones the TOC links point at. Footnote numbering restarts in every chapter too, so the
+    chapters are converted with an id prefix, and their other ids (footnotes, back-references) are
+    namespaced by chapter number when stitched. The cached fragments do not depend on the other
+    chapters, or on their position in the document.
+"""
+
+import asyncio
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+from textwrench.artifactcache import ArtifactCache
+from textwrench.cachedir import cache_dir
+from textwrench.document import Document
+from textwrench.pathmgr import PathMgr
+from textwrench.pdfbuilder import PdfBuilder
+from textwrench.tocbuilder import HeadingIndex, apply_toc, find_toc_marker, heading_index
+from textwrench import profiler
+
+logger = logging.getLogger(__name__)
+
+# Marks where the chapters go in the shell; pandoc passes HTML comments through
+_PLACEHOLDER = "<!--textwrench-chapters-->"
+_HEADING_ID_RE = re.compile(r'(<h[1-6]\b[^>]*?\bid=")([^"]*)(")')
+_ANCHOR_RE = re.compile(r'(\bid="|\bhref="#)([^"]*)(")')
+# The id prefix chapters are converted with, replaced when they are stitched
+_ID_PREFIX = "textwrench-"
+_FRAGMENT_VERSION = "2"
+
+
+def apply_toc_to_chapters(doc: Document, boundaries: List[int]) -> List[int]:
+    """
+    Builds the TOC of a document (see apply_toc), keeping the chapter boundaries in step. The
+    document is edited in place.
+
+    Args:
+        doc (Document): the document
+        boundaries (List[int]): the chapter boundaries (line numbers)
+
+    Returns:
+        the chapter boundaries, adjusted for the lines added by the TOC
+    """
+    toc = find_toc_marker(doc)
+    before = len(doc)
+    apply_toc(doc)
+    if not toc:
+        return boundaries
+    # All the chapters that follow the marker moved by the same amount
+    delta = len(doc) - before
+    return [b + delta if b > toc["start_line"] else b for b in boundaries]
+
+
+def chapter_ranges(boundaries: Sequence[int], total: int) -> List[Tuple[int, int]]:
+    """
+    Splits a document at its chapter boundaries.
+
+    Args:
+        boundaries (Sequence[int]): the line numbers where chapters start
+        total (int): the number of lines in the document
+
+    Returns:
+        a list of (start, end) line ranges, covering the whole document. The first range is
+        everything before the first chapter, and may be empty.
+    """
+    cuts = sorted({b for b in boundaries if 0 < b < total})
+    return list(zip([0, *cuts], [*cuts, total]))
+
+
+def _id_map(doc: Document, index: HeadingIndex, start: int, end: int) -> Dict[str, str]:
+    # The ids pandoc gives the headings of lines[start:end] converted on their own, mapped to
+    # their ids in the whole document (only those that differ)
+    local = HeadingIndex(h for h in doc.headings if start <= h["line"] < end)
+    ids = {}
+    for anchor in local.anchors:
+        slug = index.slug(anchor["line"])
+        if slug != anchor["slug"]:
+            ids[anchor["slug"]] = slug
+    return ids
+
+
+def _map_ids(html: str, part: int, ids: Dict[str, str]) -> str:
+    # Resolves the ids and internal links of a chapter converted with _ID_PREFIX: headings get
+    # their ids in the whole document, the other ids of the chapter (footnotes) a per-chapter
+    # prefix, and links to anything else point at the whole document's ids
+    headings = {m.group(2) for m in _HEADING_ID_RE.finditer(html)}
+    own = {m.group(2) for m in _ANCHOR_RE.finditer(html) if m.group(1) == 'id="'}
+    prefix = f"c{part}-"
+
+    def target(m: re.Match) -> str:
+        anchor = m.group(2)
+        if not anchor.startswith(_ID_PREFIX):
+            # Raw HTML ids and links, which pandoc leaves alone
+            return m.group(0)
+        local = anchor[len(_ID_PREFIX) :]
+        if anchor in headings:
+            local = ids.get(local, local)
+        elif anchor in own:
+            local = prefix + local
+        return m.group(1) + local + m.group(3)
+
+    return _ANCHOR_RE.sub(target, html)
+
+
+def stitch(shell: str, fragments: Sequence[str]) -> str:
+    """
+    Puts the chapter fragments into the HTML shell, at the placeholder (or at the end of the
+    body, if pandoc dropped the placeholder).
+
+    Args:
+        shell (str): the standalone HTML document of the part before the first chapter
+        fragments (Sequence[str]): the HTML fragments of the chapters, in order
+
+    Returns:
+        the HTML document
+    """
+    head, placeholder, tail = shell.partition(_PLACEHOLDER)
+    if not placeholder:
+        logger.warning("Chapter placeholder not found in the HTML, appending the chapters.")
+        head, body_end, tail = shell.rpartition("</body>")
+        tail = body_end + tail
+    return head + "\n".join(fragments) + tail
+
+
+class FragmentRenderer:
+
+    def __init__(
+        self,
+        fmgr: PathMgr,
+        engine: str = "pandoc",
+        cache: Optional[ArtifactCache] = None,
+        timeout: Optional[float] = None,
+        jobs: int = 0,
+    ) -> None:
+        """
+        Initialize a fragment renderer.
+
+        Args:
+            fmgr (PathMgr): the document's PathMgr; the PDF is written to its directory
+            engine (str): the PdfBuilder engine
+            cache (ArtifactCache): the fragment cache. Defaults to `fragments` in the textwrench
+                cache directory.
+            timeout (float): the maximum time, in seconds, for each pandoc or weasyprint run
+            jobs (int): the maximum number of chapters converted at once, 0 = one per CPU
+        """
+        self.builder = PdfBuilder(
+            fmgr, engine, timeout=timeout, max_concurrency=jobs or os.cpu_count() or 1
+        )
+        self.cache = cache if cache is not None else ArtifactCache(cache_dir("fragments"))
+        self.hits = 0
+        self.misses = 0
+
+    async def _fragment(
+        self,
+        part: int,
+        lines: List[str],
+        css_file: Optional[str],
+        template: Optional[str],
+        id_prefix: Optional[str] = None,
+    ) -> str:
+        files = [template] if template else []
+        options = [_FRAGMENT_VERSION, self.builder.engine, css_file or "", template or ""]
+        options.append(id_prefix or "")
+        key = self.cache.key(lines, files, [], options=options)
+        cached = self.cache.get_bytes(key, ".html")
+        if cached is not None:
+            self.hits += 1
+            return cached.decode("utf-8")
+        self.misses += 1
+        html = await self.builder.to_html(lines, f"part {part}", css_file, template, id_prefix)
+        self.cache.put_bytes(key, ".html", html.encode("utf-8"))
+        return html
+
+    async def to_html(
+        self, doc: Document, boundaries: Sequence[int], css_file: str, html_template_file: str
+    ) -> str:
+        """
+        Converts a document to a standalone HTML document, chapter by chapter, converting only
+        the chapters that are not in the cache.
+
+        Args:
+            doc (Document): the final document (TOC built, image links resolved)
+            boundaries (Sequence[int]): the line numbers where chapters start
+            css_file (str): The path to the CSS file to use for styling.
+            html_template_file (str): The path to the pandoc HTML template.
+
+        Returns:
+            the HTML document
+        """
+        ranges = chapter_ranges(boundaries, len(doc))
+        index = heading_index(doc)
+        tasks = []
+        async with asyncio.TaskGroup() as group:
+            for part, (start, end) in enumerate(ranges):
+                if part == 0:
+                    lines = [*doc.lines[start:end], "\n", _PLACEHOLDER + "\n"]
+                    fragment = self._fragment(part, lines, css_file, html_template_file)
+                else:
+                    lines = doc.lines[start:end]
+                    fragment = self._fragment(part, lines, None, None, _ID_PREFIX)
+                tasks.append(group.create_task(fragment))
+        html = [tasks[0].result()]
+        for part, (task, (start, end)) in enumerate(zip(tasks[1:], ranges[1:]), 1):
+            html.append(_map_ids(task.result(), part, _id_map(doc, index, start, end)))
+        profiler.count("fragments.hits", self.hits)
+        profiler.count("fragments.misses", self.misses)
+        logger.info(
+            "HTML fragments: %s chapters, %s converted, %s cached.",
+            len(ranges) - 1,
+            self.misses,
+            self.hits,
+        )
+        self.cache.evict()
+        return stitch(html[0], html[1:])
+
+    @profiler.timed("fragments")
+    def render(
+        self,
+        doc: Document,
+        boundaries: Sequence[int],
+        output_pdf_file: str,
+        css_file: str,
+        html_template_file: str,
+    ):
+        """
+        Renders a document to PDF from its HTML fragments (see to_html).
+
+        Args:
+            doc (Document): the final document (TOC built, image links resolved)
+            boundaries (Sequence[int]): the line numbers where chapters start
+            output_pdf_file (str): The name of the output PDF file.
+            css_file (str): The path to the CSS file to use for styling.
+            html_template_file (str): The path to the pandoc HTML template.
+        """
+
+        async def render_all():
+            html = await self.to_html(doc, boundaries, css_file, html_template_file)
+            await self.builder.html_to_pdf(html, output_pdf_file, css_file)
+
+        asyncio.run(render_all())
@@ -0,0 +1,116 @@
+"""
+Filename: htmlrender.py
+
+Author: mg4news
+
+Date: 2025-09-09
+
+License: Unlicense
+
+Description:
+    In-process HTML -> PDF rendering with the weasyprint Python API. Parsed stylesheets and the font
+    configuration are kept for the life of the process, so documents rendered in the same run do not
+    pay for CSS parsing and font discovery again. weasyprint is an optional dependency; it is only
+    imported when this engine is used.
+"""
+
+import logging
+from pathlib import Path
+from typing import Dict, List, Tuple
+from textwrench import profiler
+
+logger = logging.getLogger(__name__)
+
+_font_config = None
+_stylesheets: Dict[Tuple[str, int], object] = {}
+
+
+def _weasyprint():
+    try:
+        import weasyprint
+    except ImportError:
+        logger.error(
+            "The weasyprint Python package is not installed. Install it, or use the pandoc engine."
+        )
+        raise
+    return weasyprint
+
+
+@profiler.timed("weasyprint.fonts")
+def font_config():
+    """
+    Returns the shared weasyprint font configuration, creating it on first use.
+
+    Returns:
+        the weasyprint FontConfiguration
+    """
+    global _font_config
+    if _font_config is None:
+        from weasyprint.text.fonts import FontConfiguration
+
+        _font_config = FontConfiguration()
+        logger.info("Created weasyprint font configuration.")
+    return _font_config
+
+
+def stylesheet(css_file: str):
+    """
+    Returns the parsed stylesheet for a CSS file. Stylesheets are parsed once and re-used
+    until the file changes.
+
+    Args:
+        css_file (str): the path to the CSS file
+
+    Returns:
+        the weasyprint CSS object
+    """
+    path = str(Path(css_file).resolve())
+    key = (path, Path(path).stat().st_mtime_ns)
+    sheet = _stylesheets.get(key)
+    if sheet is None:
+        weasyprint = _weasyprint()
+        with profiler.stage("weasyprint.css"):
+            sheet = weasyprint.CSS(filename=path, font_config=font_config())
+        # Drop any stale versions of the same file
+        for old in [k for k in _stylesheets if k[0] == path]:
+            del _stylesheets[old]
+        _stylesheets[key] = sheet
+        logger.info("Parsed stylesheet: %s", path)
+    return sheet
+
+
+def warm_up(css_files: List[str]):
+    """
+    Loads the font configuration and parses the stylesheets ahead of rendering. Called before
+    forking batch workers, so that every worker starts with them loaded.
+
+    Args:
+        css_files (List[str]): the stylesheets to parse
+    """
+    for css in css_files:
+        stylesheet(css)
+
+
+def cached() -> Dict[str, object]:
+    """
+    Returns what is loaded: the number of parsed stylesheets, and whether the fonts are.
+    """
+    return {"stylesheets": len(_stylesheets), "fonts": _font_config is not None}
+
+
+@profiler.timed("weasyprint.render")
+def render_pdf(html: str, output_path: Path, css_files: List[str], base_url: str):
+    """
+    Renders an HTML document to PDF in-process.
+
+    Args:
+        html (str): the standalone HTML document
+        output_path (Path): the PDF file to write
+        css_files (List[str]): the stylesheets to apply
+        base_url (str): the base for relative links (images, etc.)
+    """
+    weasyprint = _weasyprint()
+    sheets = [stylesheet(css) for css in css_files]
+    document = weasyprint.HTML(string=html, base_url=base_url)
+    document.write_pdf(str(output_path), stylesheets=sheets, font_config=font_config())
+    logger.info("Rendered PDF in-process: %s", output_path)
@@ -9,64 +9,317 @@ License: Unlicense
 
 Description:
     Parses out image links and replaces them with absollute links. This allows pandoc to find them without
-    needing to run the program from the directory the markdown is in
+    needing to run the program from the directory the markdown is in.
+    Handles markdown image links, Obsidian image embeds (`![[image.png]]`) and HTML `<img src>`. All the
+    references in a document are collected and de-duplicated first, resolved against cached directory
+    listings (optionally in parallel, for remote mounts), then every occurrence is rewritten in one pass.
+    iter_images() does the same for a stream of lines, resolving each reference when it first appears.
 """
 
+import html
+import os
 import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import logging
-from typing import List
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set
+from textwrench.document import Document, IMAGE, IMAGE_REF_RE, classify
+from textwrench.vaultindex import VaultIndex
+from textwrench import profiler
 
 logger = logging.getLogger(__name__)
 
-_IMG_LINK = re.compile(r"!\[([^\]]*)\]\(([^)]+)\)")
+# A link target followed by an optional title, i.e. `path "title"`, or `<path with spaces> "title"`
+_TARGET_RE = re.compile(r"^\s*(?:<([^>]*)>|(\S+))(\s+[\"'(].*)?\s*$")
+_EXTERNAL = ("http://", "https://", "data:", "file:")
+# The size of an Obsidian embed, `![[img.png|300]]` or `![[img.png|300x200]]`
+_SIZE_RE = re.compile(r"^\s*(\d+)\s*(?:x\s*(\d+)\s*)?$")
 
 
-def _resolve_image_link(link: str, md_dir: str) -> str:
+def _split_target(link: str) -> tuple[str, str]:
+    match = _TARGET_RE.match(link)
+    if not match:
+        return link.strip(), ""
+    return (match.group(1) if match.group(1) is not None else match.group(2)), match.group(3) or ""
+
+
+def _not_found(link: str) -> str:
+    return f"ERROR: Image file not found: {link}"
+
+
+class ImageResolver:
+
+    def __init__(
+        self, md_dir: str, index: Optional[VaultIndex] = None, workers: int = 0
+    ) -> None:
+        """
+        Initialize an image resolver. Directory listings are cached, so every directory that images
+        are looked up in is listed once, however many images it holds.
+
+        Args:
+            md_dir (str): the directory of the markdown document; relative links are resolved against it
+            index (VaultIndex): the vault index, used to find embedded images anywhere in the vault
+            workers (int): resolve links on this many threads (useful on network mounts), 0 = serial
+        """
+        self.md_dir = Path(md_dir)
+        self.index = index
+        self.workers = workers
+        self._listings: Dict[str, frozenset] = {}
+
+    @staticmethod
+    def _scan(directory: str) -> frozenset:
+        profiler.count("imgfix.listdir")
+        try:
+            with os.scandir(directory) as it:
+                return frozenset(e.name for e in it if e.is_file())
+        except OSError:
+            return frozenset()
+
+    def _is_file(self, path: Path) -> bool:
+        directory = str(path.parent)
+        listing = self._listings.get(directory)
+        if listing is None:
+            listing = self._listings[directory] = self._scan(directory)
+        return path.name in listing
+
+    def _candidates(self, link: str) -> List[Path]:
+        return [Path(os.path.abspath(p)) for p in (Path(link), self.md_dir / link)]
+
+    def resolve(self, link: str, embed: bool = False) -> Optional[str]:
+        """
+        Resolves a single image link. Absolute paths are used as is, relative paths are tried as given
+        and then relative to the markdown directory. Embeds are also looked up in the vault index.
+
+        Args:
+            link (str): the link target
+            embed (bool): True for an Obsidian embed
+
+        Returns:
+            the absolute path of the image, or None if it cannot be found
+        """
+        for path in self._candidates(link):
+            if self._is_file(path):
+                return str(path)
+        if embed and self.index is not None:
+            found = self.index.lookup_attachment(link, near=self.md_dir)
+            if found is not None:
+                return str(found)
+        return None
+
+    def resolve_all(self, refs: Iterable[tuple[str, bool]]) -> Dict[tuple[str, bool], Optional[str]]:
+        """
+        Resolves a set of image references, each one once.
+
+        Args:
+            refs (Iterable[tuple[str, bool]]): (link, embed) pairs, duplicates allowed
+
+        Returns:
+            a map of (link, embed) -> resolved path (None if not found)
+        """
+        unique = list(dict.fromkeys(refs))
+        if self.workers > 1 and len(unique) > 1:
+            # Warm the listings in parallel; these are the only filesystem calls
+            dirs = {str(p.parent) for link, _ in unique for p in self._candidates(link)}
+            dirs -= self._listings.keys()
+            with ThreadPoolExecutor(self.workers) as pool:
+                for directory, listing in zip(dirs, pool.map(self._scan, dirs)):
+                    self._listings[directory] = listing
+        return {ref: self.resolve(*ref) for ref in unique}
+
+
+def image_refs(line: str) -> Iterable[tuple[str, bool]]:
     """
-    Resolves a single parsed out image link
+    Lists the local image references on a line: markdown image links, Obsidian embeds and HTML
+    `<img src>`. External (http, data, ...) references are skipped.
 
     Args:
-        link (str): the matched link
-        md_dir: the directory of the current markdown document
+        line: a markdown line.
+
+    Returns:
+        (link, embed) pairs, embed is True for an Obsidian embed.
+    """
+    for m in IMAGE_REF_RE.finditer(line):
+        if m.group("link") is not None:
+            target = _split_target(m.group("link"))[0]
+        elif m.group("embed") is not None:
+            yield m.group("embed").strip(), True
+            continue
+        else:
+            target = m.group("src")
+        if target and not target.startswith(_EXTERNAL):
+            yield target, False
+
+
+def _rewriter(resolved: Dict[tuple[str, bool], Optional[str]]) -> Callable[[re.Match], str]:
+    # The IMAGE_REF_RE substitution that rewrites a reference to its resolved path
+
+    def md_target(link: str, embed: bool) -> str:
+        path = resolved[(link, embed)]
+        if path is None:
+            return _not_found(link)
+        return f"<{path}>" if " " in path else path
+
+    def rewrite(m: re.Match) -> str:
+        if m.group("embed") is not None:
+            link = m.group("embed").strip()
+            size = _SIZE_RE.match(m.group("size") or "")
+            path = resolved[(link, True)]
+            if size and path is not None:
+                # gfm has no image attributes; pandoc passes the HTML through as is
+                height = f' height="{size.group(2)}"' if size.group(2) else ""
+                alt = html.escape(Path(link).name)
+                return f'<img src="{path}" alt="{alt}" width="{size.group(1)}"{height}>'
+            return f"![{Path(link).name}]({md_target(link, True)})"
+        if m.group("link") is not None:
+            target, title = _split_target(m.group("link"))
+        else:
+            target, title = m.group("src"), None
+        if not target or target.startswith(_EXTERNAL):
+            return m.group(0)
+        if title is not None:
+            return f"![{m.group('alt')}]({md_target(target, False)}{title})"
+        path = resolved[(target, False)] or _not_found(target)
+        return f"{m.group('img')}{m.group('quote')}{path}{m.group('quote')}"
+
+    return rewrite
 
-    Return:
-        an absolute link to the image file, if found
 
-    Raises:
-        an error if the image file cannot be found
+@profiler.timed("images")
+def resolve_document_images(
+    doc: Document,
+    md_dir: str,
+    deps: Optional[Set[str]] = None,
+    index: Optional[VaultIndex] = None,
+    workers: int = 0,
+    prepare: Optional[Callable[[Iterable[str]], Dict[str, str]]] = None,
+) -> Document:
     """
-    if Path(link).is_file():
-        resolved = str(Path(link))
-    elif Path(Path(md_dir) / link).is_file():
-        resolved = str(Path(md_dir) / link)
-    else:
-        logger.error(f"Image file not found: {link}")
-        resolved = f"ERROR: Image file not found: {link}"
-    return resolved
+    Finds image references in a document (outside code blocks and comments), resolves each distinct
+    one once, and replaces every occurrence with the fully qualified path. Obsidian embeds are
+    rewritten as markdown image links. The document is edited in place.
 
+    Args:
+        doc: the document.
+        md_dir: root directory to search for image files.
+        deps: if given, the paths of all resolved image files are added to it.
+        index: the vault index, used to find embedded images anywhere in the vault.
+        workers: resolve on this many threads, 0 = serial.
+        prepare: if given, maps the resolved paths to the files to link instead (e.g.
+            ImagePrep.process_all). deps still gets the original paths.
+
+    Returns:
+        the same document, for chaining.
+    """
+    logger.info("Resolving image links using doc path: %s", md_dir)
+    lines = list(doc.image_lines)
+    resolver = ImageResolver(md_dir, index, workers)
+    resolved = resolver.resolve_all(ref for i in lines for ref in image_refs(doc.lines[i]))
+    profiler.count("imgfix.images", len(resolved))
+    for (link, _), path in resolved.items():
+        if path is None:
+            logger.error("Image file not found: %s", link)
+        elif deps is not None:
+            deps.add(path)
+    if prepare is not None:
+        found = [path for path in resolved.values() if path is not None]
+        prepared = prepare(found)
+        resolved = {ref: path and prepared.get(path, path) for ref, path in resolved.items()}
+
+    rewrite = _rewriter(resolved)
+    for i in lines:
+        line = doc.lines[i]
+        new = IMAGE_REF_RE.sub(rewrite, line)
+        if new != line:
+            doc.set_line(i, new)
+    return doc
+
+
+def iter_images(
+    lines: Iterable[str],
+    md_dir: str,
+    deps: Optional[Set[str]] = None,
+    index: Optional[VaultIndex] = None,
+    prepare: Optional[Callable[[Iterable[str]], Dict[str, str]]] = None,
+) -> Iterator[str]:
+    """
+    The streaming counterpart of resolve_document_images: yields the lines with every image
+    reference (outside code blocks and comments) replaced by the fully qualified path. Each
+    distinct reference is resolved, and prepared, once, the first time it is seen.
+
+    Args:
+        lines: the markdown lines (any iterator of lines).
+        md_dir: root directory to search for image files.
+        deps: if given, the paths of all resolved image files are added to it.
+        index: the vault index, used to find embedded images anywhere in the vault.
+        prepare: if given, maps the resolved paths to the files to link instead (e.g.
+            ImagePrep.process_all). deps still gets the original paths.
 
-def resolve_image_links(lines: List[str], md_dir: str) -> List[str]:
+    Yields:
+        the lines, with updated image paths.
     """
-    Finds markdown image links in lines, searches for the file under md_dir,
-    and replaces the reference with the fully qualified path if found.
+    logger.info("Resolving image links using doc path: %s", md_dir)
+    resolver = ImageResolver(md_dir, index)
+    resolved: Dict[tuple[str, bool], Optional[str]] = {}
+    rewrite = _rewriter(resolved)
+    for line, kind in classify(lines):
+        if not kind & IMAGE:
+            yield line
+            continue
+        new = list(dict.fromkeys(ref for ref in image_refs(line) if ref not in resolved))
+        found = []
+        for ref in new:
+            path = resolved[ref] = resolver.resolve(*ref)
+            if path is None:
+                logger.error("Image file not found: %s", ref[0])
+                continue
+            found.append(path)
+            if deps is not None:
+                deps.add(path)
+        if prepare is not None and found:
+            prepared = prepare(found)
+            for ref in new:
+                if resolved[ref] is not None:
+                    resolved[ref] = prepared.get(resolved[ref], resolved[ref])
+        yield IMAGE_REF_RE.sub(rewrite, line)
+    profiler.count("imgfix.images", len(resolved))
+
+
+def resolve_image_links(
+    lines: List[str],
+    md_dir: str,
+    deps: Optional[Set[str]] = None,
+    index: Optional[VaultIndex] = None,
+    workers: int = 0,
+    prepare: Optional[Callable[[Iterable[str]], Dict[str, str]]] = None,
+) -> List[str]:
+    """
+    Finds image references in lines, searches for the files under md_dir,
+    and replaces every reference with the fully qualified path if found.
 
     Args:
         lines: list of markdown lines (strings).
         md_dir: root directory to search for image files.
+        deps: if given, the paths of all resolved image files are added to it.
+        index: the vault index, used to find embedded images anywhere in the vault.
+        workers: resolve on this many threads, 0 = serial.
+        prepare: if given, maps the resolved paths to the files to link instead.
 
     Returns:
         list of processed lines with updated image paths.
     """
-    logger.info(f"Resolving image links using doc path: {md_dir}")
-    new_lines = []
-    for line in lines:
-        match = _IMG_LINK.search(line)
-        if match:
-            title, link = match.groups()
-            if link:
-                logger.info(f"Resolving image link: [{title}]({link})")
-                line = line.replace(link, _resolve_image_link(link, md_dir))
-        new_lines.append(line)
-
-    return new_lines
+    return resolve_document_images(Document(lines), md_dir, deps, index, workers, prepare).lines
+
+
+def find_image_paths(lines: List[str]) -> List[str]:
+    """
+    Lists the targets of all image references (markdown links and HTML img tags) in lines.
+
+    Args:
+        lines: list of markdown lines (strings).
+
+    Returns:
+        list of image link targets, in order of appearance.
+    """
+    return [
+        link for line in lines if "![" in line or "<img" in line for link, _ in image_refs(line)
+    ]
@@ -0,0 +1,151 @@
+"""
+Filename: imgprep.py
+
+Author: mg4news
+
+Date: 2025-09-24
+
+License: Unlicense
+
+Description:
+    Optional image pre-processing before PDF rendering. Images wider than the printable page at the
+    target DPI are downsampled, recompressed and stripped of metadata, so the renderer does not
+    decode and embed full resolution originals. Results are kept in a cache keyed by a hash of the
+    image content and the processing options, so an unchanged image is only ever processed once.
+    Pillow is an optional dependency; without it images are passed through unchanged.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable
+from textwrench.cachedir import cache_dir
+from textwrench import profiler
+
+logger = logging.getLogger(__name__)
+
+# A4 (210mm) less the template margins (2 x 15mm), in inches
+DEFAULT_PAGE_WIDTH = 7.1
+_FORMATS = {".png": "PNG", ".jpg": "JPEG", ".jpeg": "JPEG", ".webp": "WEBP"}
+
+
+def _pillow():
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    return Image
+
+
+class ImagePrep:
+
+    def __init__(
+        self,
+        dpi: int = 150,
+        page_width: float = DEFAULT_PAGE_WIDTH,
+        quality: int = 85,
+        directory: str | Path | None = None,
+        workers: int = 0,
+    ) -> None:
+        """
+        Initialize an image pre-processor.
+
+        Args:
+            dpi (int): the target resolution
+            page_width (float): the printable page width, in inches. Images are scaled down to
+                at most dpi * page_width pixels wide.
+            quality (int): the JPEG/WEBP quality (PNGs are recompressed losslessly)
+            directory (str or Path object): the cache directory. Defaults to `images` in the
+                textwrench cache directory.
+            workers (int): process images on this many threads, 0 = one per CPU
+        """
+        self.max_width = max(1, int(dpi * page_width))
+        self.quality = quality
+        self.directory = Path(directory) if directory else cache_dir("images")
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.workers = workers or os.cpu_count() or 1
+        self._options = f"{self.max_width}:{self.quality}".encode()
+
+    def key(self, path: str) -> str:
+        """
+        Returns the cache key of an image: a hash of its content and the processing options.
+        """
+        h = hashlib.sha256(self._options)
+        with open(path, "rb") as f:
+            h.update(hashlib.file_digest(f, "sha256").digest())
+        return h.hexdigest()
+
+    def _convert(self, image_module, src: str, dest: Path, fmt: str):
+        with image_module.open(src) as original:
+            original.load()
+            img = original
+            if img.width > self.max_width:
+                height = max(1, round(img.height * self.max_width / img.width))
+                img = img.resize((self.max_width, height), image_module.LANCZOS)
+                profiler.count("imgprep.downsampled")
+            if fmt == "JPEG" and img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+            # Only the pixels are saved, no EXIF/ICC/text chunks
+            options = {"optimize": True}
+            if fmt in ("JPEG", "WEBP"):
+                options["quality"] = self.quality
+            tmp = dest.with_name(f".{dest.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            img.save(tmp, fmt, **options)
+            # A JPEG that recompressing did not make smaller is saved with its own quantization
+            # tables instead: about the original size, still without the metadata
+            if (
+                img is original
+                and original.format == "JPEG"
+                and tmp.stat().st_size >= os.path.getsize(src)
+            ):
+                original.save(tmp, fmt, quality="keep", optimize=True)
+        os.replace(tmp, dest)
+
+    def process(self, path: str) -> str:
+        """
+        Returns the pre-processed version of an image, processing it if it is not in the cache.
+
+        Args:
+            path (str): the path of the original image
+
+        Returns:
+            the path of the processed image, or the original path if it cannot be processed
+        """
+        fmt = _FORMATS.get(Path(path).suffix.lower())
+        image_module = _pillow()
+        if fmt is None or image_module is None:
+            return path
+        try:
+            dest = self.directory / f"{self.key(path)}{Path(path).suffix.lower()}"
+            if dest.exists():
+                profiler.count("imgprep.hits")
+                return str(dest)
+            profiler.count("imgprep.misses")
+            self._convert(image_module, path, dest, fmt)
+        except Exception as e:
+            logger.warning("Could not pre-process image %s: %s", path, e)
+            return path
+        return str(dest)
+
+    @profiler.timed("imgprep")
+    def process_all(self, paths: Iterable[str]) -> Dict[str, str]:
+        """
+        Pre-processes a set of images in parallel.
+
+        Args:
+            paths (Iterable[str]): the original image paths
+
+        Returns:
+            a map of original path -> processed path
+        """
+        unique = list(dict.fromkeys(paths))
+        if unique and _pillow() is None:
+            logger.warning("Pillow is not installed, images are used unchanged.")
+            return {p: p for p in unique}
+        if self.workers > 1 and len(unique) > 1:
+            with ThreadPoolExecutor(self.workers) as pool:
+                return dict(zip(unique, pool.map(self.process, unique)))
+        return {p: self.process(p) for p in unique}
@@ -8,25 +8,159 @@ Date: 2025-07-30
 License: Unlicense
 
 Description:
-    Configures logging for the textwrench package.
+    Configures logging for the textwrench package. Nothing is configured when the package is
+    imported; the command line calls configure() at the start of a run and shutdown() at the end.
+    Console output is written by a background thread (QueueHandler/QueueListener), so the pipeline
+    does not wait on the terminal, and messages are only formatted on that thread. Every record is
+    counted per logger and message template. In quiet mode, only warnings and errors are written,
+    and the counts of the suppressed messages are logged as a summary at the end of the run.
+    Messages logged in hot loops use lazy %-style arguments, so that the count groups them by
+    template and suppressed messages are never formatted. Forked worker processes write to the
+    console directly.
 """
 
+import atexit
 import logging
+import logging.handlers
+import os
+import queue
 import sys
+import threading
+from collections import Counter
+from typing import List, Optional, TextIO, Tuple
 
 # Get a logger for the 'textwrench' package. This will be the parent logger.
 logger = logging.getLogger("textwrench")
 
-# Set the lowest-severity log message a logger will handle.
-logger.setLevel(logging.INFO)
+_FORMAT = "[%(asctime)s] [%(name)s] [%(levelname)s] - %(message)s"
+# Templates shown in the quiet mode summary
+_SUMMARY_TOP = 10
 
-# Create a handler to send log records to the console (stdout).
-console_handler = logging.StreamHandler(sys.stdout)
 
-# Create a formatter to define the log message layout and add it to the handler.
-formatter = logging.Formatter("[%(asctime)s] [%(name)s] [%(levelname)s] - %(message)s")
-console_handler.setFormatter(formatter)
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on the queue as they are. The stock QueueHandler formats the message in the
+    logging thread; here that is left to the listener's thread. Records stay in this process, so
+    they do not need to be made picklable.
+    """
 
-# Add the handler to the logger, but only if no handlers are already configured.
-if not logger.handlers:
-    logger.addHandler(console_handler)
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class _EventCounter(logging.Filter):
+    """
+    Counts records per (logger, message template). In quiet mode it also drops the records
+    below the quiet level, before they are queued or formatted.
+    """
+
+    def __init__(self, quiet_level: Optional[int]) -> None:
+        super().__init__()
+        self.quiet_level = quiet_level
+        self.counts: Counter = Counter()
+        self.suppressed: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, str(record.msg))
+        suppress = self.quiet_level is not None and record.levelno < self.quiet_level
+        with self._lock:
+            self.counts[key] += 1
+            if suppress:
+                self.suppressed[key] += 1
+        return not suppress
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[logging.Handler] = None
+_counter: Optional[_EventCounter] = None
+_console: Optional[logging.Handler] = None
+
+
+def configure(level: int = logging.INFO, quiet: bool = False, stream: Optional[TextIO] = None):
+    """
+    Configures console logging for the textwrench package, replacing any previous
+    configuration.
+
+    Args:
+        level (int): the lowest level of the records created
+        quiet (bool): only write warnings and errors, count the other records, and log a
+            summary of them at shutdown()
+        stream (TextIO): the console stream. Defaults to stderr, so that the output of the
+            query modes (e.g. --affected) can be piped.
+    """
+    global _listener, _handler, _counter, _console
+    shutdown(summary=False)
+    _console = logging.StreamHandler(stream or sys.stderr)
+    _console.setFormatter(logging.Formatter(_FORMAT))
+    _counter = _EventCounter(logging.WARNING if quiet else None)
+    _handler = _DeferredQueueHandler(queue.SimpleQueue())
+    _handler.addFilter(_counter)
+    _listener = logging.handlers.QueueListener(_handler.queue, _console)
+    _listener.start()
+    logger.setLevel(level)
+    logger.addHandler(_handler)
+    # The package has its own handler; do not also pass records to the root logger's
+    logger.propagate = False
+
+
+def counts() -> List[Tuple[str, str, int]]:
+    """
+    Returns how many records were logged since configure(), per logger and message template.
+
+    Returns:
+        a list of (logger name, template, count), most frequent first
+    """
+    if _counter is None:
+        return []
+    with _counter._lock:
+        return [(name, msg, n) for (name, msg), n in _counter.counts.most_common()]
+
+
+def shutdown(summary: bool = True):
+    """
+    Logs the quiet mode summary (if any records were suppressed), then flushes and stops the
+    console thread. Safe to call more than once.
+
+    Args:
+        summary (bool): log the summary of suppressed records
+    """
+    global _listener, _handler, _counter, _console
+    if _handler is None:
+        return
+    suppressed = _counter.suppressed if _counter else Counter()
+    if summary and suppressed:
+        # Bypass the counter, the summary itself must always be written
+        _counter.quiet_level = None
+        logger.warning(
+            "Quiet mode: %d messages not shown (%d kinds). Most frequent:",
+            sum(suppressed.values()),
+            len(suppressed),
+        )
+        for (name, msg), n in suppressed.most_common(_SUMMARY_TOP):
+            logger.warning("  %7d x [%s] %s", n, name, msg)
+    if _listener is not None:
+        _listener.stop()
+    logger.removeHandler(_handler)
+    logger.propagate = True
+    _listener = _handler = _counter = _console = None
+
+
+def _after_fork_in_child():
+    # The listener thread does not exist in a forked child (batch jobs, process pools), and
+    # children often leave with os._exit, without flushing a queue. They write directly.
+    global _listener, _handler, _counter
+    if _listener is None:
+        return
+    logger.removeHandler(_handler)
+    # The child counts (and summarizes) its own records only
+    _counter = _EventCounter(_counter.quiet_level)
+    _handler = _console
+    _handler.addFilter(_counter)
+    logger.addHandler(_handler)
+    _listener = None
+
+
+atexit.register(shutdown)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
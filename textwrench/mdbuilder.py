@@ -9,26 +9,19 @@ License: Unlicense
 
 Description:
     Walks a markdown file, and inserts any linked markdown documents.
-    Results in a single assembled markdown file
+    Results in a single assembled markdown file. iter_assemble() does the same as a stream, reading
+    the linked documents as the lines are consumed, for documents too large to hold in memory.
 """
 
-import re
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Set
 from textwrench.pathmgr import PathMgr
-from textwrench.mdstate import MdState
+from textwrench.document import Document, COMMENT, WIKILINK, DOC_LINK_RE, classify
+from textwrench import profiler
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Explanation of regex:
-# 	^ → start of line
-# 	\s* → allow optional whitespace before the link
-# 	(!)? → Optional embed character i.e. !
-# 	\[\[ ... \]\] → the wiki link itself
-# 	\s* → allow trailing spaces
-# 	$ → end of line
-_DOC_LINK_RE = re.compile(r"^\s*(!)?\[\[([^\]|]+)(?:\|([^\]]+))?\]\]\s*$")
-_MAX_PASSES = 3
+_MAX_DEPTH = 32
 
 
 def strip_html_comment_blocks(lines: List[str]) -> List[str]:
@@ -41,71 +34,205 @@ def strip_html_comment_blocks(lines: List[str]) -> List[str]:
     Returns:
         List[str]: Lines with YAML blocks removed.
     """
-    stripped = []
-    docstate = MdState()
+    return Document(lines).content_lines()
 
-    for line in lines:
-        docstate.process_line(line)
-        if not docstate.in_comment_block:
-            stripped.append(line)
 
-    return stripped
+class _Frame:
+    """
+    One document being expanded on the assembly stack.
+    """
+
+    __slots__ = ("doc", "path", "document", "links", "pos", "start")
+
+    def __init__(
+        self, doc: str | None, path: str | None, lines: List[str], start: int
+    ) -> None:
+        self.doc = doc
+        self.path = path
+        self.document = Document(lines)
+        self.links = {link["line"]: link for link in self.document.wiki_links}
+        self.pos = 0
+        self.start = start
+
+
+class _Stream:
+    """
+    One document being streamed on the assembly stack (see iter_assemble).
+    """
+
+    __slots__ = ("doc", "path", "lines")
 
+    def __init__(self, doc: str | None, path: str | None, lines: Iterable[str]) -> None:
+        self.doc = doc
+        self.path = path
+        self.lines = classify(lines)
 
-def _one_pass(lines: List[str], fmgr: PathMgr) -> List[str]:
+
+def _cycle_error(stack: List[_Frame] | List[_Stream], doc: str, path: str) -> ValueError:
+    paths = [f.path for f in stack]
+    chain = [f.doc for f in stack[paths.index(path) :]] + [doc]
+    msg = f"Document include cycle detected: {' -> '.join(chain)}"
+    logger.error(msg)
+    return ValueError(msg)
+
+
+@profiler.timed("assemble")
+def assemble(
+    lines: List[str],
+    fmgr: PathMgr,
+    max_depth: int = _MAX_DEPTH,
+    deps: Optional[Set[str]] = None,
+    boundaries: Optional[List[int]] = None,
+) -> List[str]:
     """
-    Perform a single assembly pass.
+    Assembles a single markdown file from linked markdown documents. Inlines any markdown
+    document referenced by an Obsidian or Wikipedia style doc link, depth first, in a single
+    streaming pass. Each linked document is read and expanded once; further links to the same
+    document reuse the already expanded lines. Assembly stops as soon as nothing is left to
+    expand. Links inside fenced code blocks are left alone, and HTML comment blocks are removed.
+    Links are resolved with PathMgr.resolve_link, i.e. anywhere in the vault if the PathMgr has a
+    vault index.
 
     Args:
-        lines (List[str]): A list of strings, each representing a line of text from the root document
+        lines (List[str]): A list of strings, each representing a line of text from the root
+            document
         fmgr (PathMgr): A File/Path Manager instance to handle fetching documents
+        max_depth (int): the maximum include depth (root document = 0). Defaults to 32.
+        deps (Set[str]): if given, the paths of all inserted documents are added to it
+        boundaries (List[int]): if given, the output line numbers where the documents linked
+            from the root document start are appended to it (the top level chapter boundaries)
 
     Returns:
         a list of lines representing the assembled linked document
+
+    Raises:
+        a value error if the include depth is exceeded, or if documents include each other in a
+        cycle
+
     """
-    logger.info("Document assemply pass starting...")
-    new_lines = []
-    for line in lines:
-        match = _DOC_LINK_RE.match(line)
-        doc = None
-        if match:
-            is_embed, doc, alias = match.groups()
-            logger.info(f"Found doc link: {doc}")
-        if doc and fmgr.file_exists(f"{doc}.md"):
-            logger.info(f"Inserted document: {doc}")
-            n = fmgr.read_lines(f"{doc}.md")
-            new_lines.extend(strip_html_comment_blocks(n))
-        else:
-            new_lines.append(line)
-    logger.info("Document assembly pass done...")
-    return new_lines
-
-
-def assemble(lines: List[str], fmgr: PathMgr, passes: int = 1) -> List[str]:
+    out: List[str] = []
+    expanded: dict[str, tuple[int, int]] = {}
+    stack = [_Frame(None, None, lines, 0)]
+
+    while stack:
+        frame = stack[-1]
+        if frame.pos >= len(frame.document):
+            stack.pop()
+            if frame.path is not None:
+                expanded[frame.path] = (frame.start, len(out))
+                logger.info("Inserted document: %s", frame.doc)
+            continue
+
+        pos = frame.pos
+        frame.pos += 1
+        if frame.document.kind(pos) & COMMENT:
+            continue
+        link = frame.links.get(pos)
+        if not link:
+            out.append(frame.document.lines[pos])
+            continue
+
+        doc = link["target"]
+        line = frame.document.lines[pos]
+        logger.info("Found doc link: %s", doc)
+        resolved = fmgr.resolve_link(doc)
+        if resolved is None:
+            out.append(line)
+            continue
+        path = str(resolved)
+        if boundaries is not None and len(stack) == 1:
+            boundaries.append(len(out))
+        if path in expanded:
+            start, end = expanded[path]
+            out.extend(out[start:end])
+            continue
+        if any(f.path == path for f in stack):
+            raise _cycle_error(stack, doc, path)
+        if len(stack) > max_depth:
+            msg = f"Maximum include depth ({max_depth}) exceeded at '{doc}'. Aborting."
+            logger.error(msg)
+            raise ValueError(msg)
+        stack.append(_Frame(doc, path, fmgr.read_lines(path), len(out)))
+
+    logger.info("Document assembly done, %s documents inserted.", len(expanded))
+    profiler.count("mdbuilder.documents", len(expanded))
+    profiler.count("mdbuilder.lines", len(out))
+    if deps is not None:
+        deps.update(expanded)
+    return out
+
+
+def iter_assemble(
+    lines: Iterable[str],
+    fmgr: PathMgr,
+    max_depth: int = _MAX_DEPTH,
+    deps: Optional[Set[str]] = None,
+    boundaries: Optional[List[int]] = None,
+) -> Iterator[str]:
     """
-    Assembles a single markdown file from linked markdown documents. Runs up
-    to three passes. Inlines in any markdown document referenced by an Obsidian or
-    Wikipedia style doc link. Each pass (default = 1) fetches the next level of documents.
+    The streaming counterpart of assemble: yields the assembled document line by line, with the
+    same content. Linked documents are read as the lines are consumed, and a document linked more
+    than once is read again instead of being kept, so memory use does not grow with the size of
+    the document.
 
     Args:
-        lines (List[str]): A list of strings, each representing a line of text from the root document
+        lines (Iterable[str]): the lines of the root document (any iterator of lines)
         fmgr (PathMgr): A File/Path Manager instance to handle fetching documents
-        passes (int): the maximum number of passes to make. Defaults to 1.
+        max_depth (int): the maximum include depth (root document = 0). Defaults to 32.
+        deps (Set[str]): if given, the paths of all inserted documents are added to it once
+            the lines are exhausted
+        boundaries (List[int]): if given, the output line numbers where the documents linked
+            from the root document start are appended to it, as they are reached
 
-    Returns:
-        a list of lines representing the assembled linked document
+    Yields:
+        the lines of the assembled document
 
     Raises:
-        a value error if the maximum number of passes is exceeded
-
+        a value error if the include depth is exceeded, or if documents include each other in a
+        cycle
     """
-    if passes > _MAX_PASSES:
-        msg = f"Maximum number of passes ({_MAX_PASSES}) exceeded. Aborting."
-        logger.error(msg)
-        raise ValueError(msg)
-
-    asm_lines = strip_html_comment_blocks(lines)
-    for p in range(passes):
-        logger.info(f"Document assembly pass: {p + 1} / {passes}")
-        asm_lines = _one_pass(asm_lines, fmgr)
-    return asm_lines
+    stack = [_Stream(None, None, lines)]
+    inserted: Set[str] = set()
+    count = 0
+
+    while stack:
+        frame = stack[-1]
+        item = next(frame.lines, None)
+        if item is None:
+            stack.pop()
+            if frame.path is not None:
+                inserted.add(frame.path)
+                logger.info("Inserted document: %s", frame.doc)
+            continue
+
+        line, kind = item
+        if kind & COMMENT:
+            continue
+        if not kind & WIKILINK:
+            count += 1
+            yield line
+            continue
+
+        target = DOC_LINK_RE.match(line).group(2)
+        logger.info("Found doc link: %s", target)
+        resolved = fmgr.resolve_link(target)
+        if resolved is None:
+            count += 1
+            yield line
+            continue
+        path = str(resolved)
+        if boundaries is not None and len(stack) == 1:
+            boundaries.append(count)
+        if any(f.path == path for f in stack):
+            raise _cycle_error(stack, target, path)
+        if len(stack) > max_depth:
+            msg = f"Maximum include depth ({max_depth}) exceeded at '{target}'. Aborting."
+            logger.error(msg)
+            raise ValueError(msg)
+        stack.append(_Stream(target, path, fmgr.iter_lines(path)))
+
+    logger.info("Document assembly done, %s documents inserted.", len(inserted))
+    profiler.count("mdbuilder.documents", len(inserted))
+    profiler.count("mdbuilder.lines", count)
+    if deps is not None:
+        deps.update(inserted)
@@ -16,6 +16,9 @@ import re
 
 _CODE_BLOCK_TYPE = re.compile(r"^```(\w+)?")
 
+# One logger for all instances; a document scan creates an MdState per run of lines
+logger = logging.getLogger(__name__)
+
 
 class MdState:
 
@@ -28,10 +31,24 @@ class MdState:
         self._last_line = False
 
     def __init__(self):
-        self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
         self._reset_states()
         self.line_count = 0
 
+    @property
+    def in_block(self) -> bool:
+        """True if the last line processed is part of a code, comment, YAML or HTML block."""
+        return (
+            self.in_code_block
+            or self.in_comment_block
+            or self.in_yaml_block
+            or self.in_html_block
+        )
+
+    @property
+    def at_block_end(self) -> bool:
+        """True if the last line processed closed a block, i.e. the next line starts outside it."""
+        return self._last_line
+
     def process_line(self, line: str):
         stripped_line = line.strip()
         self.line_count += 1
@@ -43,26 +60,30 @@ class MdState:
         # Check for code blocks (fenced code blocks)
         if stripped_line.startswith("```"):
             if not self.in_code_block:
-                self.logger.info(f"Code block starts at line {self.line_count}.")
+                logger.info("Code block starts at line %d.", self.line_count)
                 self.in_code_block = True
                 match = _CODE_BLOCK_TYPE.match(stripped_line)
                 if match:
                     self.code_block_type = match.group(1)
-                    self.logger.info(
-                        f"Code block type: {self.code_block_type} at line {self.line_count}."
+                    logger.info(
+                        "Code block type: %s at line %d.", self.code_block_type, self.line_count
                     )
             else:
-                self.logger.info(f"Code block ends at line {self.line_count}.")
+                logger.info("Code block ends at line %d.", self.line_count)
                 self._last_line = True
             return
 
         # Check for HTML comment blocks
         if not self.in_comment_block and stripped_line.startswith("<!--"):
             self.in_comment_block = True
-            self.logger.info(f"HTML comment block starts at line {self.line_count}.")
+            logger.info("HTML comment block starts at line %d.", self.line_count)
+            if stripped_line.endswith("-->"):
+                # Single line comment
+                self._last_line = True
+                return
         elif self.in_comment_block and stripped_line.endswith("-->"):
             self._last_line = True
-            self.logger.info(f"HTML comment block ends at line {self.line_count}.")
+            logger.info("HTML comment block ends at line %d.", self.line_count)
             return  # The line ending the comment block is part of the block
 
         # Check for YAML front matter (typically at the very beginning of the file)
@@ -75,10 +96,10 @@ class MdState:
                 and not self.in_comment_block
             ):
                 self.in_yaml_block = True
-                self.logger.info(f"YAML block starts at line {self.line_count}.")
+                logger.info("YAML block starts at line %d.", self.line_count)
         elif self.in_yaml_block and stripped_line == "---":
             self._last_line = True
-            self.logger.info(f"YAML block ends at line {self.line_count}.")
+            logger.info("YAML block ends at line %d.", self.line_count)
             return  # The line ending the YAML block is part of the block
 
         # Check for raw HTML blocks (simplified: lines starting with < and ending with >)
@@ -89,8 +110,8 @@ class MdState:
             and stripped_line.endswith(">")
         ):
             self.in_html_block = True
-            self.logger.info(f"HTML block starts at line {self.line_count}.")
+            logger.info("HTML block starts at line %d.", self.line_count)
         elif self.in_html_block and stripped_line.startswith("</"):
             self._last_line = True
-            self.logger.info(f"HTML block ends at line {self.line_count}.")
+            logger.info("HTML block ends at line %d.", self.line_count)
             return  # The line ending the HTML block is part of the block
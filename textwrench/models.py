@@ -12,7 +12,7 @@ Description:
     Prefer this to pydantic to limit dependencies and for a bit more efficiency.
 """
 
-from typing import List, Optional, TypedDict
+from typing import List, NotRequired, Optional, TypedDict
 
 
 class TocMarker(TypedDict):
@@ -20,3 +20,61 @@ class TocMarker(TypedDict):
     end_line: int
     min_depth: int
     max_depth: int
+
+
+class Heading(TypedDict):
+    line: int
+    depth: int
+    text: str
+
+
+class Anchor(TypedDict):
+    line: int
+    depth: int
+    text: str
+    slug: str
+
+
+class WikiLink(TypedDict):
+    line: int
+    target: str
+    alias: Optional[str]
+    embed: bool
+
+
+class Block(TypedDict):
+    start: int
+    end: int
+    kind: int
+    lang: Optional[str]
+
+
+class BatchResult(TypedDict):
+    inp: str
+    status: str
+    attempts: int
+    duration: float
+    error: Optional[str]
+
+
+class RewriteRule(TypedDict):
+    pattern: str
+    replace: str
+    ignore_case: NotRequired[bool]
+    scope: NotRequired[str]
+
+
+class RewriteResult(TypedDict):
+    path: str
+    changed: bool
+    replacements: int
+    diff: Optional[str]
+    error: Optional[str]
+
+
+class Diagnostic(TypedDict):
+    file: str
+    line: Optional[int]
+    check: str
+    severity: str
+    message: str
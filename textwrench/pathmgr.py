@@ -13,28 +13,168 @@ Description:
     and reuse
 """
 
+import contextlib
+import hashlib
+import io
 import logging
+import os
+import threading
 from pathlib import Path
-from typing import List
+from typing import BinaryIO, Dict, Iterator, List, Optional, TextIO
+from textwrench.cachedir import cache_dir
+from textwrench.vaultindex import VaultIndex, find_vault_root
+from textwrench.contentcache import ContentCache, shared_cache
+from textwrench import profiler
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks on this platform (Windows); threads are still serialized
+    fcntl = None
+
+class _PathLock:
+    """
+    The lock on one path, while any thread of this process holds or waits for it: a reentrant
+    lock for the threads of this process, how deep the holding thread has nested it, and the lock
+    file while it is held.
+    """
+
+    __slots__ = ("rlock", "depth", "file", "users")
+
+    def __init__(self) -> None:
+        self.rlock = threading.RLock()
+        self.depth = 0
+        self.file = None
+        self.users = 0
+
+
+# Each path has its own lock (and lock file), so unrelated paths never wait for each other
+_path_locks: Dict[str, _PathLock] = {}
+_path_locks_guard = threading.Lock()
+# How many file locks the current thread holds
+_held = threading.local()
+
+
+def holds_file_lock() -> bool:
+    """
+    Returns True if the calling thread holds any file lock (see file_lock).
+    """
+    return getattr(_held, "count", 0) > 0
+
+
+@contextlib.contextmanager
+def file_lock(path: str | Path) -> Iterator[None]:
+    """
+    Holds an exclusive advisory lock on a path, across threads and processes (e.g. the parallel
+    jobs of a batch that write to the same directory). The lock is reentrant within a thread.
+    Only other lock holders are excluded; plain reads and writes are not blocked.
+    A thread should hold one path's lock at a time: two threads that nest the locks of the same
+    paths in opposite orders deadlock.
+
+    Args:
+        path (str or Path object): the path to lock; it does not need to exist
+    """
+    key = hashlib.sha256(os.path.realpath(path).encode()).hexdigest()
+    with _path_locks_guard:
+        lock = _path_locks.setdefault(key, _PathLock())
+        lock.users += 1
+    try:
+        with lock.rlock:
+            if lock.depth == 0 and fcntl is not None:
+                f = open(cache_dir("locks") / f"{key}.lock", "a")
+                fcntl.flock(f, fcntl.LOCK_EX)
+                lock.file = f
+            lock.depth += 1
+            _held.count = getattr(_held, "count", 0) + 1
+            try:
+                yield
+            finally:
+                _held.count -= 1
+                lock.depth -= 1
+                if lock.depth == 0 and lock.file is not None:
+                    f, lock.file = lock.file, None
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                    f.close()
+    finally:
+        with _path_locks_guard:
+            lock.users -= 1
+            if lock.users == 0:
+                del _path_locks[key]
+
+
+def _write_lock(path: Path) -> contextlib.AbstractContextManager:
+    # The lock for a write; a thread that already holds a lock (e.g. a build's, on its output)
+    # writes under that one, so locks are never nested
+    return contextlib.nullcontext() if holds_file_lock() else file_lock(path)
+
+
+@contextlib.contextmanager
+def _atomic_file(path: str | Path) -> Iterator[BinaryIO]:
+    # Yields a temporary file next to path, which replaces path when the block completes
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp, "wb") as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        if path.exists():
+            os.chmod(tmp, path.stat().st_mode & 0o7777)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def write_atomic(path: str | Path, data: bytes):
+    """
+    Writes a file atomically: to a temporary file in the same directory, which then replaces
+    the original. Readers see the old or the new content, never a partial file. The file mode of
+    an existing file is kept.
+
+    Args:
+        path (str or Path object): the file
+        data (bytes): the new content
+    """
+    with _atomic_file(path) as f:
+        f.write(data)
+
+
+def _same_content(path: Path, data: bytes) -> bool:
+    try:
+        if path.stat().st_size != len(data):
+            return False
+        with open(path, "rb") as f:
+            old = f.read()
+    except OSError:
+        return False
+    profiler.count("pathmgr.bytes_read", len(old))
+    return hashlib.sha256(old).digest() == hashlib.sha256(data).digest()
 
 
 class PathMgr:
 
-    def __init__(self, relative_dir: str | Path) -> None:
+    def __init__(
+        self, relative_dir: str | Path, cache: Optional[ContentCache] = None
+    ) -> None:
         """
         Initialize a PathMgr object. Creates the directory if it doesn't exist.
         Logs actions performed by the instance.
 
         Args:
             relative_dir (str or Path object): The relative directory where data will be stored and loaded.
+            cache (ContentCache): the cache for file contents read with read_lines. Defaults to the
+                process wide cache, shared by all PathMgr instances.
         """
         self.logger = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
         self.directory = Path(relative_dir).resolve()
+        self.index: Optional[VaultIndex] = None
+        self.cache = cache if cache is not None else shared_cache()
 
         # Create directory only if it does not exist
         if not self.directory.exists():
             self.directory.mkdir(parents=True, exist_ok=True)
-            self.logger.info(f"Created directory: {self.directory}")
+            self.logger.info("Created directory: %s", self.directory)
 
     def file_exists(self, filename: str) -> bool:
         """
@@ -48,9 +188,8 @@ class PathMgr:
             bool: True if the file exists, False otherwise.
         """
         exists = (self.directory / filename).exists()
-        self.logger.info(
-            f"Checked if '{filename}' exists in '{self.directory}': {exists}"
-        )
+        profiler.count("pathmgr.stat")
+        self.logger.info("Checked if '%s' exists in '%s': %s", filename, self.directory, exists)
         return exists
 
     def delete_file(self, filename: str):
@@ -67,13 +206,14 @@ class PathMgr:
         filepath = self.directory / filename
         if filepath.exists():
             filepath.unlink()
-            self.logger.info(f"Deleted file: {filepath}")
+            self.logger.info("Deleted file: %s", filepath)
         else:
-            self.logger.info(f"Attempted to delete non-existent file: {filepath}")
+            self.logger.info("Attempted to delete non-existent file: %s", filepath)
 
     def read_lines(self, filename: str) -> List[str]:
         """
-        Reads a text file and returns its contents as a list of lines.
+        Reads a text file and returns its contents as a list of lines. Contents are cached,
+        and only re-read if the file's modification time or size changed.
 
         Args:
             filename (str): The name of the text file to read.
@@ -82,26 +222,114 @@ class PathMgr:
             List[str]: A list of strings, each representing a line from the file.
         """
         filepath = self.directory / filename
+        key = str(filepath)
+        st = os.stat(filepath)
+        profiler.count("pathmgr.stat")
+        lines = self.cache.get(key, st.st_mtime_ns, st.st_size)
+        if lines is not None:
+            profiler.count("pathmgr.cache_hits")
+            return lines
+        profiler.count("pathmgr.cache_misses")
         with open(filepath, "r") as f:
             lines = f.readlines()
-            self.logger.info(f"Read text file: {filepath}")
-            return lines
+            # Validate against the file that was actually read
+            st = os.fstat(f.fileno())
+            profiler.count("pathmgr.open")
+            profiler.count("pathmgr.bytes_read", st.st_size)
+            self.logger.info("Read text file: %s", filepath)
+        self.cache.put(key, st.st_mtime_ns, st.st_size, lines)
+        return lines
 
-    def write_lines(self, filename: str, lines: List[str]):
+    def iter_lines(self, filename: str) -> Iterator[str]:
         """
-        Writes a list of lines to a text file.
+        Yields the lines of a text file one at a time, without reading the whole file into
+        memory. Lines already in the cache are served from it; otherwise the file is streamed,
+        and not added to the cache.
+
+        Args:
+            filename (str): The name of the text file to read.
+
+        Yields:
+            the lines of the file
+        """
+        filepath = self.directory / filename
+        st = os.stat(filepath)
+        profiler.count("pathmgr.stat")
+        lines = self.cache.get(str(filepath), st.st_mtime_ns, st.st_size)
+        if lines is not None:
+            profiler.count("pathmgr.cache_hits")
+            yield from lines
+            return
+        profiler.count("pathmgr.open")
+        profiler.count("pathmgr.bytes_read", st.st_size)
+        self.logger.info("Streaming text file: %s", filepath)
+        with open(filepath, "r") as f:
+            yield from f
+
+    @contextlib.contextmanager
+    def open_atomic(self, filename: str) -> Iterator[TextIO]:
+        """
+        Opens a text file (UTF-8) for writing, for content that is written in pieces (e.g. a
+        streamed document). Like write_lines, the file is replaced atomically under its advisory
+        lock, once the block completes; if the block raises, the original file is kept.
+        If the calling thread already holds a file lock, the write happens under that lock.
+
+        Args:
+            filename (str): The name of the text file to write.
+
+        Yields:
+            the open file
+        """
+        filepath = self.directory / filename
+        with _write_lock(filepath), _atomic_file(filepath) as f:
+            text = io.TextIOWrapper(f, encoding="utf-8", newline="")
+            yield text
+            text.flush()
+            text.detach()
+            profiler.count("pathmgr.open")
+            profiler.count("pathmgr.bytes_written", f.tell())
+        self.cache.invalidate(str(filepath))
+        self.logger.info("Wrote text file: %s", filepath)
+
+    def lock(self, filename: str) -> contextlib.AbstractContextManager:
+        """
+        Returns a context manager that holds an exclusive advisory lock on a file, across
+        threads and processes. See file_lock.
+
+        Args:
+            filename (str): The name of the file to lock.
+        """
+        return file_lock(self.directory / filename)
+
+    def write_lines(self, filename: str, lines: List[str], only_if_changed: bool = False) -> bool:
+        """
+        Writes a list of lines to a text file (UTF-8). The file is replaced atomically, under
+        the file's advisory lock, so concurrent writers never interleave and readers never see
+        a partial file. If the calling thread already holds a file lock (e.g. a build holding
+        the lock on its output), the write happens under that lock instead, so locks never nest.
 
         Args:
             filename (str): The name of the text file to write.
             lines (List[str]): A list of strings to write to the file.
+            only_if_changed (bool): skip the write, keeping the file and its mtime, if the file
+                already has this content.
 
         Returns:
-            None
+            True if the file was written, False if the write was skipped
         """
         filepath = self.directory / filename
-        with open(filepath, "w") as f:
-            f.writelines(lines)
-            self.logger.info(f"Wrote text file: {filepath}")
+        data = "".join(lines).encode("utf-8")
+        with _write_lock(filepath):
+            if only_if_changed and _same_content(filepath, data):
+                profiler.count("pathmgr.writes_skipped")
+                self.logger.info("Unchanged, not written: %s", filepath)
+                return False
+            self.cache.invalidate(str(filepath))
+            write_atomic(filepath, data)
+        profiler.count("pathmgr.open")
+        profiler.count("pathmgr.bytes_written", len(data))
+        self.logger.info("Wrote text file: %s", filepath)
+        return True
 
     def get_resolved_path(self, filename: str | None = None) -> Path:
         """
@@ -117,3 +345,39 @@ class PathMgr:
             return self.directory
         else:
             return self.directory / filename
+
+    def index_vault(
+        self, root: str | Path | None = None, cache_file: str | Path | None = None
+    ) -> VaultIndex:
+        """
+        Builds (or incrementally refreshes) the vault index used to resolve wiki links.
+
+        Args:
+            root (str or Path object): the vault root. Defaults to the enclosing Obsidian
+                vault, or this directory if it is not inside a vault.
+            cache_file (str or Path object): where to persist the index. Defaults to
+                the textwrench cache directory
+
+        Returns:
+            VaultIndex: the refreshed index
+        """
+        if root is None:
+            root = find_vault_root(self.directory) or self.directory
+        self.index = VaultIndex(root, cache_file).refresh()
+        return self.index
+
+    def resolve_link(self, name: str) -> Optional[Path]:
+        """
+        Resolves a wiki link target (e.g. `[[name]]`) to a markdown file. Uses the vault index
+        if one was built, otherwise looks for `<name>.md` in this directory.
+
+        Args:
+            name (str): the link target
+
+        Returns:
+            Path: the resolved path of the linked document, or None if not found
+        """
+        if self.index is not None:
+            return self.index.lookup(name, near=self.directory)
+        filename = name if name.endswith(".md") else f"{name}.md"
+        return self.directory / filename if self.file_exists(filename) else None
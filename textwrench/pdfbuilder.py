@@ -8,29 +8,327 @@ Date: 2025-08-25
 License: Unlicense
 
 Description:
-    Pandoc builder class. Handles the conversion from MD -> HTML -> PDF
+    Pandoc builder class. Handles the conversion from MD -> HTML -> PDF. The markdown can come from a
+    file, or be streamed from memory to pandoc's stdin.
+    The conversion is asynchronous (`await builder.convert(...)`): the number of pandoc processes
+    running at once can be limited, a conversion that takes too long is killed together with its
+    children (weasyprint), pandoc's stderr is logged as it arrives, and cancelling the task kills
+    the processes too. convert_to_pdf and convert_lines_to_pdf are synchronous wrappers.
+    to_html and html_to_pdf run the two halves separately, for renders that assemble the HTML
+    from parts (see fragments.py).
 """
 
+import asyncio
+import os
+import signal
 import subprocess
+import time
+import weakref
+from collections import deque
+from typing import Iterable, List, Optional
 from textwrench.pathmgr import PathMgr
+from textwrench import htmlrender, profiler
 import logging
 
 logger = logging.getLogger(__name__)
 
+ENGINES = ("pandoc", "weasyprint")
+
+# Flush stdin to pandoc in chunks of about this size
+_CHUNK = 64 * 1024
+# Lines of stderr kept for the error report
+_STDERR_TAIL = 50
+
+
+def _kill_tree(proc: asyncio.subprocess.Process):
+    # pandoc runs in its own session, so its process group includes weasyprint
+    try:
+        if hasattr(os, "killpg"):
+            os.killpg(proc.pid, signal.SIGKILL)
+        else:
+            proc.kill()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def _feed(stdin: asyncio.StreamWriter, lines: Iterable[str]) -> int:
+    written = 0
+    pending = 0
+    try:
+        for line in lines:
+            data = line.encode("utf-8")
+            stdin.write(data)
+            written += len(data)
+            pending += len(data)
+            if pending >= _CHUNK:
+                await stdin.drain()
+                pending = 0
+        await stdin.drain()
+        stdin.close()
+        await stdin.wait_closed()
+    except (BrokenPipeError, ConnectionResetError):
+        # pandoc exited early; its exit status and stderr tell why
+        pass
+    return written
+
+
+async def _stream_stderr(stderr: asyncio.StreamReader, tool: str, source: str, tail: deque):
+    async for raw in stderr:
+        line = raw.decode("utf-8", errors="replace").rstrip()
+        tail.append(line)
+        logger.warning("%s (%s): %s", tool, source, line)
+
 
 class PdfBuilder:
 
-    def __init__(self, fmgr: PathMgr) -> None:
+    def __init__(
+        self,
+        fmgr: PathMgr,
+        engine: str = "pandoc",
+        timeout: Optional[float] = None,
+        max_concurrency: int = 0,
+    ) -> None:
         """
         Initializes the PdfBuilder with a PathMgr instance.
 
         Args:
             fmgr (PathMgr): An instance of PathMgr to handle file operations.
+            engine (str): "pandoc" runs pandoc with weasyprint as its PDF engine. "weasyprint"
+                uses pandoc for MD -> HTML only, and renders HTML -> PDF in-process, keeping
+                stylesheets and fonts loaded across documents.
+            timeout (float): the maximum time, in seconds, for one pandoc run. None = no limit.
+                The in-process weasyprint render cannot be interrupted, so it is not limited.
+            max_concurrency (int): the maximum number of pandoc runs at once, across all the
+                conversions awaited on this builder. 0 = no limit.
         """
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown PDF engine '{engine}', expected one of {ENGINES}")
         self.fmgr = fmgr
-        logger.info("PdfBuilder initialized.")
+        self.engine = engine
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        # asyncio semaphores belong to an event loop, and the sync wrappers run a new loop per call
+        self._semaphores: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        logger.info("PdfBuilder initialized, engine: %s.", engine)
 
-    def convert_to_pdf(
+    def _semaphore(self) -> Optional[asyncio.Semaphore]:
+        if self.max_concurrency <= 0:
+            return None
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+        return semaphore
+
+    async def _run_pandoc_async(
+        self, command: List[str], source: str, lines: Optional[Iterable[str]] = None
+    ) -> str:
+        semaphore = self._semaphore()
+        if semaphore is None:
+            return await self._exec(command, source, lines)
+        async with semaphore:
+            return await self._exec(command, source, lines)
+
+    async def _exec(
+        self, command: List[str], source: str, lines: Optional[Iterable[str]]
+    ) -> str:
+        logger.info("Executing %s command: %s", command[0], " ".join(command))
+        start = time.perf_counter()
+        returncode = None
+        tail: deque = deque(maxlen=_STDERR_TAIL)
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *command,
+                stdin=asyncio.subprocess.PIPE if lines is not None else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
+            )
+        except FileNotFoundError:
+            logger.error(
+                "Pandoc or weasyprint not found. Please ensure they are installed and in your PATH."
+            )
+            raise
+        try:
+            async with asyncio.timeout(self.timeout):
+                tasks = [
+                    proc.stdout.read(),
+                    _stream_stderr(proc.stderr, command[0], source, tail),
+                ]
+                if lines is not None:
+                    tasks.append(_feed(proc.stdin, lines))
+                results = await asyncio.gather(*tasks)
+                returncode = await proc.wait()
+        except TimeoutError:
+            _kill_tree(proc)
+            await proc.wait()
+            msg = f"Pandoc conversion of '{source}' timed out after {self.timeout} s, killed."
+            logger.error(msg)
+            raise TimeoutError(msg) from None
+        except asyncio.CancelledError:
+            _kill_tree(proc)
+            await proc.wait()
+            logger.warning("Pandoc conversion of '%s' cancelled, killed.", source)
+            raise
+        finally:
+            profiler.record_subprocess(command[0], time.perf_counter() - start, returncode)
+
+        stdout = results[0].decode("utf-8")
+        if lines is not None:
+            profiler.count("pdfbuilder.bytes_to_pandoc", results[2])
+        if returncode != 0:
+            logger.error("Pandoc conversion failed for '%s':", source)
+            logger.error("Stdout: %s", stdout)
+            raise subprocess.CalledProcessError(returncode, command, stdout, "\n".join(tail))
+        profiler.count("pdfbuilder.bytes_from_pandoc", len(stdout))
+        return stdout
+
+    def _run_pandoc(
+        self, command: List[str], source: str, lines: Optional[Iterable[str]] = None
+    ) -> str:
+        """
+        Runs pandoc to completion (synchronous). If lines are given they are streamed to
+        pandoc's stdin.
+        """
+        return asyncio.run(self._run_pandoc_async(command, source, lines))
+
+    async def _convert(
+        self,
+        input_args: List[str],
+        source: str,
+        lines: Optional[Iterable[str]],
+        output_pdf_file: str,
+        css_file: str,
+        html_template_file: str,
+    ):
+        output_path = self.fmgr.directory / output_pdf_file
+        css_opt = f"--css={css_file}"
+        html_opt = f"--template={html_template_file}"
+        # Relative links resolve against the document directory, also when reading stdin
+        resource_opt = f"--resource-path={self.fmgr.directory}"
+
+        if self.engine == "weasyprint":
+            # pandoc only produces the HTML, the stylesheet is applied by the renderer
+            command = [
+                "pandoc", *input_args, "-f", "gfm", "-t", "html5", html_opt, resource_opt, "-s"
+            ]
+            html = await self._run_pandoc_async(command, source, lines)
+            await asyncio.to_thread(
+                htmlrender.render_pdf,
+                html,
+                output_path,
+                [css_file],
+                base_url=str(self.fmgr.directory),
+            )
+        else:
+            command = [
+                "pandoc",
+                *input_args,
+                "-f",
+                "gfm",
+                "-t",
+                "html5",
+                css_opt,
+                html_opt,
+                resource_opt,
+                "--pdf-engine=weasyprint",
+                "-s",
+                "-o",
+                str(output_path),
+            ]
+            await self._run_pandoc_async(command, source, lines)
+        logger.info("Successfully converted '%s' to '%s'.", source, output_pdf_file)
+
+    async def to_html(
+        self,
+        lines: Iterable[str],
+        source: str,
+        css_file: Optional[str] = None,
+        html_template_file: Optional[str] = None,
+        id_prefix: Optional[str] = None,
+    ) -> str:
+        """
+        Converts in-memory markdown to HTML, streaming it to pandoc's stdin.
+
+        Args:
+            lines (Iterable[str]): The markdown lines.
+            source (str): what the lines are, for the log and errors
+            css_file (str): The path to the CSS file to link. Only used with a template, and only
+                with the pandoc engine (the weasyprint engine applies it when rendering).
+            html_template_file (str): The path to the pandoc HTML template. If given, the result
+                is a standalone document; otherwise it is an HTML fragment.
+            id_prefix (str): a prefix for all the ids (headings, footnotes) and internal links
+                pandoc generates, e.g. to convert parts of a document separately
+
+        Returns:
+            the HTML
+
+        Raises:
+            TimeoutError if pandoc takes longer than the timeout, CalledProcessError if it fails
+        """
+        command = ["pandoc", "-f", "gfm", "-t", "html5", f"--resource-path={self.fmgr.directory}"]
+        if html_template_file is not None:
+            command += [f"--template={html_template_file}", "-s"]
+            if css_file is not None and self.engine == "pandoc":
+                command.append(f"--css={css_file}")
+        if id_prefix:
+            command.append(f"--id-prefix={id_prefix}")
+        return await self._run_pandoc_async(command, source, lines)
+
+    async def html_to_pdf(self, html: str, output_pdf_file: str, css_file: str):
+        """
+        Renders a standalone HTML document (see to_html) to a PDF. The pandoc engine runs the
+        weasyprint executable, as pandoc would; the weasyprint engine renders in-process.
+
+        Args:
+            html (str): the HTML document
+            output_pdf_file (str): The name of the output PDF file.
+            css_file (str): The path to the CSS file. With the pandoc engine, the document
+                links it already.
+
+        Raises:
+            TimeoutError if weasyprint takes longer than the timeout, CalledProcessError if it fails
+        """
+        output_path = self.fmgr.directory / output_pdf_file
+        with profiler.stage("pdf"):
+            if self.engine == "weasyprint":
+                await asyncio.to_thread(
+                    htmlrender.render_pdf,
+                    html,
+                    output_path,
+                    [css_file],
+                    base_url=str(self.fmgr.directory),
+                )
+            else:
+                command = ["weasyprint", "-u", str(self.fmgr.directory), "-", str(output_path)]
+                await self._run_pandoc_async(command, output_pdf_file, [html])
+        logger.info("Successfully rendered HTML to '%s'.", output_pdf_file)
+
+    async def convert(
+        self,
+        lines: Iterable[str],
+        output_pdf_file: str,
+        css_file: str,
+        html_template_file: str,
+    ):
+        """
+        Converts in-memory markdown to a PDF, streaming it to pandoc's stdin.
+
+        Args:
+            lines (Iterable[str]): The markdown lines (a list or any iterator of lines).
+            output_pdf_file (str): The name of the output PDF file.
+            css_file (str): The path to the CSS file to use for styling.
+            html_template_file (str): The path to the pandoc HTML template.
+
+        Raises:
+            TimeoutError if pandoc takes longer than the timeout, CalledProcessError if it fails
+        """
+        with profiler.stage("pdf"):
+            await self._convert(
+                [], "<stdin>", lines, output_pdf_file, css_file, html_template_file
+            )
+
+    async def convert_file(
         self,
         input_md_file: str,
         output_pdf_file: str,
@@ -44,40 +342,57 @@ class PdfBuilder:
             input_md_file (str): The name of the input markdown file.
             output_pdf_file (str): The name of the output PDF file.
             css_file (str): The path to the CSS file to use for styling.
+            html_template_file (str): The path to the pandoc HTML template.
+
+        Raises:
+            TimeoutError if pandoc takes longer than the timeout, CalledProcessError if it fails
         """
         input_path = self.fmgr.directory / input_md_file
-        output_path = self.fmgr.directory / output_pdf_file
-        css_opt = f"--css={css_file}"
-        html_opt = f"--template={html_template_file}"
-
-        command = [
-            "pandoc",
-            str(input_path),
-            "-f",
-            "gfm",
-            "-t",
-            "html5",
-            css_opt,
-            html_opt,
-            "--pdf-engine=weasyprint",
-            "-s",
-            "-o",
-            str(output_path),
-        ]
-
-        logger.info(f"Executing pandoc command: {' '.join(command)}")
-        try:
-            subprocess.run(command, check=True, capture_output=True, text=True)
-            logger.info(
-                f"Successfully converted '{input_md_file}' to '{output_pdf_file}'."
+        with profiler.stage("pdf"):
+            await self._convert(
+                [str(input_path)],
+                input_md_file,
+                None,
+                output_pdf_file,
+                css_file,
+                html_template_file,
             )
-        except subprocess.CalledProcessError as e:
-            logger.error(f"Pandoc conversion failed for '{input_md_file}':")
-            logger.error(f"Stdout: {e.stdout}")
-            logger.error(f"Stderr: {e.stderr}")
-            raise
-        except FileNotFoundError:
-            logger.error(
-                "Pandoc or weasyprint not found. Please ensure they are installed and in your PATH."
-            )
-            raise
+
+    def convert_to_pdf(
+        self,
+        input_md_file: str,
+        output_pdf_file: str,
+        css_file: str,
+        html_template_file: str,
+    ):
+        """
+        Converts a markdown file to a PDF using pandoc (synchronous wrapper of convert_file).
+
+        Args:
+            input_md_file (str): The name of the input markdown file.
+            output_pdf_file (str): The name of the output PDF file.
+            css_file (str): The path to the CSS file to use for styling.
+            html_template_file (str): The path to the pandoc HTML template.
+        """
+        asyncio.run(
+            self.convert_file(input_md_file, output_pdf_file, css_file, html_template_file)
+        )
+
+    def convert_lines_to_pdf(
+        self,
+        lines: Iterable[str],
+        output_pdf_file: str,
+        css_file: str,
+        html_template_file: str,
+    ):
+        """
+        Converts in-memory markdown to a PDF, streaming it to pandoc's stdin. No intermediate
+        file is written (synchronous wrapper of convert).
+
+        Args:
+            lines (Iterable[str]): The markdown lines (a list or any iterator of lines).
+            output_pdf_file (str): The name of the output PDF file.
+            css_file (str): The path to the CSS file to use for styling.
+            html_template_file (str): The path to the pandoc HTML template.
+        """
+        asyncio.run(self.convert(lines, output_pdf_file, css_file, html_template_file))
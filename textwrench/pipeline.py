@@ -0,0 +1,111 @@
+"""
+Filename: pipeline.py
+
+Author: mg4news
+
+Date: 2025-10-14
+
+License: Unlicense
+
+Description:
+    Streaming document pipeline, for documents too large to hold in memory. A pipeline is a source
+    of lines followed by stages. Every stage takes an iterator of lines and yields lines
+    (mdbuilder.iter_assemble, tocbuilder.iter_toc, imgfix.iter_images, or any generator function),
+    so a document flows through the pipeline one line at a time. The sinks consume the lines:
+    write_to() streams them to a file and tee() writes them while passing them on. A pipeline can
+    be given to PdfBuilder.convert() (or convert_lines_to_pdf) as is, which streams it to pandoc.
+    A pipeline can be iterated more than once; each iteration reads its source again.
+"""
+
+import functools
+import logging
+from typing import Callable, Iterable, Iterator, List
+from textwrench.pathmgr import PathMgr
+from textwrench import profiler
+
+logger = logging.getLogger(__name__)
+
+
+class Pipeline:
+
+    def __init__(self, source: Callable[[], Iterable[str]], stages: Iterable[Callable] = ()) -> None:
+        """
+        Initialize a pipeline.
+
+        Args:
+            source (Callable): returns a new iterator of the input lines, for every iteration
+            stages (Iterable[Callable]): the stages, in order. Each takes an iterator of lines
+                and returns an iterator of lines.
+        """
+        self.source = source
+        self.stages: List[Callable[[Iterable[str]], Iterable[str]]] = list(stages)
+
+    @classmethod
+    def from_file(cls, fmgr: PathMgr, filename: str) -> "Pipeline":
+        """
+        Returns a pipeline that reads a text file, streaming it (see PathMgr.iter_lines).
+
+        Args:
+            fmgr (PathMgr): the PathMgr of the file's directory
+            filename (str): the name of the file
+        """
+        return cls(functools.partial(fmgr.iter_lines, filename))
+
+    def then(self, stage: Callable[..., Iterable[str]], *args, **kwargs) -> "Pipeline":
+        """
+        Returns a new pipeline, with a stage added at the end. The pipeline itself is not changed.
+
+        Args:
+            stage (Callable): called with the iterator of lines, followed by args and kwargs
+            args, kwargs: the other arguments of the stage
+
+        Returns:
+            the new pipeline
+        """
+        return Pipeline(self.source, [*self.stages, lambda lines: stage(lines, *args, **kwargs)])
+
+    def __iter__(self) -> Iterator[str]:
+        lines = self.source()
+        for stage in self.stages:
+            lines = stage(lines)
+        return iter(lines)
+
+
+def tee(lines: Iterable[str], fmgr: PathMgr, filename: str) -> Iterator[str]:
+    """
+    A stage that writes the lines to a file while passing them on, e.g. to keep the work file of a
+    document streamed to pandoc. The file is replaced atomically once the lines are exhausted (see
+    PathMgr.open_atomic); if they are not, the original file is kept.
+
+    Args:
+        lines (Iterable[str]): the lines
+        fmgr (PathMgr): the PathMgr of the file's directory
+        filename (str): the name of the file
+
+    Yields:
+        the same lines
+    """
+    with fmgr.open_atomic(filename) as f:
+        for line in lines:
+            f.write(line)
+            yield line
+
+
+def write_to(lines: Iterable[str], fmgr: PathMgr, filename: str) -> int:
+    """
+    Streams lines to a file, replacing it atomically (see PathMgr.open_atomic).
+
+    Args:
+        lines (Iterable[str]): the lines, e.g. a pipeline
+        fmgr (PathMgr): the PathMgr of the file's directory
+        filename (str): the name of the file
+
+    Returns:
+        the number of lines written
+    """
+    count = 0
+    with profiler.stage("write_stream"), fmgr.open_atomic(filename) as f:
+        for count, line in enumerate(lines, 1):
+            f.write(line)
+    logger.info("Streamed %s lines to %s", count, filename)
+    return count
@@ -0,0 +1,204 @@
+"""
+Filename: profiler.py
+
+Author: mg4news
+
+Date: 2025-09-17
+
+License: Unlicense
+
+Description:
+    Instrumentation for the textwrench pipeline. Records wall and CPU time per stage, event counters
+    (bytes read and written, stat and open calls, documents, headings, images), subprocess durations
+    and peak memory (tracemalloc), and writes them as a machine readable JSON report. When no profiler
+    is active, the module level stage() and count() helpers do (almost) nothing.
+"""
+
+import functools
+import json
+import logging
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+_REPORT_VERSION = 1
+
+
+class Profiler:
+
+    def __init__(self, trace_memory: bool = True) -> None:
+        """
+        Initialize a profiler.
+
+        Args:
+            trace_memory (bool): track peak Python memory with tracemalloc (adds some overhead)
+        """
+        self.trace_memory = trace_memory
+        self.stages: Dict[str, Dict[str, float]] = {}
+        self.counters: Dict[str, int] = {}
+        self.subprocesses: List[Dict[str, object]] = []
+        # Kept when the profiler is stopped, as stopping also stops tracemalloc
+        self.peak_memory: Optional[int] = None
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """
+        Times a stage. Nested and repeated stages are recorded separately, per name.
+
+        Args:
+            name (str): the stage name, e.g. "assemble"
+        """
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            entry = self.stages.setdefault(name, {"calls": 0, "wall": 0.0, "cpu": 0.0})
+            entry["calls"] += 1
+            entry["wall"] += time.perf_counter() - wall
+            entry["cpu"] += time.process_time() - cpu
+
+    def count(self, name: str, n: int = 1):
+        """
+        Adds to an event counter.
+
+        Args:
+            name (str): the counter name, e.g. "pathmgr.open"
+            n (int): the amount to add
+        """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record_subprocess(self, command: str, duration: float, returncode: Optional[int]):
+        """
+        Records a subprocess run.
+
+        Args:
+            command (str): the executable
+            duration (float): the wall time, in seconds
+            returncode (int): the exit status, None if it did not finish
+        """
+        self.subprocesses.append(
+            {"command": command, "duration": duration, "returncode": returncode}
+        )
+
+    def report(self) -> dict:
+        """
+        Returns the collected measurements as a JSON compatible dictionary.
+        """
+        report = {
+            "version": _REPORT_VERSION,
+            "wall": time.perf_counter() - self._wall,
+            "cpu": time.process_time() - self._cpu,
+            "stages": self.stages,
+            "counters": dict(sorted(self.counters.items())),
+            "subprocesses": self.subprocesses,
+            "peak_memory": self.peak_memory,
+        }
+        if self.trace_memory and tracemalloc.is_tracing():
+            report["peak_memory"] = tracemalloc.get_traced_memory()[1]
+        return report
+
+    def write(self, filename: str):
+        """
+        Writes the report as JSON.
+
+        Args:
+            filename (str): the report file
+        """
+        with open(filename, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        logger.info("Wrote profile report: %s", filename)
+
+
+_active: Optional[Profiler] = None
+
+
+def start(trace_memory: bool = True) -> Profiler:
+    """
+    Starts collecting measurements for the whole package.
+
+    Args:
+        trace_memory (bool): track peak Python memory with tracemalloc
+
+    Returns:
+        the active profiler
+    """
+    global _active
+    _active = Profiler(trace_memory)
+    return _active
+
+
+def stop() -> Optional[Profiler]:
+    """
+    Stops collecting measurements.
+
+    Returns:
+        the profiler that was active, if any
+    """
+    global _active
+    profiler, _active = _active, None
+    if profiler and profiler.trace_memory and tracemalloc.is_tracing():
+        profiler.peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return profiler
+
+
+_NO_STAGE = nullcontext()
+
+
+def stage(name: str):
+    """
+    Times a stage on the active profiler, if there is one.
+
+    Args:
+        name (str): the stage name
+    """
+    return _active.stage(name) if _active is not None else _NO_STAGE
+
+
+def timed(name: str) -> Callable:
+    """
+    Decorator that times every call of a function as a stage on the active profiler.
+
+    Args:
+        name (str): the stage name
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+            with _active.stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name: str, n: int = 1):
+    """
+    Adds to an event counter on the active profiler, if there is one.
+
+    Args:
+        name (str): the counter name
+        n (int): the amount to add
+    """
+    if _active is not None:
+        _active.count(name, n)
+
+
+def record_subprocess(command: str, duration: float, returncode: Optional[int]):
+    """
+    Records a subprocess run on the active profiler, if there is one.
+    """
+    if _active is not None:
+        _active.record_subprocess(command, duration, returncode)
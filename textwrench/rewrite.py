@@ -0,0 +1,280 @@
+"""
+Filename: rewrite.py
+
+Author: mg4news
+
+Date: 2025-10-06
+
+License: Unlicense
+
+Description:
+    Bulk rewrite engine. Applies a set of rules (regular expression replacements, or line
+    transform functions) to many markdown files at once, on a pool of worker processes. Rules only
+    touch markdown content: lines in code fences, HTML comments and the YAML front matter, and
+    inline code spans, are left alone (unless a rule's scope is "all"). A dry run produces unified
+    diffs instead of writing; otherwise only the files whose content changed are written, each one
+    atomically (written to a temporary file, then renamed over the original).
+    Rules files are JSON: a list of {"pattern": ..., "replace": ..., "ignore_case": false,
+    "scope": "content" or "all"}. The replacement uses the `re.sub` syntax (\\1, \\g<name>).
+"""
+
+import difflib
+import json
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, List, Sequence, Tuple
+from textwrench.document import Document, CODE, COMMENT, YAML
+from textwrench.models import RewriteResult, RewriteRule
+from textwrench.pathmgr import file_lock, write_atomic
+from textwrench import profiler
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ("content", "all")
+_NOT_CONTENT = CODE | COMMENT | YAML
+_CODE_SPAN_RE = re.compile(r"(`+).*?\1")
+
+# A compiled rule: a line transform, and whether it applies to every line
+_Compiled = Tuple[Callable[[str], Tuple[str, int]], bool]
+
+# The compiled rules of a worker process, set once by the pool initializer
+_worker_rules: List[_Compiled] = []
+
+
+def load_rules(rules_file: str | Path) -> List[RewriteRule]:
+    """
+    Loads and validates a JSON rules file.
+
+    Args:
+        rules_file (str or Path object): the rules file
+
+    Returns:
+        the rules
+
+    Raises:
+        a value error if the file is not a list of valid rules
+    """
+    with open(rules_file, "r") as f:
+        rules = json.load(f)
+    if not isinstance(rules, list):
+        msg = f"Rules file {rules_file} must contain a list of rules"
+        logger.error(msg)
+        raise ValueError(msg)
+    for n, rule in enumerate(rules, 1):
+        if not isinstance(rule, dict) or not {"pattern", "replace"} <= rule.keys():
+            msg = f"Rule {n} in {rules_file} needs a 'pattern' and a 'replace'"
+            logger.error(msg)
+            raise ValueError(msg)
+    compile_rules(rules)
+    return rules
+
+
+def _regex(rule: RewriteRule) -> Callable[[str], Tuple[str, int]]:
+    replace = rule["replace"]
+    try:
+        pattern = re.compile(rule["pattern"], re.IGNORECASE if rule.get("ignore_case") else 0)
+    except re.error as e:
+        msg = f"Invalid rule pattern '{rule['pattern']}': {e}"
+        logger.error(msg)
+        raise ValueError(msg) from e
+    try:
+        # The replacement template is parsed on first use; parse it now (an unknown group name
+        # is an IndexError, not a re.error)
+        pattern.subn(replace, "")
+    except (re.error, IndexError) as e:
+        msg = f"Invalid rule replacement '{replace}': {e}"
+        logger.error(msg)
+        raise ValueError(msg) from e
+    return lambda text: pattern.subn(replace, text)
+
+
+def _function(transform: Callable[[str], str]) -> Callable[[str], Tuple[str, int]]:
+    def apply(text: str) -> Tuple[str, int]:
+        new = transform(text)
+        return new, int(new != text)
+
+    return apply
+
+
+def compile_rules(rules: Iterable[RewriteRule | Callable[[str], str]]) -> List[_Compiled]:
+    """
+    Compiles rules. A rule is a RewriteRule, or a function that takes the text of a line
+    (without its line ending) and returns the new text. Functions apply to content only.
+
+    Args:
+        rules (Iterable): the rules, applied in order
+
+    Returns:
+        the compiled rules
+
+    Raises:
+        a value error if a pattern, replacement or scope is invalid
+    """
+    compiled = []
+    for rule in rules:
+        if callable(rule):
+            compiled.append((_function(rule), False))
+            continue
+        scope = rule.get("scope", "content")
+        if scope not in SCOPES:
+            msg = f"Unknown rule scope '{scope}', expected one of {SCOPES}"
+            logger.error(msg)
+            raise ValueError(msg)
+        compiled.append((_regex(rule), scope == "all"))
+    return compiled
+
+
+def _outside_code_spans(transform: Callable[[str], Tuple[str, int]], text: str):
+    if "`" not in text:
+        return transform(text)
+    parts = []
+    count = 0
+    pos = 0
+    for span in _CODE_SPAN_RE.finditer(text):
+        new, n = transform(text[pos : span.start()])
+        parts += [new, span.group(0)]
+        count += n
+        pos = span.end()
+    new, n = transform(text[pos:])
+    parts.append(new)
+    return "".join(parts), count + n
+
+
+def rewrite_lines(lines: List[str], rules: Sequence[_Compiled]) -> Tuple[List[str], int]:
+    """
+    Applies compiled rules to the lines of a document. Line endings are kept as they are.
+
+    Args:
+        lines (List[str]): the lines, with their line endings
+        rules (Sequence): the compiled rules (see compile_rules)
+
+    Returns:
+        the new lines, and the number of replacements made
+    """
+    doc = Document(lines)
+    out = []
+    total = 0
+    for i, line in enumerate(lines):
+        body = line.rstrip("\r\n")
+        ending = line[len(body) :]
+        content = not doc.kind(i) & _NOT_CONTENT
+        for transform, everywhere in rules:
+            if everywhere:
+                body, n = transform(body)
+            elif content:
+                body, n = _outside_code_spans(transform, body)
+            else:
+                continue
+            total += n
+        out.append(body + ending)
+    return out, total
+
+
+def _stamp(path: str | Path) -> Tuple[int, int]:
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def rewrite_file(
+    path: str | Path, rules: Sequence[_Compiled], dry_run: bool = False
+) -> RewriteResult:
+    """
+    Applies compiled rules to one file. The file is only written if its content changed.
+
+    Args:
+        path (str or Path object): the markdown file
+        rules (Sequence): the compiled rules (see compile_rules)
+        dry_run (bool): do not write, return a unified diff of the changes instead
+
+    Returns:
+        the result. Errors (unreadable files, failing replacements) are reported in the result,
+        not raised.
+    """
+    result = RewriteResult(path=str(path), changed=False, replacements=0, diff=None, error=None)
+    try:
+        # The lock keeps builds and other rewrites out from the read to the write; an editor that
+        # does not lock is caught by the stamp check, and its edit is kept
+        with file_lock(path):
+            stamp = _stamp(path)
+            # newline="" keeps the line endings, so a rewrite does not convert them
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                lines = f.readlines()
+            new, result["replacements"] = rewrite_lines(lines, rules)
+            result["changed"] = new != lines
+            if result["changed"]:
+                if dry_run:
+                    result["diff"] = "".join(
+                        difflib.unified_diff(lines, new, f"a/{path}", f"b/{path}")
+                    )
+                elif _stamp(path) != stamp:
+                    result["error"] = "Conflict: the file changed while it was rewritten"
+                else:
+                    write_atomic(path, "".join(new).encode("utf-8"))
+    except (OSError, UnicodeDecodeError, re.error, IndexError) as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+def _init_worker(rules: List[RewriteRule]):
+    global _worker_rules
+    _worker_rules = compile_rules(rules)
+
+
+def _rewrite_in_worker(path: str, dry_run: bool) -> RewriteResult:
+    return rewrite_file(path, _worker_rules, dry_run)
+
+
+@profiler.timed("rewrite")
+def rewrite_files(
+    paths: Sequence[str | Path],
+    rules: List[RewriteRule | Callable[[str], str]],
+    dry_run: bool = False,
+    jobs: int = 0,
+) -> List[RewriteResult]:
+    """
+    Applies rules to many files, on a pool of worker processes.
+
+    Args:
+        paths (Sequence): the markdown files
+        rules (List): the rules (see compile_rules). Function rules must be picklable, i.e.
+            module level functions, when more than one job is used.
+        dry_run (bool): do not write, produce unified diffs instead
+        jobs (int): the number of worker processes, 0 = one per CPU, 1 = in this process
+
+    Returns:
+        the results, in the order of the paths
+    """
+    workers = min(len(paths), jobs or os.cpu_count() or 1)
+    if workers <= 1:
+        compiled = compile_rules(rules)
+        results = [rewrite_file(p, compiled, dry_run) for p in paths]
+    else:
+        # Validate the rules here, so a bad pattern fails once instead of in every worker
+        compile_rules(rules)
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(rules,)) as pool:
+            chunksize = max(1, len(paths) // (workers * 8))
+            results = list(
+                pool.map(
+                    _rewrite_in_worker,
+                    [str(p) for p in paths],
+                    [dry_run] * len(paths),
+                    chunksize=chunksize,
+                )
+            )
+    changed = sum(r["changed"] for r in results)
+    profiler.count("rewrite.files", len(results))
+    profiler.count("rewrite.changed", changed)
+    logger.info(
+        "Rewrite %s: %s files, %s changed, %s replacements",
+        "dry run" if dry_run else "done",
+        len(results),
+        changed,
+        sum(r["replacements"] for r in results),
+    )
+    for r in results:
+        if r["error"]:
+            logger.error("Could not rewrite %s: %s", r["path"], r["error"])
+    return results
@@ -0,0 +1,253 @@
+"""
+Filename: server.py
+
+Author: mg4news
+
+Date: 2025-10-02
+
+License: Unlicense
+
+Description:
+    Render server. A long lived process that listens on a unix socket and builds documents on a pool
+    of worker threads, keeping its warm state between builds: imported modules, parsed stylesheets
+    and fonts, the file content cache and the tool versions. The CLI forwards its arguments (and
+    working directory) to a running server, and builds in-process if there is none.
+    The protocol is one JSON request and one JSON response per connection, each on a single line:
+    {"op": "build", "argv": [...], "cwd": "..."}, {"op": "status"} or {"op": "shutdown"}.
+"""
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+from textwrench.cachedir import cache_dir
+
+logger = logging.getLogger(__name__)
+
+
+def default_socket() -> str:
+    """
+    Returns the default server socket path, in the textwrench cache directory.
+    """
+    return str(cache_dir("server") / "render.sock")
+
+
+def request(message: dict, socket_path: Optional[str] = None) -> Optional[dict]:
+    """
+    Sends a request to the render server and waits for the response.
+
+    Args:
+        message (dict): the request
+        socket_path (str): the server socket. Defaults to default_socket().
+
+    Returns:
+        the response, or None if no server is running
+    """
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    path = socket_path or default_socket()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+        sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError(f"The render server at {path} closed the connection")
+    return json.loads(line)
+
+
+def forward(argv: List[str], cwd: str, socket_path: Optional[str] = None) -> Optional[dict]:
+    """
+    Asks the render server to build a document.
+
+    Args:
+        argv (List[str]): the command line arguments, as given to textwrench
+        cwd (str): the working directory the arguments are relative to
+        socket_path (str): the server socket. Defaults to default_socket().
+
+    Returns:
+        the build result ({"ok": bool, "error": str or None, "duration": float}), or None if
+        no server is running
+    """
+    return request({"op": "build", "argv": argv, "cwd": cwd}, socket_path)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            message = json.loads(self.rfile.readline())
+            response = self.server.owner.dispatch(message)
+        except Exception as e:
+            response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class RenderServer:
+
+    def __init__(
+        self,
+        parse: Callable[[List[str]], object],
+        build: Callable,
+        socket_path: Optional[str] = None,
+        workers: int = 0,
+        stats: Optional[Callable[[], Dict[str, object]]] = None,
+    ) -> None:
+        """
+        Initialize a render server.
+
+        Args:
+            parse (Callable): turns the forwarded command line arguments into build arguments
+            build (Callable): the pipeline, called with the build arguments. The arguments get a
+                `cwd` attribute: the client's working directory.
+            socket_path (str): the socket to listen on. Defaults to default_socket().
+            workers (int): the number of documents built at once, 0 = one per CPU
+            stats (Callable): returns extra statistics (e.g. caches) for status requests
+        """
+        self.parse = parse
+        self.build = build
+        self.socket_path = socket_path or default_socket()
+        self.workers = workers or os.cpu_count() or 1
+        self.stats = stats
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        # Builds of the same document write the same files, so they run one at a time
+        self._doc_locks: Dict[str, threading.Lock] = {}
+        self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix="textwrench-build")
+        self._server: Optional[_UnixServer] = None
+
+    def _bind(self) -> _UnixServer:
+        path = Path(self.socket_path)
+        if path.exists():
+            if request({"op": "status"}, self.socket_path) is not None:
+                msg = f"A render server is already running at {self.socket_path}"
+                logger.error(msg)
+                raise RuntimeError(msg)
+            # Left over from a server that did not shut down cleanly
+            path.unlink()
+        server = _UnixServer(self.socket_path, _Handler)
+        server.owner = self
+        return server
+
+    def serve_forever(self):
+        """
+        Listens for requests until a shutdown request (or KeyboardInterrupt).
+        """
+        self._server = self._bind()
+        logger.info("Render server listening on %s, %s workers", self.socket_path, self.workers)
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            self._pool.shutdown(wait=True)
+            Path(self.socket_path).unlink(missing_ok=True)
+            logger.info("Render server stopped.")
+
+    def shutdown(self):
+        """
+        Stops serve_forever (from another thread). Running builds are completed first.
+        """
+        if self._server is not None:
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+
+    def dispatch(self, message: dict) -> dict:
+        """
+        Handles one request.
+
+        Args:
+            message (dict): the request
+
+        Returns:
+            the response
+        """
+        op = message.get("op")
+        if op == "build":
+            return self.submit(message["argv"], message["cwd"])
+        if op == "status":
+            return self.status()
+        if op == "shutdown":
+            self.shutdown()
+            return {"ok": True}
+        return {"ok": False, "error": f"Unknown request: {op}"}
+
+    def submit(self, argv: List[str], cwd: str) -> dict:
+        """
+        Queues a build on the worker pool, and waits for it to finish.
+
+        Args:
+            argv (List[str]): the command line arguments
+            cwd (str): the working directory the arguments are relative to
+
+        Returns:
+            {"ok": bool, "error": str or None, "duration": float}
+        """
+        try:
+            args = self.parse(argv)
+        except SystemExit:
+            return {"ok": False, "error": f"Invalid arguments: {' '.join(argv)}", "duration": 0.0}
+        args.cwd = cwd
+        with self._lock:
+            self.queued += 1
+        start = time.perf_counter()
+        error = None
+        try:
+            self._pool.submit(self._run, args).result()
+        except BaseException as e:
+            error = f"{type(e).__name__}: {e}"
+            logger.error("Build failed: %s: %s", " ".join(argv), error)
+        with self._lock:
+            if error:
+                self.failed += 1
+            else:
+                self.completed += 1
+        return {"ok": error is None, "error": error, "duration": time.perf_counter() - start}
+
+    def _run(self, args):
+        key = str(Path(args.cwd, getattr(args, "inp", None) or "").resolve())
+        with self._lock:
+            self.queued -= 1
+            self.in_flight += 1
+            doc_lock = self._doc_locks.setdefault(key, threading.Lock())
+        try:
+            with doc_lock:
+                return self.build(args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def status(self) -> dict:
+        """
+        Returns the server statistics: queue depth, builds in flight, completed and failed
+        builds, and any extra statistics.
+        """
+        with self._lock:
+            status = {
+                "ok": True,
+                "pid": os.getpid(),
+                "uptime": time.monotonic() - self._started,
+                "workers": self.workers,
+                "queued": self.queued,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+        if self.stats:
+            status.update(self.stats())
+        return status
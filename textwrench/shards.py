@@ -0,0 +1,258 @@
+"""
+Filename: shards.py
+
+Author: mg4news
+
+Date: 2025-09-29
+
+License: Unlicense
+
+Description:
+    Sharded PDF rendering. weasyprint lays out a document on a single core, so a long document is
+    split at its top level chapter boundaries (the documents linked from the root document), the
+    shards are rendered in parallel, and the shard PDFs are merged into one, keeping the bookmark
+    outline of every shard.
+    TOC links cannot point at anchors in another shard, so in a sharded render every TOC heading gets
+    an explicit anchor, and the TOC links use the textwrench-anchor: URI scheme. The merge turns those
+    links into GoTo actions on the pages where the anchors ended up. pypdf is an optional
+    dependency; it is only imported when a sharded render is merged.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+from urllib.parse import unquote
+from textwrench.document import Document
+from textwrench.pathmgr import PathMgr
+from textwrench.pdfbuilder import PdfBuilder
+from textwrench.tocbuilder import apply_toc, build_heading_map, find_toc_marker, toc_slugs
+from textwrench import profiler
+
+logger = logging.getLogger(__name__)
+
+ANCHOR_SCHEME = "textwrench-anchor:"
+_ANCHOR_PREFIX = "tw-"
+_HEADING_RE = re.compile(r"^(\s{0,3}#{1,6}\s+)(.*)$", re.DOTALL)
+
+
+def _pypdf():
+    try:
+        import pypdf
+    except ImportError:
+        logger.error("The pypdf package is not installed. Install it to use sharded rendering.")
+        raise
+    return pypdf
+
+
+def plan_shards(boundaries: Sequence[int], total: int, shards: int) -> List[Tuple[int, int]]:
+    """
+    Groups the chapters of a document into at most `shards` contiguous line ranges of roughly
+    equal size. Everything before the first chapter (title page, TOC) goes into the first shard.
+
+    Args:
+        boundaries (Sequence[int]): the line numbers where chapters start
+        total (int): the number of lines in the document
+        shards (int): the maximum number of shards
+
+    Returns:
+        a list of (start, end) line ranges, covering the whole document
+    """
+    cuts = sorted({b for b in boundaries if 0 < b < total})
+    if shards < 2 or not cuts:
+        return [(0, total)]
+    target = total / shards
+    ranges = []
+    start = 0
+    for cut in cuts:
+        if cut - start >= target and len(ranges) < shards - 1:
+            ranges.append((start, cut))
+            start = cut
+    ranges.append((start, total))
+    return ranges
+
+
+def prepare_shards(doc: Document, boundaries: List[int]) -> List[int]:
+    """
+    Builds the TOC of a document for a sharded render: every TOC heading gets an explicit anchor,
+    and the TOC links point at them with the textwrench-anchor: URI scheme. The document is edited
+    in place.
+
+    Args:
+        doc (Document): the document
+        boundaries (List[int]): the chapter boundaries (line numbers)
+
+    Returns:
+        the chapter boundaries, adjusted for the lines added by the TOC
+    """
+    toc = find_toc_marker(doc)
+    if not toc:
+        logger.warning("No TOC marker found, nothing to link across shards.")
+        return boundaries
+    slugs = toc_slugs(doc, toc, build_heading_map(doc, toc))
+    before = len(doc)
+    apply_toc(doc, link_prefix=ANCHOR_SCHEME + _ANCHOR_PREFIX)
+    # All the TOC headings follow the marker, so they all moved by the same amount
+    delta = len(doc) - before
+    for line, slug in slugs.items():
+        match = _HEADING_RE.match(doc.lines[line + delta])
+        if match:
+            anchor = f'<a id="{_ANCHOR_PREFIX}{slug}"></a>'
+            doc.set_line(line + delta, f"{match.group(1)}{anchor}{match.group(2)}")
+    return [b + delta if b > toc["start_line"] else b for b in boundaries]
+
+
+def _render_shard(
+    directory: str,
+    engine: str,
+    timeout: Optional[float],
+    lines: List[str],
+    output: str,
+    css_file: str,
+    template: str,
+) -> str:
+    PdfBuilder(PathMgr(directory), engine=engine, timeout=timeout).convert_lines_to_pdf(
+        lines, output, css_file, template
+    )
+    return output
+
+
+def _number(value):
+    from pypdf.generic import FloatObject, NullObject
+
+    return NullObject() if value is None or isinstance(value, NullObject) else FloatObject(value)
+
+
+@profiler.timed("merge")
+def merge_pdfs(parts: Sequence[str], output: str | Path) -> int:
+    """
+    Merges PDFs into one, keeping their outlines, and resolves textwrench-anchor: links against
+    the named destinations of all the parts.
+
+    Args:
+        parts (Sequence[str]): the PDFs to merge, in order
+        output (str or Path object): the merged PDF
+
+    Returns:
+        the number of links resolved across parts
+    """
+    pypdf = _pypdf()
+    from pypdf.generic import ArrayObject, DictionaryObject, NameObject, NumberObject
+
+    writer = pypdf.PdfWriter()
+    dests = {}
+    for part in parts:
+        reader = pypdf.PdfReader(part)
+        offset = len(writer.pages)
+        for name, dest in reader.named_destinations.items():
+            page = reader.get_destination_page_number(dest)
+            if page is not None and page >= 0:
+                dests[name] = (offset + page, dest.left, dest.top)
+        writer.append(reader, import_outline=True)
+
+    resolved = 0
+    for page in writer.pages:
+        for annot in page.get("/Annots") or []:
+            annot = annot.get_object()
+            action = annot.get("/A")
+            uri = action.get_object().get("/URI") if action is not None else None
+            if not isinstance(uri, str) or not uri.startswith(ANCHOR_SCHEME):
+                continue
+            target = dests.get(unquote(uri[len(ANCHOR_SCHEME) :]))
+            if target is None:
+                logger.warning("Link target not found in any shard: %s", uri)
+                continue
+            number, left, top = target
+            annot[NameObject("/A")] = DictionaryObject(
+                {
+                    NameObject("/S"): NameObject("/GoTo"),
+                    NameObject("/D"): ArrayObject(
+                        [
+                            writer.pages[number].indirect_reference,
+                            NameObject("/XYZ"),
+                            _number(left),
+                            _number(top),
+                            NumberObject(0),
+                        ]
+                    ),
+                }
+            )
+            resolved += 1
+
+    with open(output, "wb") as f:
+        writer.write(f)
+    logger.info("Merged %s PDFs into %s, %s links resolved.", len(parts), output, resolved)
+    return resolved
+
+
+@profiler.timed("shards")
+def render_sharded(
+    fmgr: PathMgr,
+    engine: str,
+    lines: List[str],
+    ranges: Sequence[Tuple[int, int]],
+    output_pdf_file: str,
+    css_file: str,
+    html_template_file: str,
+    jobs: int = 0,
+    timeout: Optional[float] = None,
+):
+    """
+    Renders the shards of a document in parallel, and merges them into one PDF.
+
+    Args:
+        fmgr (PathMgr): the document's PathMgr; the PDF is written to its directory
+        engine (str): the PdfBuilder engine
+        lines (List[str]): the final markdown lines
+        ranges (Sequence[Tuple[int, int]]): the shards, as line ranges (see plan_shards)
+        output_pdf_file (str): The name of the output PDF file.
+        css_file (str): The path to the CSS file to use for styling.
+        html_template_file (str): The path to the pandoc HTML template.
+        jobs (int): the maximum number of shards rendered at once, 0 = one per CPU
+        timeout (float): the maximum time, in seconds, for each shard's pandoc run
+    """
+    workers = min(len(ranges), jobs or os.cpu_count() or 1)
+    profiler.count("shards.rendered", len(ranges))
+    with tempfile.TemporaryDirectory(prefix="textwrench-shards-") as tmp:
+        parts = [str(Path(tmp) / f"shard-{i:03d}.pdf") for i in range(len(ranges))]
+        shards = [(lines[start:end], part) for (start, end), part in zip(ranges, parts)]
+        if engine == "weasyprint":
+            # The in-process renderer holds the GIL, so each shard needs its own process
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context("fork" if "fork" in methods else "spawn")
+            with ProcessPoolExecutor(workers, mp_context=ctx) as pool:
+                futures = [
+                    pool.submit(
+                        _render_shard,
+                        str(fmgr.directory),
+                        engine,
+                        timeout,
+                        shard,
+                        part,
+                        css_file,
+                        html_template_file,
+                    )
+                    for shard, part in shards
+                ]
+                for future in futures:
+                    future.result()
+        else:
+            # pandoc (and the weasyprint it runs) are separate processes already. If one shard
+            # fails, the task group cancels (and so kills) the others.
+            builder = PdfBuilder(fmgr, engine, timeout=timeout, max_concurrency=workers)
+
+            async def render_all():
+                async with asyncio.TaskGroup() as group:
+                    for shard, part in shards:
+                        group.create_task(
+                            builder.convert(shard, part, css_file, html_template_file)
+                        )
+
+            asyncio.run(render_all())
+        merge_pdfs(parts, fmgr.directory / output_pdf_file)
+    logger.info("Rendered %s shards into '%s'.", len(ranges), output_pdf_file)
@@ -10,161 +10,461 @@ License: Unlicense
 Description:
     Walks a markdown file, and looks for a TOC marker (various formats). It builds a table of contents
     at that point. It ignores any headers preceding the TOC marker. The table of contents is
-    built using links so that it remains navigable after the conversion to HTML and PDF. Duplicate links
-    are managed in the same way as github.
+    built using links so that it remains navigable after the conversion to HTML and PDF. Link slugs are
+    computed the way pandoc computes heading ids for GitHub markdown, over all the headings in the
+    document, so that the links match the ids in the HTML. The heading/anchor index can also be used
+    to validate the internal #anchor links of a document. iter_toc() inserts the TOC into a stream
+    of lines, spooling the lines after the marker (to a temporary file once they outgrow a memory
+    budget) until the headings that follow it are known.
 """
 
-from typing import List, Optional
-from textwrench.models import TocMarker
-from textwrench.mdstate import MdState
+import functools
+import tempfile
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import unquote
+from textwrench.models import Anchor, Heading, TocMarker
+from textwrench.document import Document, CODE, COMMENT, HEADING, YAML, classify, parse_heading
+from textwrench import profiler
 import re
 import logging
 
 logger = logging.getLogger(__name__)
 _TOC_DEPTH_RE = re.compile(r"^(min_depth|max_depth):\s*(\d+)$")
+_TOC_TITLE = "Table of Contents"
+_FENCE_LANG_RE = re.compile(r"^```(\w+)?")
+# Memory budget of the iter_toc spool, beyond it the spool moves to a temporary file
+_SPOOL_BYTES = 8 * 1024 * 1024
+
+# Inline markup that pandoc drops when it turns a heading into plain text: code spans (content
+# kept), links and images (text kept), HTML tags, and emphasis/strikeout markers
+_INLINE_RE = re.compile(
+    r"(`+)(.*?)\1|!?\[([^\]]*)\]\([^)]*\)|<[^>]*>|\*+|~~|(?<![^\W_])_+|_+(?![^\W_])"
+)
+_PUNCT_RE = re.compile(r"[^\w\s-]")
+_SPACE_RE = re.compile(r"\s+")
+_ANCHOR_LINK_RE = re.compile(r"\]\(#([^)\s]+)\)|href=[\"']#([^\"']+)[\"']")
+_ID_RE = re.compile(r"\bid=[\"']([^\"']+)[\"']")
+_NOT_CONTENT = CODE | COMMENT | YAML
+
+
+def _inline_text(match: re.Match) -> str:
+    if match.group(1):
+        return match.group(2)
+    if match.group(3) is not None:
+        return _INLINE_RE.sub(_inline_text, match.group(3))
+    return ""
+
+
+@functools.lru_cache(maxsize=8192)
+def slugify(text: str) -> str:
+    """
+    Computes the base slug of a heading the way pandoc does for GitHub markdown: markup removed,
+    lower case, anything but letters, digits, spaces, hyphens and underscores dropped, and every
+    space turned into a hyphen. Memoized.
+
+    Args:
+        text (str): the heading text
+
+    Returns:
+        the slug, before de-duplication (may be empty)
+    """
+    plain = _SPACE_RE.sub(" ", _INLINE_RE.sub(_inline_text, text)).strip().lower()
+    return _PUNCT_RE.sub("", plain).replace(" ", "-")
+
+
+def _unique(base: str, used: set) -> str:
+    # Same rule as pandoc: "section" for an empty slug, then -1, -2, ... until unused
+    base = base or "section"
+    slug, n = base, 0
+    while slug in used:
+        n += 1
+        slug = f"{base}-{n}"
+    used.add(slug)
+    return slug
+
+
+class HeadingIndex:
+
+    def __init__(self, headings: Iterable[Heading], ids: Iterable[str] = ()) -> None:
+        """
+        Initialize a heading/anchor index: the slug (HTML id) of every heading, de-duplicated
+        in document order, plus any explicit ids.
+
+        Args:
+            headings (Iterable[Heading]): all the headings of the document, in document order
+            ids (Iterable[str]): explicit ids in the document, e.g. from `<a id="...">`
+        """
+        used: set = set()
+        self.anchors: List[Anchor] = []
+        self._by_line: Dict[int, Anchor] = {}
+        self._by_slug: Dict[str, Anchor] = {}
+        for h in headings:
+            slug = _unique(slugify(h["text"]), used)
+            anchor = Anchor(line=h["line"], depth=h["depth"], text=h["text"], slug=slug)
+            self.anchors.append(anchor)
+            self._by_line[anchor["line"]] = anchor
+            self._by_slug[anchor["slug"]] = anchor
+        self._ids = set(ids)
+
+    def __len__(self) -> int:
+        return len(self.anchors)
+
+    def __contains__(self, anchor: str) -> bool:
+        anchor = unquote(anchor[1:] if anchor.startswith("#") else anchor)
+        return anchor in self._by_slug or anchor in self._ids
+
+    def slug(self, line: int) -> Optional[str]:
+        """
+        Returns the slug of the heading on a line, or None if the line is not a heading.
+        """
+        anchor = self._by_line.get(line)
+        return anchor["slug"] if anchor else None
+
+    def find(self, anchor: str) -> Optional[Anchor]:
+        """
+        Returns the heading an anchor (e.g. "#intro-1") points at, or None.
+        """
+        return self._by_slug.get(unquote(anchor[1:] if anchor.startswith("#") else anchor))
+
+
+def heading_index(lines: List[str] | Document) -> HeadingIndex:
+    """
+    Builds the heading/anchor index of a document: all headings outside code blocks and comments,
+    and the explicit HTML ids.
+
+    Args:
+        lines (List[str] or Document): A list of strings, each representing a line of text, or
+            an already classified document.
+
+    Returns:
+        the index
+    """
+    doc = _as_document(lines)
+    ids = [
+        m.group(1)
+        for i, line in enumerate(doc.lines)
+        if "id=" in line and not doc.kind(i) & _NOT_CONTENT
+        for m in _ID_RE.finditer(line)
+    ]
+    return HeadingIndex(doc.headings, ids)
+
+
+def broken_anchor_links(
+    lines: List[str] | Document, index: Optional[HeadingIndex] = None
+) -> List[Tuple[int, str]]:
+    """
+    Finds internal links (`[text](#anchor)`, `href="#anchor"`) that do not match any heading or id.
 
+    Args:
+        lines (List[str] or Document): A list of strings, each representing a line of text, or
+            an already classified document.
+        index (HeadingIndex): the document's index, built if not given
 
-def find_toc_marker(lines: List[str]) -> Optional[TocMarker]:
+    Returns:
+        a list of (line number, anchor) pairs
     """
-    Searches a list of lines for a table of contents marker. of the form
+    doc = _as_document(lines)
+    index = index if index is not None else heading_index(doc)
+    broken = []
+    for i, line in enumerate(doc.lines):
+        if "#" not in line or doc.kind(i) & _NOT_CONTENT:
+            continue
+        for m in _ANCHOR_LINK_RE.finditer(line):
+            anchor = m.group(1) or m.group(2)
+            if anchor not in index:
+                broken.append((i, anchor))
+    return broken
+
+
+def _as_document(lines: List[str] | Document) -> Document:
+    return lines if isinstance(lines, Document) else Document(lines)
+
+
+def find_toc_marker(lines: List[str] | Document) -> Optional[TocMarker]:
+    """
+    Searches a document for a table of contents marker. of the form
     ```toc
     min_depth: 1
     max_depth: 2
     ```
 
     Args:
-        lines (List[str]): A list of strings, each representing a line of text.
+        lines (List[str] or Document): A list of strings, each representing a line of text, or
+            an already classified document.
 
     Returns:
-        TOC dict if found and parsed, else None
+        TOC dict if found and parsed, else None. start_line and end_line are the opening and
+        closing fence lines.
 
     Raises:
         a value error if the TOC block is too long
-    logger.info("Searching for TOC marker...")
 
     """
     logger.info("Searching for TOC marker...")
-    toc: Optional[TocMarker] = None
-    docstate = MdState()
-
-    for i, line in enumerate(lines):
-        line = line.strip()
-        docstate.process_line(line)
-        if not toc and docstate.in_code_block and docstate.code_block_type == "toc":
-            toc = {"start_line": i, "end_line": i, "min_depth": 1, "max_depth": 3}
-        elif toc:
-            if not docstate.in_code_block:
-                toc["end_line"] = i
-                if toc["end_line"] - toc["start_line"] > 5:
-                    msg = f"TOC marker block is too long (lines {toc['start_line'] + 1}–{toc['end_line'] + 1})."
-                    logger.error(msg)
-                    raise ValueError(msg)
-                return toc
-            else:
-                match = _TOC_DEPTH_RE.match(line)
-                if match and toc:
-                    key, value = match.groups()
-                    toc[key] = int(value)
+    doc = _as_document(lines)
+
+    for fence in doc.fences("toc"):
+        start, end = fence["start"], fence["end"]
+        if end == start or not doc.lines[end].strip().startswith("```"):
+            # Unterminated fence
+            return None
+        if end - start > 4:
+            msg = f"TOC marker block is too long (lines {start + 1}–{end + 1})."
+            logger.error(msg)
+            raise ValueError(msg)
+        toc: TocMarker = {"start_line": start, "end_line": end, "min_depth": 1, "max_depth": 3}
+        for line in doc.lines[start + 1 : end]:
+            match = _TOC_DEPTH_RE.match(line.strip())
+            if match:
+                key, value = match.groups()
+                toc[key] = int(value)
+        return toc
     return None
 
 
-def build_heading_map(lines: List[str], toc: TocMarker) -> dict[int, tuple[int, str]]:
+def build_heading_map(
+    lines: List[str] | Document, toc: TocMarker
+) -> dict[int, tuple[int, str]]:
     """
-    Extracts a heading "map" from a markdown file.
+    Extracts a heading "map" from a markdown file. Only headings after the TOC marker and
+    within its depth range are included; lines in code blocks and comments are not headings.
 
-    logger.info(f"Building heading map, starting after line {toc['end_line'] + 1}.")
     Args:
-        lines (List[str]): A list of strings, each representing a line of text.
-        if line_number <= toc["end_line"]:
+        lines (List[str] or Document): A list of strings, each representing a line of text, or
+            an already classified document.
+        toc (TocMarker): the TOC marker
 
     Returns:
         a map (dictionary) of line number :: (depth, heading text)
 
     """
-    logger.info(f"Building heading map, starting after line {toc['end_line'] + 1}.")
-    heading_map = {}
-    for line_number, line in enumerate(lines):
-        if line_number <= toc["end_line"]:
-            continue
-        match = re.match(r"^(#+)\s*(.*?)\s*#*\s*$", line)
-        if match:
-            depth = len(match.group(1))
-            if depth < toc["min_depth"] or depth > toc["max_depth"]:
-                continue
-            heading_text = match.group(2).strip()
-            heading_map[line_number] = (depth, heading_text)
-    logger.info(f"Found {len(heading_map)} headings matching depth criteria.")
+    logger.info("Building heading map, starting after line %s.", toc["end_line"] + 1)
+    doc = _as_document(lines)
+    heading_map = {
+        h["line"]: (h["depth"], h["text"])
+        for h in doc.headings
+        if h["line"] > toc["end_line"] and toc["min_depth"] <= h["depth"] <= toc["max_depth"]
+    }
+    logger.info("Found %s headings matching depth criteria.", len(heading_map))
+    profiler.count("toc.headings", len(heading_map))
     return heading_map
 
 
-def new_toc_from_map(heading_map: dict[int, tuple[int, str]]) -> List[str]:
+def heading_slugs(heading_map: dict[int, tuple[int, str]]) -> dict[int, str]:
+    """
+    Computes the link slug of every heading in a heading map, de-duplicated within the map.
+    See toc_slugs for slugs that match the ids of a whole document.
+
+    Args:
+        heading_map (dict[int, tuple[int, str]]): a map (dictionary) of line number
+
+    Returns:
+        a map (dictionary) of line number :: slug
+
+    """
+    used: set = set()
+    return {line: _unique(slugify(text), used) for line, (_, text) in heading_map.items()}
+
+
+def toc_slugs(
+    lines: List[str] | Document, toc: TocMarker, heading_map: dict[int, tuple[int, str]]
+) -> dict[int, str]:
+    """
+    Computes the slugs of the TOC headings as pandoc will see them once the TOC is in place:
+    de-duplicated against all the headings of the document (not only those in the TOC depth
+    range), including the TOC's own title.
+
+    Args:
+        lines (List[str] or Document): the document, with the TOC marker
+        toc (TocMarker): the TOC marker
+        heading_map (dict[int, tuple[int, str]]): the TOC headings (see build_heading_map)
+
+    Returns:
+        a map (dictionary) of line number :: slug
+
+    """
+    doc = _as_document(lines)
+    headings = [h for h in doc.headings if h["line"] < toc["start_line"]]
+    headings.append(Heading(line=toc["start_line"], depth=2, text=_TOC_TITLE))
+    headings += [h for h in doc.headings if h["line"] > toc["end_line"]]
+    index = HeadingIndex(headings)
+    return {line: index.slug(line) for line in heading_map}
+
+
+def _toc_entry(depth: int, text: str, target: str) -> str:
+    return "    " * (depth - 1) + f"- [{text}]({target})\n"
+
+
+def new_toc_from_map(
+    heading_map: dict[int, tuple[int, str]],
+    link_prefix: str = "#",
+    slugs: Optional[dict[int, str]] = None,
+) -> List[str]:
     """
     Builds a new hyperlinked TOC from the heading map
 
     Args:
         heading_map (dict[int, tuple[int, str]]): a map (dictionary) of line number
+        link_prefix (str): put in front of each slug to make the link target
+        slugs (dict[int, str]): the slug of each heading (see toc_slugs). Defaults to slugs
+            de-duplicated within the heading map.
 
     Returns:
         a line list of the new TOC
 
     """
-    logger.info(f"Generating navigable TOC from a map of {len(heading_map)} headings.")
-    new_toc_lines = ["## Table of Contents\n", "\n"]
-    slug_counts = {}
+    logger.info("Generating navigable TOC from a map of %s headings.", len(heading_map))
+    new_toc_lines = [f"## {_TOC_TITLE}\n", "\n"]
+    if slugs is None:
+        slugs = heading_slugs(heading_map)
 
     for line_number, (depth, heading_text) in heading_map.items():
-        prefix = "    " * (depth - 1) + "- "
-
-        # to lower; remove anything not alphanumeric, space, or hyphen; replace spaces with hyphens
-        base_slug = heading_text.lower()
-        base_slug = re.sub(r"[^\w\s-]", "", base_slug)
-        base_slug = re.sub(r"\s+", "-", base_slug)
-
-        # Handle duplicate slugs to ensure unique links, similar to GitHub
-        count = slug_counts.get(base_slug, 0)
-        slug_counts[base_slug] = count + 1
-        if count > 0:
-            slug = f"{base_slug}-{count}"
-            logger.info(f"Found duplicate slug: {slug}. Appended count.")
-        else:
-            slug = base_slug
-
-        line = prefix + f"[{heading_text}](#{slug})\n"
-        new_toc_lines.append(line)
+        new_toc_lines.append(_toc_entry(depth, heading_text, link_prefix + slugs[line_number]))
 
-    logger.info(f"Generated {len(new_toc_lines)} TOC entries")
+    logger.info("Generated %s TOC entries", len(new_toc_lines))
     return new_toc_lines
 
 
-def build_toc(lines: List[str]) -> List[str]:
+@profiler.timed("toc")
+def apply_toc(doc: Document, link_prefix: str = "#") -> Document:
     """
-    Builds a table of contents from a list of strings from a markdown file
-    It replaces the Obsidian plugin YAML toc marker with a TOC that remains
-    navigable after conversion to HTML
+    Replaces the Obsidian plugin YAML toc marker in a document with a TOC that remains
+    navigable after conversion to HTML. The document is edited in place.
 
     Args:
-        lines (List[str]): A list of strings, each representing a line of text.
+        doc (Document): the document
+        link_prefix (str): put in front of each heading slug to make the link target
 
     Returns:
-        a line list. Either empty if nothing found, or updated with the TOC
+        the same document, for chaining
 
     """
     logger.info("Starting TOC build process.")
-    toc = find_toc_marker(lines)
+    toc = find_toc_marker(doc)
     if not toc:
         logger.warning("TOC build process aborted: No TOC marker found.")
-        return lines
+        return doc
 
-    hm = build_heading_map(lines, toc)
+    hm = build_heading_map(doc, toc)
     if not hm:
         logger.warning("No headings found. TOC will be empty.")
 
-    new_toc = new_toc_from_map(hm)
+    # The blank line ends the TOC list before whatever follows the marker
+    new_toc = new_toc_from_map(hm, link_prefix, toc_slugs(doc, toc, hm))
+    doc.replace(toc["start_line"], toc["end_line"] + 1, new_toc + ["\n"])
+    logger.info("Successfully built new content with updated TOC.")
+    return doc
 
-    # Reconstruct the file content by taking lines before the marker,
-    # inserting the new TOC, and appending lines after the marker.
-    pre_toc_lines = lines[: toc["start_line"]]
-    post_toc_lines = lines[toc["end_line"] + 1 :]
 
-    logger.info("Successfully built new content with updated TOC.")
-    return pre_toc_lines + new_toc + post_toc_lines
+def build_toc(lines: List[str]) -> List[str]:
+    """
+    Builds a table of contents from a list of strings from a markdown file
+    It replaces the Obsidian plugin YAML toc marker with a TOC that remains
+    navigable after conversion to HTML
+
+    Args:
+        lines (List[str]): A list of strings, each representing a line of text.
+
+    Returns:
+        a line list. Either unchanged if no marker found, or updated with the TOC
+
+    """
+    return apply_toc(Document(lines)).lines
+
+
+def iter_toc(
+    lines: Iterable[str], link_prefix: str = "#", spool_bytes: int = _SPOOL_BYTES
+) -> Iterator[str]:
+    """
+    The streaming counterpart of apply_toc: yields the lines with the TOC marker replaced by the
+    same TOC. The lines before the marker are passed on as they arrive. From the marker on, the
+    lines are spooled while the TOC entries are generated (into a second spool), and both are
+    replayed once the input is exhausted. Each spool is kept in memory up to spool_bytes, then
+    moves to a temporary file, so only the slugs already used stay in memory, however large the
+    document.
+
+    Args:
+        lines (Iterable[str]): the markdown lines (any iterator of lines)
+        link_prefix (str): put in front of each heading slug to make the link target
+        spool_bytes (int): the memory budget of each spool
+
+    Yields:
+        the lines, with the TOC in place of the marker
+
+    Raises:
+        a value error if the TOC block is too long
+    """
+    logger.info("Starting streaming TOC build.")
+    classified = enumerate(classify(lines))
+    # Slugs are de-duplicated in document order, as in HeadingIndex
+    used: set = set()
+    in_fence = False
+    start = None
+    for i, (line, kind) in classified:
+        if not kind & CODE:
+            in_fence = False
+            if kind & HEADING:
+                _unique(slugify(parse_heading(line)[1]), used)
+        elif line.strip().startswith("```"):
+            # Inside a code block, the only fence lines are its opening and closing lines
+            in_fence = not in_fence
+            if in_fence and _FENCE_LANG_RE.match(line.strip()).group(1) == "toc":
+                start = i
+                break
+        yield line
+    if start is None:
+        logger.warning("TOC build process aborted: No TOC marker found.")
+        return
+
+    toc: TocMarker = {"start_line": start, "end_line": start, "min_depth": 1, "max_depth": 3}
+    _unique(slugify(_TOC_TITLE), used)
+    entries = 0
+    # Binary, so that positions stay valid when a spool moves from memory to a file
+    with (
+        tempfile.SpooledTemporaryFile(max_size=spool_bytes, mode="w+b") as spool,
+        tempfile.SpooledTemporaryFile(max_size=spool_bytes, mode="w+b") as toc_spool,
+    ):
+        spool.write(line.encode("utf-8"))
+        end = None
+        for i, (line, kind) in classified:
+            spool.write(line.encode("utf-8"))
+            if end is not None:
+                if kind & HEADING:
+                    depth, text = parse_heading(line)
+                    slug = _unique(slugify(text), used)
+                    if toc["min_depth"] <= depth <= toc["max_depth"]:
+                        toc_spool.write(_toc_entry(depth, text, link_prefix + slug).encode("utf-8"))
+                        entries += 1
+            elif line.strip().startswith("```"):
+                end = i
+                resume = spool.tell()
+            else:
+                match = _TOC_DEPTH_RE.match(line.strip())
+                if match:
+                    key, value = match.groups()
+                    toc[key] = int(value)
+        profiler.count("toc.spooled_bytes", spool.tell() + toc_spool.tell())
+
+        if end is None:
+            # Unterminated fence
+            logger.warning("TOC build process aborted: No TOC marker found.")
+            resume = 0
+        elif end - start > 4:
+            msg = f"TOC marker block is too long (lines {start + 1}–{end + 1})."
+            logger.error(msg)
+            raise ValueError(msg)
+        else:
+            logger.info("Found %s headings matching depth criteria.", entries)
+            profiler.count("toc.headings", entries)
+            if not entries:
+                logger.warning("No headings found. TOC will be empty.")
+            yield f"## {_TOC_TITLE}\n"
+            yield "\n"
+            toc_spool.seek(0)
+            for raw in toc_spool:
+                yield raw.decode("utf-8")
+            # The blank line ends the TOC list before whatever follows the marker
+            yield "\n"
+        spool.seek(resume)
+        for raw in spool:
+            yield raw.decode("utf-8")
@@ -0,0 +1,306 @@
+"""
+Filename: vaultindex.py
+
+Author: mg4news
+
+Date: 2025-09-02
+
+License: Unlicense
+
+Description:
+    Vault wide index of markdown notes and image attachments. Walks the vault once and maps note
+    names, aliases and case-folded names to paths, so that wiki links and image embeds resolve
+    anywhere in the vault (like Obsidian)
+    without a filesystem stat per link. The index is persisted to a JSON cache file keyed on
+    directory mtimes, and refreshed incrementally: only directories whose mtime changed are re-listed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Dict, List, Optional
+from textwrench.cachedir import cache_dir
+from textwrench import profiler
+from textwrench.document import IMAGE_EXTENSIONS
+
+logger = logging.getLogger(__name__)
+
+_CACHE_VERSION = 2
+_NOTE_SUFFIX = ".md"
+_ALIAS_KEY_RE = re.compile(r"^(aliases|alias)\s*:\s*(.*)$")
+_LIST_ITEM_RE = re.compile(r"^\s*-\s*(.+?)\s*$")
+_MAX_FRONT_MATTER_LINES = 50
+
+
+def _strip_quotes(value: str) -> str:
+    return value.strip().strip("\"'").strip()
+
+
+def read_aliases(filepath: Path) -> List[str]:
+    """
+    Reads the aliases from the YAML front matter of a note. Supports the inline form
+    `aliases: [a, b]`, the single value form `alias: a` and the block list form.
+
+    Args:
+        filepath (Path): the note to read
+
+    Returns:
+        a list of aliases, empty if there is no front matter or no aliases
+    """
+    aliases: List[str] = []
+    try:
+        with open(filepath, "r") as f:
+            if f.readline().strip() != "---":
+                return aliases
+            in_list = False
+            for _ in range(_MAX_FRONT_MATTER_LINES):
+                line = f.readline()
+                if not line or line.strip() == "---":
+                    break
+                match = _ALIAS_KEY_RE.match(line.strip())
+                if match:
+                    value = match.group(2).strip()
+                    in_list = not value
+                    if value.startswith("[") and value.endswith("]"):
+                        value = value[1:-1]
+                    aliases.extend(_strip_quotes(v) for v in value.split(",") if v.strip())
+                    continue
+                item = _LIST_ITEM_RE.match(line) if in_list else None
+                if item:
+                    aliases.append(_strip_quotes(item.group(1)))
+                else:
+                    in_list = False
+    except (OSError, UnicodeDecodeError) as e:
+        logger.warning("Could not read aliases from %s: %s", filepath, e)
+    return aliases
+
+
+def find_vault_root(start: Path) -> Optional[Path]:
+    """
+    Finds the Obsidian vault containing a directory, i.e. the closest ancestor with a `.obsidian` folder.
+
+    Args:
+        start (Path): the directory to start from
+
+    Returns:
+        the vault root, or None if the directory is not inside a vault
+    """
+    for candidate in (start, *start.parents):
+        if (candidate / ".obsidian").is_dir():
+            return candidate
+    return None
+
+
+class VaultIndex:
+
+    def __init__(self, root: str | Path, cache_file: str | Path | None = None) -> None:
+        """
+        Initialize a vault index. Loads the persisted index if there is one; call refresh()
+        to bring it up to date.
+
+        Args:
+            root (str or Path object): the root directory of the vault
+            cache_file (str or Path object): where to persist the index. Defaults to a file
+                named after the vault root in the textwrench cache directory
+        """
+        self.root = Path(root).resolve()
+        if cache_file:
+            self.cache_file = Path(cache_file)
+        else:
+            key = hashlib.sha256(str(self.root).encode()).hexdigest()[:16]
+            self.cache_file = cache_dir("vaults") / f"{self.root.name}-{key}.json"
+
+        # relative dir -> {"mtime": ns, "subdirs": [...], "notes": {filename: [aliases]},
+        #                  "attachments": [filename, ...]}
+        self._dirs: Dict[str, dict] = {}
+        self._by_name: Dict[str, List[str]] = {}
+        self._by_fold: Dict[str, List[str]] = {}
+        self._by_alias: Dict[str, List[str]] = {}
+        self._by_path: Dict[str, str] = {}
+        self._attachments: Dict[str, List[str]] = {}
+        self.dirs_scanned = 0
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._by_path)
+
+    def _load(self):
+        try:
+            with open(self.cache_file, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("version") == _CACHE_VERSION and data.get("root") == str(self.root):
+            self._dirs = data.get("dirs", {})
+            logger.info("Loaded vault index for %s: %s directories", self.root, len(self._dirs))
+
+    def save(self):
+        """
+        Persists the index to the cache file.
+        """
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_file.with_suffix(".tmp")
+        with open(tmp, "w") as f:
+            json.dump(
+                {"version": _CACHE_VERSION, "root": str(self.root), "dirs": self._dirs}, f
+            )
+        os.replace(tmp, self.cache_file)
+        logger.info("Saved vault index: %s", self.cache_file)
+
+    def _scan_dir(self, rel: str, path: Path, mtime: int) -> dict:
+        subdirs = []
+        notes = {}
+        attachments = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.name.endswith(_NOTE_SUFFIX) and entry.is_file():
+                    # Aliases are re-read for notes in a changed directory only
+                    notes[entry.name] = read_aliases(Path(entry.path))
+                elif entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file():
+                    attachments.append(entry.name)
+        self.dirs_scanned += 1
+        profiler.count("vaultindex.dirs_scanned")
+        profiler.count("vaultindex.notes_scanned", len(notes))
+        logger.debug("Scanned %s: %s notes", path, len(notes))
+        return {
+            "mtime": mtime,
+            "subdirs": sorted(subdirs),
+            "notes": notes,
+            "attachments": sorted(attachments),
+        }
+
+    def refresh(self, full: bool = False) -> "VaultIndex":
+        """
+        Brings the index up to date. Each known directory is stat'ed once; only directories
+        whose mtime changed (or new directories) are listed again. Note that editing a note in place
+        does not change its directory mtime, so use full=True to pick up edited aliases.
+
+        Args:
+            full (bool): ignore the persisted state and re-walk the whole vault
+
+        Returns:
+            the index itself, for chaining
+        """
+        if full:
+            self._dirs = {}
+        self.dirs_scanned = 0
+        dirs: Dict[str, dict] = {}
+        pending = [""]
+        while pending:
+            rel = pending.pop()
+            path = self.root / rel if rel else self.root
+            try:
+                mtime = path.stat().st_mtime_ns
+            except OSError:
+                continue
+            profiler.count("vaultindex.stat")
+            known = self._dirs.get(rel)
+            if known is None or known["mtime"] != mtime:
+                known = self._scan_dir(rel, path, mtime)
+            dirs[rel] = known
+            pending.extend(f"{rel}/{d}" if rel else d for d in known["subdirs"])
+
+        changed = self.dirs_scanned > 0 or dirs.keys() != self._dirs.keys()
+        self._dirs = dirs
+        self._build_maps()
+        logger.info(
+            "Vault index refreshed: %s notes in %s directories, %s directories scanned",
+            len(self),
+            len(dirs),
+            self.dirs_scanned,
+        )
+        if changed:
+            self.save()
+        return self
+
+    def _build_maps(self):
+        self._by_name = {}
+        self._by_fold = {}
+        self._by_alias = {}
+        self._by_path = {}
+        self._attachments = {}
+        for rel, info in self._dirs.items():
+            for filename in info["attachments"]:
+                relpath = f"{rel}/{filename}" if rel else filename
+                self._attachments.setdefault(filename.casefold(), []).append(relpath)
+            for filename, aliases in info["notes"].items():
+                stem = filename[: -len(_NOTE_SUFFIX)]
+                relpath = f"{rel}/{filename}" if rel else filename
+                self._by_path[relpath[: -len(_NOTE_SUFFIX)].casefold()] = relpath
+                self._by_name.setdefault(stem, []).append(relpath)
+                self._by_fold.setdefault(stem.casefold(), []).append(relpath)
+                for alias in aliases:
+                    self._by_alias.setdefault(alias.casefold(), []).append(relpath)
+
+    def _best(self, candidates: List[str], near: Optional[Path]) -> str:
+        if len(candidates) > 1 and near is not None:
+            try:
+                near_rel = str(near.resolve().relative_to(self.root))
+            except ValueError:
+                near_rel = None
+            for c in candidates:
+                if str(Path(c).parent) == near_rel:
+                    return c
+        # Obsidian prefers the shortest path when a name is ambiguous
+        return min(candidates, key=lambda c: (c.count("/"), c))
+
+    def lookup(self, name: str, near: Optional[Path] = None) -> Optional[Path]:
+        """
+        Resolves a wiki link target to a note path. Tries, in order: a vault relative path
+        (`folder/note`), the exact note name, the case-folded note name and the aliases.
+        Heading and block references (`note#heading`) are ignored.
+
+        Args:
+            name (str): the link target
+            near (Path): the directory of the linking document, preferred when a name is ambiguous
+
+        Returns:
+            the absolute path of the note, or None if not found
+        """
+        name = name.split("#", 1)[0].strip()
+        if name.endswith(_NOTE_SUFFIX):
+            name = name[: -len(_NOTE_SUFFIX)]
+        if not name:
+            return None
+
+        found = None
+        if "/" in name:
+            found = self._by_path.get(name.strip("/").casefold())
+        else:
+            for table, key in (
+                (self._by_name, name),
+                (self._by_fold, name.casefold()),
+                (self._by_alias, name.casefold()),
+            ):
+                candidates = table.get(key)
+                if candidates:
+                    found = self._best(candidates, near)
+                    break
+        return self.root / found if found else None
+
+    def lookup_attachment(self, name: str, near: Optional[Path] = None) -> Optional[Path]:
+        """
+        Resolves an embedded attachment (e.g. `![[image.png]]`) by file name, anywhere in the vault.
+
+        Args:
+            name (str): the attachment file name, optionally with a vault relative folder
+            near (Path): the directory of the linking document, preferred when a name is ambiguous
+
+        Returns:
+            the absolute path of the attachment, or None if not found
+        """
+        name = name.strip().strip("/")
+        candidates = self._attachments.get(Path(name).name.casefold())
+        if not candidates:
+            return None
+        if "/" in name:
+            matches = [c for c in candidates if c.casefold() == name.casefold()]
+            return self.root / matches[0] if matches else None
+        return self.root / self._best(candidates, near)
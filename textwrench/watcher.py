@@ -0,0 +1,286 @@
+"""
+Filename: watcher.py
+
+Author: mg4news
+
+Date: 2025-09-11
+
+License: Unlicense
+
+Description:
+    Watch mode. Builds the root documents once, recording what each one was built from, then polls
+    those files with stat only (no external services). When files change it waits for the edits to
+    settle (debounce) and rebuilds only the affected root documents.
+    The directories of each root, of the files it was built from and of its vault are watched too,
+    so a file created later rebuilds the roots that link to (or embed) its name, e.g. the note a
+    dangling [[link]] was waiting for. A vault is walked once; its folders are then kept current
+    from the listings of the folders it already had. A rebuild re-runs the whole pipeline; only
+    the file contents are kept between builds (in the shared content cache of PathMgr), not the
+    assembled document.
+"""
+
+import copy
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+from textwrench.depgraph import DepGraph
+from textwrench.document import Document
+from textwrench.imgfix import image_refs
+from textwrench.pathmgr import PathMgr
+from textwrench.vaultindex import find_vault_root
+
+logger = logging.getLogger(__name__)
+
+_Stamp = Optional[Tuple[int, int]]
+
+
+def _stamp(path: str) -> _Stamp:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _listing(directory: str) -> FrozenSet[str]:
+    try:
+        return frozenset(os.listdir(directory))
+    except OSError:
+        return frozenset()
+
+
+def _vault_dirs(root: Path) -> Set[str]:
+    # Every directory of a vault, except hidden ones (.obsidian, .git, ...)
+    dirs = set()
+    for parent, subdirs, _ in os.walk(root):
+        subdirs[:] = [d for d in subdirs if not d.startswith(".")]
+        dirs.add(parent)
+    return dirs
+
+
+def _references(paths: Iterable[str]) -> Tuple[Set[str], Set[str]]:
+    # The (case-folded) file names that the wiki links and images of markdown files point at (a
+    # link to a note also names `<note>.md`), and the directories relative image paths point into
+    names, dirs = set(), set()
+    for path in paths:
+        if not path.endswith(".md"):
+            continue
+        try:
+            doc = Document(PathMgr(Path(path).parent).read_lines(Path(path).name))
+        except (OSError, UnicodeDecodeError):
+            continue
+        for link in doc.wiki_links:
+            name = Path(link["target"].split("#", 1)[0].strip()).name.casefold()
+            names.update((name, f"{name}.md"))
+        for i in doc.image_lines:
+            for target, _ in image_refs(doc.lines[i]):
+                names.add(Path(target).name.casefold())
+                if "://" not in target:
+                    dirs.add(os.path.normpath(Path(path).parent / Path(target).parent))
+    return names, dirs
+
+
+class Watcher:
+
+    def __init__(
+        self,
+        roots: Iterable[Path],
+        args,
+        build: Callable,
+        interval: float = 1.0,
+        debounce: float = 0.5,
+    ) -> None:
+        """
+        Initialize a watcher.
+
+        Args:
+            roots (Iterable[Path]): the root documents to build
+            args: the parsed command line arguments, copied per build with `inp` set to the root
+            build (Callable): the pipeline, called with the build arguments. Returns the set
+                of files the document was built from.
+            interval (float): seconds between polls
+            debounce (float): seconds without further changes before rebuilding
+        """
+        self.roots = [str(Path(r).resolve()) for r in roots]
+        self.args = args
+        self.build = build
+        self.interval = interval
+        self.debounce = debounce
+        self.graph = DepGraph()
+        self._stamps: Dict[str, _Stamp] = {}
+        # Per root: the directories watched for new files, its vault, and the file names it refers
+        # to. The directories of a vault are walked once, then kept current as listings change.
+        self._root_dirs: Dict[str, Set[str]] = {}
+        self._vault_of: Dict[str, Optional[str]] = {}
+        self._vault_dirs: Dict[str, Set[str]] = {}
+        self._names: Dict[str, Set[str]] = {}
+        self._dir_stamps: Dict[str, _Stamp] = {}
+        self._listings: Dict[str, FrozenSet[str]] = {}
+
+    def _build(self, root: str):
+        args = copy.copy(self.args)
+        args.inp = root
+        start = time.monotonic()
+        try:
+            deps = self.build(args) or set()
+        except Exception as e:
+            # Keep watching; the previous dependencies still tell us when to retry
+            logger.error("Build failed for %s: %s", root, e)
+            deps = self.graph.deps(root)
+        self.graph.set_deps(root, deps)
+        for path in self.graph.deps(root):
+            if path not in self._stamps:
+                self._stamps[path] = _stamp(path)
+        self._watch_dirs(root)
+        logger.info("Built %s in %.2fs", root, time.monotonic() - start)
+
+    def _watch_dirs(self, root: str):
+        deps = self.graph.deps(root) | {root}
+        dirs = {os.path.dirname(path) for path in deps}
+        vault = getattr(self.args, "vault", None) or find_vault_root(Path(root).parent)
+        vault = str(Path(vault).resolve()) if vault else None
+        if vault and vault not in self._vault_dirs:
+            self._vault_dirs[vault] = _vault_dirs(Path(vault))
+        self._vault_of[root] = vault
+        self._names[root], image_dirs = _references(deps)
+        self._root_dirs[root] = dirs | image_dirs
+        self._sync_listings()
+
+    def _watched(self, root: str) -> Set[str]:
+        return self._root_dirs[root] | self._vault_dirs.get(self._vault_of[root], set())
+
+    def _sync_listings(self) -> Set[str]:
+        # Lists the directories that are newly watched, and forgets those no root watches any more
+        # (and vaults no root is in). Returns the new directories.
+        for vault in self._vault_dirs.keys() - set(self._vault_of.values()):
+            del self._vault_dirs[vault]
+        watched = set().union(*(self._watched(root) for root in self._root_dirs))
+        new = watched - self._listings.keys()
+        for directory in new:
+            self._dir_stamps[directory] = _stamp(directory)
+            self._listings[directory] = _listing(directory)
+        for directory in self._listings.keys() - watched:
+            del self._listings[directory]
+            del self._dir_stamps[directory]
+        return new
+
+    def _update_vaults(self, directory: str, added: Iterable[str], removed: Iterable[str]) -> bool:
+        # Adds the (non hidden) subdirectories created in a vault directory, with their own
+        # subdirectories, and drops the removed ones. Returns True if a vault changed.
+        updated = False
+        for dirs in self._vault_dirs.values():
+            if directory not in dirs:
+                continue
+            for name in added:
+                path = os.path.join(directory, name)
+                if not name.startswith(".") and os.path.isdir(path):
+                    dirs |= _vault_dirs(Path(path))
+                    updated = True
+            for name in removed:
+                path = os.path.join(directory, name)
+                gone = {d for d in dirs if d == path or d.startswith(path + os.sep)}
+                dirs -= gone
+                updated = updated or bool(gone)
+        return updated
+
+    def build_all(self):
+        """
+        Builds every root document and records its dependencies.
+        """
+        for root in self.roots:
+            self._build(root)
+
+    def poll(self) -> Set[str]:
+        """
+        Stats every watched file and directory once.
+
+        Returns:
+            the files whose mtime or size changed (or that appeared or disappeared) since the last
+            poll, and the roots that refer to the name of a file created since then
+        """
+        changed = set()
+        for path in self.graph.files():
+            stamp = _stamp(path)
+            if stamp != self._stamps.get(path):
+                self._stamps[path] = stamp
+                changed.add(path)
+        # Forget files nothing depends on any more
+        for path in set(self._stamps) - self.graph.files():
+            del self._stamps[path]
+        return changed | self._poll_dirs()
+
+    def _poll_dirs(self) -> Set[str]:
+        # Stats every watched directory; for those that changed, matches the names of the new
+        # entries against the names each root refers to. Returns the roots to rebuild.
+        created: Dict[str, Set[str]] = {}
+        updated = False
+        for directory in list(self._listings):
+            stamp = _stamp(directory)
+            if stamp == self._dir_stamps.get(directory):
+                continue
+            self._dir_stamps[directory] = stamp
+            listing = _listing(directory)
+            new, gone = listing - self._listings[directory], self._listings[directory] - listing
+            self._listings[directory] = listing
+            if new:
+                created[directory] = {name.casefold() for name in new}
+            if self._update_vaults(directory, new, gone):
+                updated = True
+        if updated:
+            # Everything in a new directory is new, e.g. a folder of notes moved into the vault
+            for directory in self._sync_listings():
+                created[directory] = {name.casefold() for name in self._listings[directory]}
+        roots = set()
+        for root in self._root_dirs:
+            dirs = self._watched(root)
+            if any(names & self._names[root] for d, names in created.items() if d in dirs):
+                roots.add(root)
+        return roots
+
+    def rebuild(self, changed: Set[str]) -> List[str]:
+        """
+        Rebuilds the root documents affected by a set of changed files.
+
+        Args:
+            changed (Set[str]): the changed files (see poll)
+
+        Returns:
+            the rebuilt root documents
+        """
+        affected = sorted(self.graph.affected_roots(changed) | (changed & set(self.roots)))
+        logger.info("%s files changed, rebuilding %s documents", len(changed), len(affected))
+        for root in affected:
+            self._build(root)
+        return affected
+
+    def run(self, max_polls: Optional[int] = None):
+        """
+        Builds everything, then watches and rebuilds until interrupted.
+
+        Args:
+            max_polls (int): stop after this many polls (for testing). Defaults to forever.
+        """
+        self.build_all()
+        logger.info(
+            "Watching %s files for %s documents. Ctrl-C to stop.",
+            len(self._stamps),
+            len(self.roots),
+        )
+        changed: Set[str] = set()
+        last_change = 0.0
+        polls = 0
+        try:
+            while max_polls is None or polls < max_polls:
+                time.sleep(self.interval)
+                polls += 1
+                new = self.poll()
+                if new:
+                    changed |= new
+                    last_change = time.monotonic()
+                elif changed and time.monotonic() - last_change >= self.debounce:
+                    self.rebuild(changed)
+                    changed = set()
+        except KeyboardInterrupt:
+            logger.info("Watch stopped.")